@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+from contextlib import nullcontext
+
+from telegram import Message
+
+# Telegram допускает в альбоме не больше 10 элементов
+MAX_ALBUM_SIZE = 10
+
+
+class _Album:
+    __slots__ = ('chat_id', 'parts', 'deadline', 'on_complete', 'started', 'task')
+
+    def __init__(self, chat_id: int, on_complete, deadline: float):
+        self.chat_id = chat_id
+        self.parts = []
+        self.deadline = deadline
+        self.on_complete = on_complete
+        self.started = False
+        self.task = None
+
+
+class AlbumAggregator:
+    """
+    Собирает части альбома (media_group_id), которые приходят отдельными
+    обновлениями, и отдает их одной пачкой.
+
+    Альбом считается полным, когда в течение window секунд не пришло
+    новых частей или набралось 10 элементов. Тогда вызывается
+    on_complete(parts) первой части с частями в порядке message_id.
+    Фоновая пересылка идет под hold(chat_id) - блокировкой диалога.
+
+    Следующее сообщение того же чата не должно обогнать альбом: его
+    обработчик вызывает flush(), и ожидающие альбомы пересылаются сразу.
+    """
+
+    def __init__(self, window: float = 0.5, hold=None):
+        self.window = window
+        self.hold = hold or (lambda chat_id: nullcontext())
+        self._albums = {}
+        # chat_id -> альбомы чата в порядке первой части, пока не переслан последний
+        self._chats = {}
+        # Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+        self._tasks = set()
+
+    def __len__(self) -> int:
+        return len(self._albums)
+
+    def add(self, message: Message, on_complete) -> None:
+        key = message.media_group_id
+        album = self._albums.get(key)
+        if album is None:
+            album = self._albums[key] = _Album(message.chat_id, on_complete, time.monotonic() + self.window)
+            self._chats.setdefault(album.chat_id, []).append(album)
+            album.task = asyncio.create_task(self._wait_and_flush(key, album))
+            self._tasks.add(album.task)
+            album.task.add_done_callback(self._tasks.discard)
+        else:
+            album.deadline = time.monotonic() + self.window
+        album.parts.append(message)
+
+        if len(album.parts) >= MAX_ALBUM_SIZE:
+            album.deadline = 0
+
+    async def flush(self, chat_id: int, media_group_id: str = None) -> None:
+        """
+        Пересылает альбомы чата, кроме media_group_id, не дожидаясь окна.
+        Вызывающий уже держит блокировку диалога, поэтому пересылка идет в
+        его задаче; альбом, который уже пересылается в фоне, дожидаемся
+        """
+        for album in list(self._chats.get(chat_id, ())):
+            if album.started:
+                await asyncio.wait((album.task,))
+            elif album.parts[0].media_group_id != media_group_id:
+                await self._complete(album)
+
+    async def _wait_and_flush(self, key: str, album: _Album) -> None:
+        # Каждая новая часть отодвигает срок, поэтому спим, пока он не перестанет меняться
+        while (delay := album.deadline - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+        async with self.hold(album.chat_id):
+            # Пока ждали блокировку, альбом мог переслать flush() следующего сообщения
+            if not album.started:
+                await self._complete(album)
+
+    async def _complete(self, album: _Album) -> None:
+        album.started = True
+        key = album.parts[0].media_group_id
+        del self._albums[key]
+        album.parts.sort(key=lambda m: m.message_id)
+        try:
+            await album.on_complete(album.parts)
+        except Exception as e:
+            logging.error(f"Ошибка при пересылке альбома {key}: {e}")
+        finally:
+            albums = self._chats[album.chat_id]
+            albums.remove(album)
+            if not albums:
+                del self._chats[album.chat_id]
@@ -0,0 +1,107 @@
+"""
+Бенчмарк пакетного подбора (BatchMatcher) на большой очереди поиска.
+
+Очередь заполняется случайными пользователями (пол, фильтр, страна,
+возраст) с разным временем ожидания, после чего выполняется несколько
+проходов match_waiting() из main.py - целиком, как их делает бот: подбор,
+создание диалогов в хранилище, журнал событий и запуск уведомлений. Для
+каждого прохода выводятся его время, число пар, средняя оценка и доля
+разобранной очереди: если проход упирается в бюджет, часть пользователей
+остается на следующий запуск. Время на пару match_waiting оценивает по
+прошлым проходам, первый идет с начальной оценкой.
+
+Запуск: python benchmarks/bench_batch_matcher.py --users 10000 50000 100000 [--store sqlite]
+"""
+import argparse
+import asyncio
+import gc
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import events
+import main
+import settings
+from main import AGE_GROUPS
+from matchmaking import BatchMatcher, MatchQueue
+from storage import MemoryStore, SQLiteStore
+
+COUNTRIES = ['Россия', 'Украина', 'Беларусь', 'Казахстан', 'Другая']
+COUNTRY_WEIGHTS = [60, 15, 10, 10, 5]
+
+
+def fill_queue(matcher: BatchMatcher, users: int, max_wait: float, rng: random.Random) -> MatchQueue:
+    queue = MatchQueue(matcher)
+    now = time.monotonic()
+    for user_id in range(1, users + 1):
+        queue.add(
+            user_id,
+            rng.choice(('male', 'female')),
+            rng.choices((None, 'male', 'female'), (70, 15, 15))[0],
+            country=rng.choices(COUNTRIES, COUNTRY_WEIGHTS)[0],
+            age=rng.choice(AGE_GROUPS))
+    # Самые давние - в начале очереди
+    for n, entry in enumerate(queue):
+        entry.since = now - max_wait * (1 - n / users)
+    return queue
+
+
+async def tick(matcher: BatchMatcher, queue: MatchQueue) -> None:
+    tasks = []
+    # Уведомления не отправляются: задачи создаются, как в боте, и сразу отменяются
+    context = SimpleNamespace(application=SimpleNamespace(
+        create_task=lambda coroutine: tasks.append(asyncio.get_running_loop().create_task(coroutine))))
+    waiting = len(queue)
+    start = time.perf_counter()
+    paired = await main.match_waiting(context)
+    elapsed = time.perf_counter() - start
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    print(f"  проход {elapsed * 1000:.1f} мс, пар {paired} ({2 * paired / waiting:.0%} очереди), "
+          f"на пару {main.match_pair_cost * 1e6:.1f} мкс")
+
+
+def run(args) -> None:
+    rng = random.Random(args.seed)
+    print(f"Бюджет прохода {args.budget * 1000:.0f} мс, ожидание до {args.max_wait:.0f} с, "
+          f"смягчение каждые {args.relax_step:.0f} с, хранилище {args.store}")
+    directory = Path(tempfile.mkdtemp(prefix='bench-matcher-'))
+    for users in args.users:
+        matcher = BatchMatcher(AGE_GROUPS, args.country_weight, args.age_weight, args.relax_step, args.budget)
+        queue = fill_queue(matcher, users, args.max_wait, rng)
+        # Иначе в первый проход попадает полная сборка мусора после заполнения очереди
+        gc.collect()
+        if args.store == 'sqlite':
+            main.store = SQLiteStore(directory / f'bot-{users}.sqlite3')
+            main.store.open()
+        else:
+            main.store = MemoryStore()
+        main.active_searches = queue
+        main.event_log = events.EventLog(directory / 'events')
+        main.event_log.start()
+        main.match_pair_cost = 20e-6
+        print(f"\nочередь {users}:")
+        for _ in range(args.ticks):
+            asyncio.run(tick(matcher, queue))
+        main.event_log.close()
+        main.store.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, nargs='+', default=[10_000, 50_000, 100_000])
+    parser.add_argument('--budget', type=float, default=settings.MATCH_BUDGET, help='секунды')
+    parser.add_argument('--max-wait', type=float, default=60, help='ожидание самого давнего, секунды')
+    parser.add_argument('--relax-step', type=float, default=settings.MATCH_RELAX_STEP)
+    parser.add_argument('--country-weight', type=int, default=settings.MATCH_COUNTRY_WEIGHT)
+    parser.add_argument('--age-weight', type=int, default=settings.MATCH_AGE_WEIGHT)
+    parser.add_argument('--ticks', type=int, default=3, help='проходов на каждый размер очереди')
+    parser.add_argument('--store', choices=('memory', 'sqlite'), default='memory')
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
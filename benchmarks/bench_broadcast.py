@@ -0,0 +1,171 @@
+"""
+Бенчмарк рассылки (/broadcast) на фоне живых диалогов.
+
+Бот собирается как в main() и работает против локальной заглушки Bot API
+с лимитами отправки Telegram. Часть пользователей переписывается в
+диалогах, часть заблокировала бота. Сначала замеряется задержка
+пересылки без рассылки, затем администратор запускает рассылку всем. На
+середине бот "падает": состояние рассылки откатывается к последнему
+сохранению, бот запускается заново и продолжает рассылку сам.
+
+Отчет: достигнутая скорость рассылки, задержка пересылки в диалогах до
+и во время рассылки, сколько пользователей не получили сообщение или
+получили его дважды, сколько заблокировавших найдено.
+
+Запуск: python benchmarks/bench_broadcast.py --users 300 --rate 10 --dialogues 10
+"""
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import settings
+
+settings.METRICS_PORT = None
+
+import main
+from sender import BULK, SendScheduler
+from storage import MemoryStore
+
+from bench_load import describe
+from fake_bot_api import FakeBotAPI
+
+TOKEN = '123456:BROADCAST'
+ADMIN = 1_000
+TEXT = '📣 Объявление'
+
+
+def new_sender(args) -> SendScheduler:
+    return SendScheduler(global_rate=args.global_rate, global_burst=args.global_rate,
+                         chat_rate=settings.SEND_CHAT_RATE, chat_burst=settings.SEND_CHAT_BURST)
+
+
+async def start_bot(api: FakeBotAPI):
+    application = main.build_application(TOKEN, base_url=api.url, serve_mode='polling')
+    await application.initialize()
+    await application.updater.start_polling(poll_interval=0, timeout=1)
+    await application.start()
+    # Здесь же продолжается незавершенная рассылка
+    await application.post_init(application)
+    return application
+
+
+async def stop_bot(application) -> None:
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+
+
+async def chat(api: FakeBotAPI, user_id: int, think: float, rng: random.Random, stop: asyncio.Event) -> None:
+    # Паузы не короче think / 2: при think >= 2 с пересылка не упирается в лимит 1 сообщение/с на чат
+    while not stop.is_set():
+        api.push_message(user_id, f"сообщение от {user_id}")
+        await asyncio.sleep(think * rng.uniform(0.5, 1.5))
+
+
+async def run(args) -> None:
+    api = FakeBotAPI(TOKEN, latency=args.latency, jitter=args.jitter, seed=args.seed)
+    await api.start()
+    rng = random.Random(args.seed)
+    users = list(range(100_000, 100_000 + args.users))
+    api.blocked = set(rng.sample(users, int(len(users) * args.blocked)))
+    talkers = [u for u in users if u not in api.blocked][:2 * args.dialogues]
+
+    settings.ADMIN_IDS = (ADMIN,)
+    settings.BROADCAST_RATE = args.rate
+    settings.BROADCAST_STATE_PATH = str(Path(tempfile.mkdtemp(prefix='bench-broadcast-')) / 'broadcast.json')
+    settings.BROADCAST_CHECKPOINT_INTERVAL = args.checkpoint
+    main.store = MemoryStore()
+    for user_id in users:
+        main.store.save_user(user_id, {'gender': 'male', 'country': 'Россия', 'age': 'от 18 до 21 года'})
+    for a, b in zip(talkers[::2], talkers[1::2]):
+        main.store.link(a, b)
+    main.sender = new_sender(args)
+    application = await start_bot(api)
+
+    print(f"Пользователей {args.users} (заблокировали бота {len(api.blocked)}), диалогов {args.dialogues}, "
+          f"лимит отправки {args.global_rate:g}/с, рассылка {args.rate:g}/с, "
+          f"задержка API {args.latency * 1000:.0f}±{args.jitter * 1000:.0f} мс")
+
+    stop = asyncio.Event()
+    chats = [asyncio.create_task(chat(api, u, args.think, random.Random(u), stop)) for u in talkers]
+    await asyncio.sleep(args.baseline)
+    baseline = list(api.relay_latencies)
+
+    # Рассылка от администратора
+    start = time.perf_counter()
+    relayed = len(api.relay_latencies)
+    api.push_message(ADMIN, f'/broadcast {TEXT}')
+    while 'broadcast' not in application.bot_data:
+        await asyncio.sleep(0.05)
+    job = application.bot_data['broadcast']
+    max_bulk = 0
+    while job.processed < args.users // 2:
+        max_bulk = max(max_bulk, main.sender.stats()['queued_by_priority'][BULK])
+        await asyncio.sleep(0.1)
+
+    # Сбой: на диске остается последнее периодическое сохранение
+    state_path = Path(settings.BROADCAST_STATE_PATH)
+    crashed = state_path.read_bytes()
+    first_rate, first_processed = job.send_rate(), job.processed
+    during = api.relay_latencies[relayed:]
+    await stop_bot(application)
+    state_path.write_bytes(crashed)
+    restart = time.perf_counter()
+    main.sender = new_sender(args)
+    application = await start_bot(api)
+    restart = time.perf_counter() - restart
+
+    job = application.bot_data['broadcast']
+    while not job.state['done']:
+        max_bulk = max(max_bulk, main.sender.stats()['queued_by_priority'][BULK])
+        await asyncio.sleep(0.1)
+    elapsed = time.perf_counter() - start
+    second_rate = job.send_rate()
+    stop.set()
+    await asyncio.gather(*chats)
+    await stop_bot(application)
+    await api.stop()
+
+    received = {}
+    for user_id in users:
+        inbox = api.inbox(user_id)
+        while not inbox.empty():
+            if inbox.get_nowait().text == TEXT:
+                received[user_id] = received.get(user_id, 0) + 1
+    reachable = [u for u in users if u not in api.blocked]
+    missed = sum(u not in received for u in reachable)
+    duplicated = sum(n > 1 for n in received.values())
+
+    print(f"\nРассылка: {elapsed:.1f} с, из них перезапуск {restart:.2f} с; "
+          f"скорость до сбоя {first_rate:.1f}/с ({first_processed} получателей), после {second_rate:.1f}/с")
+    print(f"  доставлено {job.state['sent']}, недоступны {job.state['dead']} "
+          f"(заблокировали {len(api.blocked)}), ошибок {job.state['failed']}")
+    print(f"  не получили {missed}, получили дважды {duplicated}; в очереди планировщика до {max_bulk} сообщений")
+    print(f"Пересылка в диалогах без рассылки, мс:            {describe(baseline)} (n={len(baseline)})")
+    print(f"Пересылка в диалогах во время рассылки (до сбоя): {describe(during)} (n={len(during)})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--rate', type=float, default=settings.BROADCAST_RATE, help='скорость рассылки, сообщ./с')
+    parser.add_argument('--global-rate', type=float, default=settings.SEND_GLOBAL_RATE,
+                        help='общий лимит отправки бота, сообщ./с')
+    parser.add_argument('--dialogues', type=int, default=10)
+    parser.add_argument('--think', type=float, default=2.0, help='средняя пауза между сообщениями в диалоге, с')
+    parser.add_argument('--blocked', type=float, default=0.05, help='доля заблокировавших бота')
+    parser.add_argument('--baseline', type=float, default=10.0, help='замер пересылки без рассылки, с')
+    parser.add_argument('--checkpoint', type=float, default=2.0, help='интервал сохранения прогресса, с')
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка заглушки Bot API, секунды')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=1)
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,107 @@
+"""
+Бенчмарк параллельной обработки обновлений: по одному против DialogueUpdateProcessor.
+
+Заранее созданы N диалогов, оба участника каждого шлют пачку сообщений.
+Заглушка Bot API отвечает с задержкой, поэтому при обработке по одному
+каждая пересылка ждет все предыдущие, а при параллельной - только
+сообщения своего диалога. Заодно проверяется, что внутри диалога
+сообщения доходят в исходном порядке.
+
+Запуск: python benchmarks/bench_concurrency.py --dialogues 200 --messages 5
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import settings
+
+settings.METRICS_PORT = None
+
+import main
+from sender import SendScheduler
+from storage import MemoryStore
+
+from bench_load import describe
+from fake_bot_api import FakeBotAPI
+
+TOKEN = '123456:CONCURRENCY'
+
+
+async def measure(args, concurrent_updates: int) -> dict:
+    api = FakeBotAPI(TOKEN, latency=args.latency, jitter=args.jitter, seed=1)
+    await api.start()
+    main.store = MemoryStore()
+    main.sender = SendScheduler(global_rate=1e6, global_burst=1e6, chat_rate=1e6, chat_burst=1e6,
+                                max_queue=10 ** 7)
+    pairs = []
+    for i in range(args.dialogues):
+        a, b = 200_000 + 2 * i, 200_001 + 2 * i
+        for user_id in (a, b):
+            main.store.save_user(user_id, {'gender': 'male', 'country': 'Россия', 'age': 'от 18 до 21 года'})
+        main.store.link(a, b)
+        pairs.append((a, b))
+
+    application = main.build_application(TOKEN, base_url=api.url, serve_mode='polling',
+                                         concurrent_updates=concurrent_updates)
+    await application.initialize()
+    await application.updater.start_polling(poll_interval=0, timeout=1)
+    await application.start()
+
+    total = 2 * args.dialogues * args.messages
+    start = time.perf_counter()
+    for k in range(args.messages):
+        for a, b in pairs:
+            api.push_message(a, f"{a}:{k}")
+            api.push_message(b, f"{b}:{k}")
+    while len(api.relay_latencies) < total and time.perf_counter() - start < args.timeout:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    # Порядок: у каждого получателя ID исходных сообщений должны расти
+    out_of_order = 0
+    for a, b in pairs:
+        for receiver in (a, b):
+            last = 0
+            inbox = api.inbox(receiver)
+            while not inbox.empty():
+                delivery = inbox.get_nowait()
+                if delivery.method != 'copyMessage':
+                    continue
+                source_id = int(delivery.params['message_id'])
+                out_of_order += source_id < last
+                last = source_id
+
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    await main.sender.close()
+    await api.stop()
+    return {'delivered': len(api.relay_latencies), 'total': total, 'elapsed': elapsed,
+            'latencies': api.relay_latencies, 'out_of_order': out_of_order}
+
+
+async def run(args) -> None:
+    print(f"Диалогов {args.dialogues}, сообщений {2 * args.dialogues * args.messages}, "
+          f"задержка API {args.latency * 1000:.0f}±{args.jitter * 1000:.0f} мс")
+    for title, concurrent_updates in (('по одному', 1), (f'параллельно ({args.concurrency})', args.concurrency)):
+        result = await measure(args, concurrent_updates)
+        print(f"\n{title}: доставлено {result['delivered']}/{result['total']} за {result['elapsed']:.2f} с "
+              f"({result['delivered'] / result['elapsed']:.0f} сообщ./с), нарушений порядка {result['out_of_order']}")
+        print(f"  задержка пересылки, мс: {describe(result['latencies'])}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dialogues', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=5, help='сообщений от каждого участника')
+    parser.add_argument('--concurrency', type=int, default=settings.CONCURRENT_UPDATES)
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка заглушки Bot API, секунды')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--timeout', type=float, default=120)
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,143 @@
+"""
+Бенчмарк завершения диалогов с заблокировавшими бота.
+
+Бот собирается как в main() и работает против локальной заглушки Bot API
+с лимитами отправки Telegram. Все пользователи переписываются в парах,
+затем в части пар один собеседник блокирует бота (заглушка отвечает 403),
+а второй продолжает писать. В конце администратор делает рассылку всем.
+
+Отчет: сколько запросов ушло в заблокированные чаты и сколько ушло бы
+без завершения диалогов (каждое сообщение собеседника и каждая рассылка),
+сколько запросов отменено в очереди планировщика, получили ли оставшиеся
+собеседники уведомление и не остались ли заблокировавшие в диалогах.
+
+Запуск: python benchmarks/bench_dead_chats.py --dialogues 50 --blocked 0.3
+"""
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import settings
+
+settings.METRICS_PORT = None
+
+import main
+from sender import SendScheduler
+from storage import MemoryStore
+
+from fake_bot_api import FakeBotAPI
+
+TOKEN = '123456:DEAD'
+ADMIN = 1_000
+TEXT = '📣 Объявление'
+
+
+async def chat(api: FakeBotAPI, user_id: int, think: float, rng: random.Random, sent: list,
+               stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        api.push_message(user_id, f"сообщение от {user_id}")
+        sent.append(user_id)
+        await asyncio.sleep(think * rng.uniform(0.5, 1.5))
+
+
+async def wait_idle(api: FakeBotAPI) -> None:
+    while api.pending_updates or main.sender.stats()['queued'] or main.sender.stats()['in_flight']:
+        await asyncio.sleep(0.1)
+
+
+async def run(args) -> None:
+    api = FakeBotAPI(TOKEN, latency=args.latency, jitter=args.jitter, seed=args.seed)
+    await api.start()
+    rng = random.Random(args.seed)
+
+    settings.ADMIN_IDS = (ADMIN,)
+    settings.BROADCAST_RATE = args.broadcast_rate
+    settings.BROADCAST_STATE_PATH = str(Path(tempfile.mkdtemp(prefix='bench-dead-')) / 'broadcast.json')
+    main.store = MemoryStore()
+    main.sender = SendScheduler(
+        global_rate=settings.SEND_GLOBAL_RATE, global_burst=settings.SEND_GLOBAL_BURST,
+        chat_rate=settings.SEND_CHAT_RATE, chat_burst=settings.SEND_CHAT_BURST)
+    users = list(range(100_000, 100_000 + 2 * args.dialogues))
+    pairs = list(zip(users[::2], users[1::2]))
+    for user_id in users:
+        main.store.save_user(user_id, {'gender': 'male', 'country': 'Россия', 'age': 'от 18 до 21 года'})
+    for a, b in pairs:
+        main.store.link(a, b)
+
+    application = main.build_application(TOKEN, base_url=api.url, serve_mode='polling')
+    await application.initialize()
+    await application.updater.start_polling(poll_interval=0, timeout=1)
+    await application.start()
+    print(f"Диалогов {args.dialogues}, заблокируют бота {args.blocked:.0%} собеседников, "
+          f"пауза между сообщениями {args.think:g} с, {args.duration:g} с после блокировки; "
+          f"задержка API {args.latency * 1000:.0f}±{args.jitter * 1000:.0f} мс")
+
+    # Один собеседник из выбранных пар блокирует бота, второй продолжает писать
+    dead_pairs = rng.sample(pairs, int(len(pairs) * args.blocked))
+    api.blocked = {a for a, _ in dead_pairs}
+    survivors = [b for _, b in dead_pairs]
+    stop = asyncio.Event()
+    sent = []
+    tasks = [asyncio.create_task(chat(api, b, args.think, random.Random(b), sent, stop)) for b in survivors]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    await wait_idle(api)
+    relay_wasted = sum(api.forbidden.values())
+
+    start = time.perf_counter()
+    api.push_message(ADMIN, f'/broadcast {TEXT}')
+    while 'broadcast' not in application.bot_data:
+        await asyncio.sleep(0.05)
+    job = application.bot_data['broadcast']
+    while job.active:
+        await asyncio.sleep(0.1)
+    elapsed = time.perf_counter() - start
+    await wait_idle(api)
+
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    await main.sender.close()
+    await api.stop()
+
+    notified = 0
+    for user_id in survivors:
+        inbox = api.inbox(user_id)
+        while not inbox.empty():
+            delivery = inbox.get_nowait()
+            if delivery.method == 'sendMessage' and 'Собеседник покинул' in delivery.params.get('text', ''):
+                notified += 1
+    wasted = sum(api.forbidden.values())
+    # Без завершения диалога каждое сообщение собеседника и рассылка ушли бы в заблокированный чат
+    without = len(sent) + len(api.blocked)
+    print(f"\nСообщений собеседникам заблокировавших: {len(sent)}")
+    print(f"Запросов в заблокированные чаты: {wasted} (пересылка {relay_wasted}, рассылка {wasted - relay_wasted}); "
+          f"без завершения диалогов было бы {without}")
+    print(f"Отменено в очереди планировщика: {main.sender.counters['dropped_dead']}")
+    print(f"Отмечено недоступными {main.store.count_unreachable()} из {len(api.blocked)}, "
+          f"уведомлено собеседников {notified} из {len(survivors)}, "
+          f"заблокировавших в диалогах {sum(main.store.get_partner(u) is not None for u in api.blocked)}")
+    print(f"Рассылка: {elapsed:.1f} с, доставлено {job.state['sent']} из {len(users)} "
+          f"(недоступны {job.state['dead']})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dialogues', type=int, default=50)
+    parser.add_argument('--blocked', type=float, default=0.3, help='доля пар, где собеседник заблокировал бота')
+    parser.add_argument('--think', type=float, default=1.0, help='средняя пауза между сообщениями, с')
+    parser.add_argument('--duration', type=float, default=10.0, help='сколько писать после блокировки, с')
+    parser.add_argument('--broadcast-rate', type=float, default=settings.BROADCAST_RATE)
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка заглушки Bot API, секунды')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=1)
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(run(parser.parse_args()))
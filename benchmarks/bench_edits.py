@@ -0,0 +1,133 @@
+"""
+Бенчмарк пересылки правок: каждая правка отдельно против схлопывания (EDIT_WINDOW).
+
+В заранее созданных диалогах один участник отправляет фото и затем
+серией правок несколько раз меняет его (новый файл и подпись) и текст
+второго сообщения. Считаются вызовы Bot API на правки, задержка от
+последней правки до ее появления у собеседника и то, что у собеседника
+в итоге оказалась последняя версия.
+
+Запуск: python benchmarks/bench_edits.py --dialogues 100 --edits 5 --gap 0.05
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import settings
+
+settings.METRICS_PORT = None
+
+import main
+from edits import EditCoalescer
+from sender import SendScheduler
+from storage import MemoryStore
+
+from bench_load import describe
+from fake_bot_api import FakeBotAPI
+
+TOKEN = '123456:EDITS'
+EDIT_METHODS = ('editMessageText', 'editMessageCaption', 'editMessageMedia', 'deleteMessage')
+
+
+def photo(file_id: str) -> list:
+    return [{'file_id': file_id, 'file_unique_id': file_id, 'width': 90, 'height': 90}]
+
+
+async def measure(args, window: float) -> dict:
+    api = FakeBotAPI(TOKEN, latency=args.latency, jitter=args.jitter, seed=1)
+    await api.start()
+    main.store = MemoryStore()
+    main.sender = SendScheduler(global_rate=1e6, global_burst=1e6, chat_rate=1e6, chat_burst=1e6,
+                                max_queue=10 ** 7)
+    main.edits = EditCoalescer(window)
+    settings.EDIT_WINDOW = window
+    pairs = []
+    for i in range(args.dialogues):
+        a, b = 300_000 + 2 * i, 300_001 + 2 * i
+        for user_id in (a, b):
+            main.store.save_user(user_id, {'gender': 'male', 'country': 'Россия', 'age': 'от 18 до 21 года'})
+        main.store.link(a, b)
+        pairs.append((a, b))
+
+    application = main.build_application(TOKEN, base_url=api.url, serve_mode='polling')
+    await application.initialize()
+    await application.updater.start_polling(poll_interval=0, timeout=1)
+    await application.start()
+
+    # Исходные сообщения: фото и текст от первого участника
+    originals = {}
+    for a, b in pairs:
+        originals[a] = (api.push_message(a, photo=photo(f'{a}-0'), caption='v0'), api.push_message(a, 'v0'))
+    while len(api.relay_latencies) < 2 * len(pairs):
+        await asyncio.sleep(0.01)
+    calls_before = sum(api.calls[method] for method in EDIT_METHODS)
+
+    start = time.perf_counter()
+    for k in range(1, args.edits + 1):
+        for a, b in pairs:
+            photo_id, text_id = originals[a]
+            api.push_edit(a, photo_id, photo=photo(f'{a}-{k}'), caption=f'v{k}')
+            api.push_edit(a, text_id, f'v{k}')
+        await asyncio.sleep(args.gap)
+
+    # Ждем, пока у всех собеседников окажется последняя версия обоих сообщений
+    final = f'v{args.edits}'
+    latest = {}
+    while time.perf_counter() - start < args.timeout:
+        for a, b in pairs:
+            inbox = api.inbox(b)
+            while not inbox.empty():
+                delivery = inbox.get_nowait()
+                media = delivery.params.get('media')
+                if delivery.method == 'editMessageMedia':
+                    latest[(b, 'photo')] = (media.get('caption'), media.get('media'))
+                elif delivery.method == 'editMessageText':
+                    latest[(b, 'text')] = delivery.text
+        if all(latest.get((b, 'photo'), (None,))[0] == final and latest.get((b, 'text')) == final
+               for a, b in pairs):
+            break
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    up_to_date = sum(latest.get((b, 'photo')) == (final, f'{a}-{args.edits}') and latest.get((b, 'text')) == final
+                     for a, b in pairs)
+
+    calls = sum(api.calls[method] for method in EDIT_METHODS) - calls_before
+    by_method = {method: api.calls[method] for method in EDIT_METHODS if api.calls[method]}
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    await main.sender.close()
+    await api.stop()
+    return {'calls': calls, 'by_method': by_method, 'elapsed': elapsed, 'up_to_date': up_to_date,
+            'latencies': api.edit_latencies, 'coalesced': main.edits.coalesced}
+
+
+async def run(args) -> None:
+    edits = 2 * args.dialogues * args.edits
+    print(f"Диалогов {args.dialogues}, правок {edits} (по {args.edits} на сообщение с интервалом "
+          f"{args.gap * 1000:.0f} мс), задержка API {args.latency * 1000:.0f}±{args.jitter * 1000:.0f} мс")
+    for title, window in (('каждая правка', 0), (f'окно {args.window * 1000:.0f} мс', args.window)):
+        result = await measure(args, window)
+        print(f"\n{title}: вызовов на правки {result['calls']} ({result['calls'] / edits:.2f} на правку), "
+              f"схлопнуто {result['coalesced']}, актуальны {result['up_to_date']}/{args.dialogues} "
+              f"за {result['elapsed']:.2f} с")
+        print(f"  методы: {result['by_method']}")
+        print(f"  задержка последней правки, мс: {describe(result['latencies'])}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dialogues', type=int, default=100)
+    parser.add_argument('--edits', type=int, default=5, help='правок каждого сообщения')
+    parser.add_argument('--gap', type=float, default=0.05, help='интервал между правками, секунды')
+    parser.add_argument('--window', type=float, default=0.3, help='окно схлопывания, секунды')
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка заглушки Bot API, секунды')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--timeout', type=float, default=60)
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,131 @@
+"""
+Бенчмарк журнала событий чатов (events.py).
+
+1. Запись: стоимость emit() в цикле событий при работающем потоке записи
+   и без журнала, сколько событий в секунду уходит на диск.
+2. Чтение: синтетический журнал из --events событий в часовых сегментах
+   (по умолчанию 50 млн, ~1.6 ГБ) - время отчета EventStats через mmap
+   и, для сравнения, построчного разбора struct.iter_unpack на части
+   сегментов.
+
+Запуск: python benchmarks/bench_events.py --events 50000000
+"""
+import argparse
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import events
+from events import RECORD, EventLog, EventStats
+
+
+def bench_emit(n: int, directory: Path) -> None:
+    for title, path in (('без журнала', None), ('с журналом ', directory)):
+        log = EventLog(path, flush_interval=0.2)
+        log.start()
+        start = time.perf_counter()
+        for i in range(n):
+            log.emit(events.MATCHED, 100_000 + i, 200_000 + i)
+        elapsed = time.perf_counter() - start
+        log.close()
+        print(f"  {title}: {elapsed / n * 1e9:.0f} нс на emit(), записано {log.written} из {n}")
+
+
+def synthetic_block(n: int, start_ms: int, rng: random.Random) -> bytes:
+    """n событий: регистрации, поиски, диалоги и их завершения в реалистичной пропорции"""
+    kinds = [events.REGISTERED] * 1 + [events.SEARCH] * 9 + [events.MATCHED] * 4 + [events.ENDED] * 4
+    reasons = [events.STOP] * 5 + [events.NEXT] * 4 + [events.UNREACHABLE]
+    data = bytearray()
+    for i in range(n):
+        kind = rng.choice(kinds)
+        user_id = rng.randrange(1, 10 ** 10)
+        if kind == events.ENDED:
+            seconds = int(rng.expovariate(1 / 180))
+            data += RECORD.pack(start_ms + i, user_id, user_id + 1, seconds, kind, rng.choice(reasons),
+                                events.duration_bucket(seconds))
+        else:
+            data += RECORD.pack(start_ms + i, user_id, user_id + 1 if kind == events.MATCHED else 0, 0, kind, 0, 0)
+    return bytes(data)
+
+
+def write_synthetic(directory: Path, total: int, hours: int, seed: int) -> list:
+    rng = random.Random(seed)
+    block = synthetic_block(100_000, 1_767_225_600_000, rng)
+    per_segment = total // hours
+    paths = []
+    for hour in range(hours):
+        path = directory / f"events-202601{1 + hour // 24:02d}{hour % 24:02d}-1{events.SUFFIX}"
+        with open(path, 'wb') as f:
+            left = per_segment
+            while left > 0:
+                chunk = block[:min(left, 100_000) * RECORD.size]
+                f.write(chunk)
+                left -= len(chunk) // RECORD.size
+        paths.append(path)
+    return paths
+
+
+def naive_stats(paths: list) -> tuple:
+    """Тот же подсчет типов, причин и длительностей разбором каждой записи"""
+    kinds, reasons = Counter(), Counter()
+    total = count = 0
+    for path in paths:
+        for _, _, _, seconds, kind, reason, bucket in RECORD.iter_unpack(path.read_bytes()):
+            kinds[kind] += 1
+            reasons[reason] += 1
+            total += seconds
+            count += 1
+    return kinds, reasons, total, count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--emit', type=int, default=200_000, help='событий в замере записи')
+    parser.add_argument('--events', type=int, default=50_000_000, help='событий в синтетическом журнале')
+    parser.add_argument('--hours', type=int, default=48, help='часовых сегментов')
+    parser.add_argument('--naive-segments', type=int, default=2, help='сегментов для построчного разбора')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    directory = Path(tempfile.mkdtemp(prefix='bench-events-'))
+    try:
+        print("1. Запись")
+        bench_emit(args.emit, directory / 'emit')
+
+        print(f"\n2. Чтение: {args.events} событий в {args.hours} сегментах")
+        start = time.perf_counter()
+        paths = write_synthetic(directory, args.events, args.hours, args.seed)
+        size = sum(p.stat().st_size for p in paths)
+        print(f"  журнал {size / 2 ** 20:.0f} МиБ записан за {time.perf_counter() - start:.1f} с")
+
+        start = time.perf_counter()
+        stats = EventStats()
+        for path in paths:
+            stats.add_segment(path)
+        elapsed = time.perf_counter() - start
+        print(f"  mmap и срезы: {elapsed:.2f} с, {stats.events / elapsed / 1e6:.0f} млн событий/с")
+
+        sample = paths[:args.naive_segments]
+        start = time.perf_counter()
+        kinds, _, total, count = naive_stats(sample)
+        naive = time.perf_counter() - start
+        check = EventStats()
+        for path in sample:
+            check.add_segment(path)
+        same = dict(check.kinds) == {k: kinds[k] for k in events.KINDS} and check.total_duration == total
+        print(f"  struct.iter_unpack: {count / naive / 1e6:.1f} млн событий/с "
+              f"(на всем журнале ~{stats.events / (count / naive):.0f} с); результаты совпадают: {same}")
+        print()
+        print(stats.report())
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+Бенчмарк входящего лимита сообщений (flood.FloodControl).
+
+1. Спамеры на фоне живых диалогов. Бот собирается как в main() и работает
+   против локальной заглушки Bot API с лимитами отправки Telegram. Часть
+   пар переписывается в обычном темпе, в остальных один собеседник шлет
+   сообщения без пауз. Один и тот же сценарий прогоняется без лимита и с
+   ним. Отчет: задержка пересылки в обычных диалогах, сколько запросов
+   к Bot API ушло на спам, очередь планировщика и сколько спама еще
+   ждало отправки к концу замера.
+2. Память и скорость: поток check() от миллиона разных пользователей -
+   сколько записей держится в памяти и время одной проверки.
+
+Запуск: python benchmarks/bench_flood.py --dialogues 10 --spammers 5 --spam-rate 20
+"""
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import settings
+
+settings.METRICS_PORT = None
+
+import main
+import metrics
+from flood import FloodControl
+from sender import SendScheduler
+from storage import MemoryStore
+
+from bench_load import describe
+from fake_bot_api import FakeBotAPI
+
+TOKEN = '123456:FLOOD'
+
+
+async def start_bot(api: FakeBotAPI):
+    application = main.build_application(TOKEN, base_url=api.url, serve_mode='polling')
+    await application.initialize()
+    await application.updater.start_polling(poll_interval=0, timeout=1)
+    await application.start()
+    return application
+
+
+async def stop_bot(application) -> None:
+    """Остановка без доотправки: спам в очередях ушел бы собеседникам еще через минуты"""
+    await application.updater.stop()
+    while not application.update_queue.empty():
+        application.update_queue.get_nowait()
+        application.update_queue.task_done()
+    main.sender.max_queue = 0
+    await main.sender.close()
+    logging.disable(logging.ERROR)
+    await application.stop()
+    logging.disable(logging.NOTSET)
+    await application.shutdown()
+
+
+async def chat(api: FakeBotAPI, user_id: int, pause: float, rng: random.Random, pushed: dict,
+               stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        message_id = api.push_message(user_id, f"сообщение от {user_id}")
+        pushed[(user_id, message_id)] = time.perf_counter()
+        await asyncio.sleep(pause * rng.uniform(0.5, 1.5))
+
+
+async def run_case(args, limit: bool) -> dict:
+    settings.FLOOD_RATE = args.flood_rate if limit else 0
+    main.flood = FloodControl(rate=args.flood_rate, burst=settings.FLOOD_BURST, mute=settings.FLOOD_MUTE,
+                              mute_max=settings.FLOOD_MUTE_MAX, forgive=settings.FLOOD_FORGIVE)
+    main.store = MemoryStore()
+    main.sender = SendScheduler(
+        global_rate=settings.SEND_GLOBAL_RATE, global_burst=settings.SEND_GLOBAL_BURST,
+        chat_rate=settings.SEND_CHAT_RATE, chat_burst=settings.SEND_CHAT_BURST, max_queue=args.max_queue)
+    api = FakeBotAPI(TOKEN, latency=args.latency, jitter=args.jitter, seed=args.seed)
+    await api.start()
+
+    normal = list(range(100_000, 100_000 + 2 * args.dialogues))
+    spammers = list(range(200_000, 200_000 + args.spammers))
+    victims = list(range(300_000, 300_000 + args.spammers))
+    for user_id in normal + spammers + victims:
+        main.store.save_user(user_id, {'gender': 'male', 'country': 'Россия', 'age': 'от 18 до 21 года'})
+    for a, b in zip(normal[::2], normal[1::2]):
+        main.store.link(a, b)
+    for a, b in zip(spammers, victims):
+        main.store.link(a, b)
+    application = await start_bot(api)
+
+    stop = asyncio.Event()
+    pushed = {}
+    tasks = [asyncio.create_task(chat(api, u, args.think, random.Random(u), pushed, stop)) for u in normal]
+    tasks += [asyncio.create_task(chat(api, u, 1 / args.spam_rate, random.Random(u), {}, stop)) for u in spammers]
+    max_queue = 0
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        max_queue = max(max_queue, main.sender.stats()['queued'])
+        await asyncio.sleep(0.1)
+    stop.set()
+    await asyncio.gather(*tasks)
+    backlog = main.sender.stats()['queued']
+    await stop_bot(application)
+    await api.stop()
+
+    latencies = []
+    for user_id in normal:
+        inbox = api.inbox(user_id)
+        while not inbox.empty():
+            delivery = inbox.get_nowait()
+            source = (int(delivery.params.get('from_chat_id', 0)), int(delivery.params.get('message_id', 0)))
+            if delivery.method == 'copyMessage' and source in pushed:
+                latencies.append(delivery.at - pushed.pop(source))
+    spam = sum(api.inbox(user_id).qsize() for user_id in victims)
+    return {'latencies': latencies, 'lost': len(pushed), 'spam': spam, 'max_queue': max_queue,
+            'backlog': backlog, 'dropped': metrics_value('flood_dropped'), 'mutes': metrics_value('flood_mutes')}
+
+
+def metrics_value(name: str) -> int:
+    return int(getattr(metrics, name).value())
+
+
+def bench_memory(users: int, rate: float) -> None:
+    """Поток сообщений от users разных пользователей со скоростью rate сообщений в секунду"""
+    flood = FloodControl(rate=settings.FLOOD_RATE or 1.0, burst=settings.FLOOD_BURST)
+    step = 1 / rate
+    tracked = 0
+    start = time.perf_counter()
+    for i in range(users):
+        flood.check(i, now=i * step)
+        if i % 1000 == 0:
+            tracked = max(tracked, len(flood))
+    elapsed = time.perf_counter() - start
+    tracked = max(tracked, len(flood))
+    print(f"  {users} пользователей по одному сообщению, {rate:g} сообщ./с: в памяти до {tracked} записей "
+          f"(за FLOOD_BURST / FLOOD_RATE = {flood.burst / flood.rate:g} с потока - {flood.burst / flood.rate * rate:.0f}), {elapsed / users * 1e9:.0f} нс на проверку")
+
+
+async def run(args) -> None:
+    print(f"Обычных диалогов {args.dialogues} (пауза {args.think:g} с), спамеров {args.spammers} "
+          f"по {args.spam_rate:g} сообщ./с, {args.duration:g} с; лимит {args.flood_rate:g}/с, "
+          f"до {settings.FLOOD_BURST} подряд; задержка API {args.latency * 1000:.0f}±{args.jitter * 1000:.0f} мс")
+    print("\n1. Спамеры на фоне диалогов")
+    for title, limit in (('без лимита', False), ('с лимитом ', True)):
+        dropped, mutes = metrics_value('flood_dropped'), metrics_value('flood_mutes')
+        r = await run_case(args, limit)
+        print(f"  {title}: пересылка в диалогах {describe(r['latencies'])} мс (n={len(r['latencies'])}, "
+              f"не доставлено {r['lost']})")
+        print(f"    спама доставлено {r['spam']}, в очереди к концу {r['backlog']}, очередь до {r['max_queue']}; "
+              f"отброшено входящих {r['dropped'] - dropped}, молчаний {r['mutes'] - mutes}")
+
+    print("\n2. Память и скорость")
+    bench_memory(args.users, args.stream_rate)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dialogues', type=int, default=10)
+    parser.add_argument('--think', type=float, default=2.0, help='средняя пауза в обычном диалоге, с')
+    parser.add_argument('--spammers', type=int, default=5)
+    parser.add_argument('--spam-rate', type=float, default=20.0, help='сообщений в секунду от спамера')
+    parser.add_argument('--duration', type=float, default=20.0, help='длительность сценария, с')
+    parser.add_argument('--flood-rate', type=float, default=settings.FLOOD_RATE or 1.0)
+    parser.add_argument('--max-queue', type=int, default=settings.SEND_MAX_QUEUE)
+    parser.add_argument('--users', type=int, default=1_000_000, help='пользователей в замере памяти')
+    parser.add_argument('--stream-rate', type=float, default=10_000.0, help='сообщений в секунду в замере памяти')
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка заглушки Bot API, секунды')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=1)
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(run(parser.parse_args()))
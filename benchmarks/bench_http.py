@@ -0,0 +1,144 @@
+"""
+Бенчмарк транспорта Bot API (transport.PooledRequest) через локальную заглушку.
+
+1. Размер пула: поток copy_message с заданным числом одновременных
+   запросов при разных HTTP_POOL_SIZE - пропускная способность, задержка,
+   процессорное время на запрос и сколько запросов ждали соединения.
+2. Разбиение пула: один большой пул как один клиент httpx и как
+   несколько клиентов по stripe_size соединений.
+3. Keep-alive: те же запросы без сохранения простаивающих соединений.
+4. Медленные медиа: пересылка текста на фоне долгих sendMediaGroup -
+   с общим пулом и с отдельным пулом для медиа.
+
+Заглушка работает в отдельном процессе, чтобы ее разбор запросов не
+смешивался с процессорным временем клиента.
+
+Запуск: python benchmarks/bench_http.py --requests 3000 --concurrency 200
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import socket
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from telegram import Bot, InputMediaPhoto
+
+from sender import RELAY, SendScheduler
+from transport import Pool, PooledRequest, route_media
+
+from bench_load import describe
+from fake_bot_api import FakeBotAPI
+
+TOKEN = '123456:HTTP'
+
+
+def serve_api(port: int, latency: float, jitter: float, media_latency: float) -> None:
+    async def serve():
+        api = FakeBotAPI(TOKEN, port=port, latency=latency, jitter=jitter, seed=1,
+                         method_latency={'sendMediaGroup': media_latency})
+        await api.start()
+        await asyncio.Event().wait()
+    asyncio.run(serve())
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def run_case(api_url: str, request: PooledRequest, texts: int, concurrency: int, media: int = 0) -> dict:
+    """texts пересылок текста и media альбомов параллельно, не больше concurrency запросов в полете"""
+    bot = Bot(TOKEN, base_url=f"{api_url}/bot", request=request)
+    await bot.initialize()
+    sender = SendScheduler(global_rate=1e6, global_burst=1e6, chat_rate=1e6, chat_burst=1e6,
+                           max_queue=10 ** 7, max_in_flight=concurrency)
+    latencies = []
+
+    async def text(i: int) -> None:
+        start = time.perf_counter()
+        await sender.call(bot, 'copy_message', RELAY, chat_id=1_000 + i, from_chat_id=1, message_id=1)
+        latencies.append(time.perf_counter() - start)
+
+    async def album(i: int) -> None:
+        await sender.call(bot, 'send_media_group', RELAY, chat_id=900_000 + i,
+                          media=[InputMediaPhoto(f'photo{i}-{k}') for k in range(3)])
+
+    cpu, start = time.process_time(), time.perf_counter()
+    # Медиа ставятся в очередь первыми и занимают соединения раньше текста
+    results = await asyncio.gather(*(album(i) for i in range(media)), *(text(i) for i in range(texts)),
+                                   return_exceptions=True)
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    await sender.close()
+    await bot.shutdown()
+    return {'elapsed': elapsed, 'cpu': cpu, 'latencies': latencies, 'rate': texts / elapsed,
+            'errors': sum(isinstance(r, Exception) for r in results), 'saturated': dict(request.saturated)}
+
+
+def single_pool(size: int, keepalive: int = None, stripe_size: int = 8) -> PooledRequest:
+    return PooledRequest({'send': Pool(size, keepalive, stripe_size=stripe_size)})
+
+
+async def run(args) -> None:
+    port = free_port()
+    api = multiprocessing.get_context('spawn').Process(
+        target=serve_api, args=(port, args.latency, args.jitter, args.media_latency), daemon=True)
+    api.start()
+    api_url = f"http://127.0.0.1:{port}"
+    await asyncio.sleep(1)
+    print(f"Запросов {args.requests}, одновременно до {args.concurrency}, "
+          f"задержка API {args.latency * 1000:.0f}±{args.jitter * 1000:.0f} мс")
+
+    print("\n1. Размер пула (keep-alive для всех соединений)")
+    for size in args.pool_sizes:
+        r = await run_case(api_url, single_pool(size), args.requests, args.concurrency)
+        print(f"  пул {size:>4}: {r['rate']:>6.0f} запр./с, CPU {r['cpu'] / args.requests * 1e6:>5.0f} мкс/запрос, "
+              f"ждали соединения {r['saturated']['send']:>5}, ошибок {r['errors']}; "
+              f"задержка, мс: {describe(r['latencies'])}")
+
+    size = max(args.pool_sizes)
+    print(f"\n2. Разбиение пула {size}")
+    for stripe_size in sorted({size, 64, 16, 8}, reverse=True):
+        r = await run_case(api_url, single_pool(size, stripe_size=stripe_size), args.requests, args.concurrency)
+        print(f"  клиентов httpx {-(-size // stripe_size):>3}: {r['rate']:>6.0f} запр./с, "
+              f"CPU {r['cpu'] / args.requests * 1e6:>5.0f} мкс/запрос; задержка, мс: {describe(r['latencies'])}")
+
+    size = args.keepalive_pool
+    print(f"\n3. Keep-alive (пул {size})")
+    for title, keepalive in (('все соединения', None), ('без keep-alive', 0)):
+        r = await run_case(api_url, single_pool(size, keepalive), args.requests, args.concurrency)
+        print(f"  {title}: {r['rate']:.0f} запр./с, CPU {r['cpu'] / args.requests * 1e6:.0f} мкс/запрос; "
+              f"задержка, мс: {describe(r['latencies'])}")
+
+    texts = args.requests // 4
+    print(f"\n4. Пересылка {texts} текстов на фоне {args.media} альбомов по {args.media_latency:.1f} с")
+    shared = single_pool(size)
+    split = PooledRequest({
+        'send': Pool(size),
+        'media': Pool(args.media_pool, pool_timeout=60),
+    }, route_media, {'sendMediaGroup': args.media_latency * 2})
+    for title, request in (('общий пул', shared), (f'отдельный пул медиа ({args.media_pool})', split)):
+        r = await run_case(api_url, request, texts, args.concurrency, media=args.media)
+        print(f"  {title}: текст {describe(r['latencies'])} мс, ошибок {r['errors']}, "
+              f"ждали соединения {r['saturated']}")
+    api.terminate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--concurrency', type=int, default=200, help='запросов в полете (max_in_flight)')
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=[8, 32, 64, 128, 256])
+    parser.add_argument('--keepalive-pool', type=int, default=64)
+    parser.add_argument('--media', type=int, default=64, help='альбомов в сценарии 3')
+    parser.add_argument('--media-pool', type=int, default=8)
+    parser.add_argument('--media-latency', type=float, default=2.0, help='время отправки альбома, секунды')
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка заглушки Bot API, секунды')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(run(parser.parse_args()))
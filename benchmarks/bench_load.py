@@ -0,0 +1,315 @@
+"""
+Нагрузочный тест: настоящие обработчики main.py против локальной заглушки Bot API.
+
+Бот собирается так же, как в main() (build_application), и получает
+обновления через getUpdates от заглушки. Тысячи смоделированных
+пользователей регистрируются, нажимая кнопки, ищут собеседника, переписываются (с ответами и правками),
+листают собеседников через /next и выходят через /stop.
+
+Отчет: пропускная способность, задержка пересылки (p50/p95/p99),
+время регистрации и до нахождения собеседника, вызовы API и 429, память процесса.
+
+Запуск: python benchmarks/bench_load.py --users 1000 --duration 30
+        python benchmarks/bench_load.py --latency 0.05 --flood 0.01 --telegram-limits
+"""
+import argparse
+import asyncio
+import gc
+import logging
+import multiprocessing
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import settings
+
+# Без сервера метрик: тест может идти параллельно с запущенным ботом
+settings.METRICS_PORT = None
+
+import main
+from sender import SendScheduler
+from sharding import run_sharded
+from storage import MemoryStore
+
+from fake_bot_api import FakeBotAPI
+
+# В режиме шардов координатор берет токен из config, поэтому он общий
+TOKEN = main.TOKEN
+MATCHED = 'Собеседник найден'
+PARTNER_LEFT = 'Собеседник завершил диалог'
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def describe(values: list, scale: float = 1000) -> str:
+    if not values:
+        return "нет данных"
+    return (f"p50 {percentile(values, 50) * scale:.1f}, p95 {percentile(values, 95) * scale:.1f}, "
+            f"p99 {percentile(values, 99) * scale:.1f}, max {max(values) * scale:.1f}")
+
+
+class SimUser:
+    """Один пользователь: регистрация, затем поиск -> переписка -> /next или /stop, по кругу"""
+
+    def __init__(self, api: FakeBotAPI, user_id: int, args, rng: random.Random, stats: dict):
+        self.api = api
+        self.user_id = user_id
+        self.args = args
+        self.rng = rng
+        self.stats = stats
+        self.inbox = api.inbox(user_id)
+        self.in_dialog = False
+        self.received = []
+
+    def _drain(self) -> None:
+        """Разбирает все, что бот успел прислать"""
+        while not self.inbox.empty():
+            self._observe(self.inbox.get_nowait())
+
+    def _observe(self, delivery) -> bool:
+        if delivery.method == 'copyMessage':
+            self.received.append(delivery.message_id)
+        elif delivery.method == 'sendMessage':
+            if PARTNER_LEFT in delivery.text:
+                self.in_dialog = False
+                self.stats['partner_left'] += 1
+            elif MATCHED in delivery.text:
+                self.in_dialog = True
+                return True
+        return False
+
+    async def _wait_match(self, since: float, deadline: float) -> bool:
+        while True:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                return False
+            try:
+                delivery = await asyncio.wait_for(self.inbox.get(), timeout)
+            except asyncio.TimeoutError:
+                return False
+            if self._observe(delivery):
+                self.stats['time_to_match'].append(delivery.at - since)
+                return True
+
+    async def _register(self, deadline: float) -> bool:
+        """/start и случайная кнопка на каждом шаге, пока у сообщения регистрации есть клавиатура"""
+        since = time.perf_counter()
+        self.api.push_message(self.user_id, '/start')
+        while True:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                return False
+            try:
+                delivery = await asyncio.wait_for(self.inbox.get(), timeout)
+            except asyncio.TimeoutError:
+                return False
+            if delivery.method not in ('sendMessage', 'editMessageText'):
+                continue
+            markup = delivery.params.get('reply_markup') or {}
+            if 'inline_keyboard' in markup:
+                button = self.rng.choice([b for row in markup['inline_keyboard'] for b in row])
+                self.api.push_callback(self.user_id, delivery.message_id, button['callback_data'])
+            elif delivery.method == 'sendMessage' and 'keyboard' in markup:
+                # Последний шаг присылает основную клавиатуру
+                self.stats['time_to_register'].append(delivery.at - since)
+                return True
+
+    async def _chat(self, deadline: float) -> None:
+        sent = []
+        for i in range(self.args.messages):
+            self._drain()
+            if not self.in_dialog or time.perf_counter() >= deadline:
+                return
+            reply_to = None
+            if self.received and self.rng.random() < self.args.reply_rate:
+                reply_to = self.rng.choice(self.received)
+            sent.append(self.api.push_message(self.user_id, f"сообщение {i} от {self.user_id}", reply_to))
+            self.stats['messages'] += 1
+            self.stats['replies'] += reply_to is not None
+            if sent and self.rng.random() < self.args.edit_rate:
+                self.api.push_edit(self.user_id, self.rng.choice(sent), f"исправлено {self.user_id}")
+                self.stats['edits'] += 1
+            await asyncio.sleep(self.rng.expovariate(1 / self.args.think))
+
+    async def run(self, deadline: float) -> None:
+        # Пользователи приходят не одновременно
+        await asyncio.sleep(self.rng.random() * self.args.ramp)
+        if not await self._register(deadline):
+            return
+        searching = False
+        while time.perf_counter() < deadline:
+            if not searching:
+                self._drain()
+                self.received.clear()
+                since = time.perf_counter()
+                self.api.push_message(self.user_id, 'Рандом')
+                self.stats['searches'] += 1
+            if not await self._wait_match(since, deadline):
+                return
+            await self._chat(deadline)
+            self._drain()
+            if not self.in_dialog:
+                searching = False
+                continue
+            # Сами завершаем диалог: /next сразу ставит в поиск, /stop - нет
+            since = time.perf_counter()
+            self.in_dialog = False
+            if self.rng.random() < 0.7:
+                self.api.push_message(self.user_id, '/next')
+                self.stats['next'] += 1
+                searching = True
+            else:
+                self.api.push_message(self.user_id, '/stop')
+                self.stats['stop'] += 1
+                searching = False
+                await asyncio.sleep(self.rng.expovariate(1 / self.args.think))
+
+
+def serve_shards(shards: int, overrides: dict) -> None:
+    """Процесс с координатором и воркерами (запускается через spawn, останавливается SIGTERM)"""
+    vars(settings).update(overrides)
+    store = MemoryStore(map_window=settings.MESSAGE_MAP_WINDOW, map_ttl=settings.MESSAGE_MAP_TTL)
+    run_sharded(shards, store, main.ALLOWED_UPDATES, main.matcher)
+
+
+async def start_shards(args, api: FakeBotAPI):
+    overrides = {'BOT_API_BASE_URL': api.url, 'SERVE_MODE': 'polling', 'STORAGE_BACKEND': 'memory',
+                 'CONCURRENT_UPDATES': args.concurrent_updates}
+    if not args.telegram_limits:
+        overrides.update(SEND_GLOBAL_RATE=1e6, SEND_GLOBAL_BURST=1e6, SEND_CHAT_RATE=1e6, SEND_CHAT_BURST=1e6,
+                         SEND_MAX_QUEUE=10 ** 7)
+    process = multiprocessing.get_context('spawn').Process(
+        target=serve_shards, args=(args.shards, overrides))
+    process.start()
+    # Каждый воркер при старте вызывает getMe
+    while api.calls['getMe'] < args.shards:
+        await asyncio.sleep(0.1)
+    return process
+
+
+async def run(args) -> None:
+    rng = random.Random(args.seed)
+    api = FakeBotAPI(TOKEN, latency=args.latency, jitter=args.jitter, flood_rate=args.flood, seed=args.seed)
+    await api.start()
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    users = list(range(100_000, 100_000 + args.users))
+
+    application = shards = None
+    if args.shards > 1:
+        shards = await start_shards(args, api)
+    else:
+        main.store = MemoryStore(map_window=settings.MESSAGE_MAP_WINDOW, map_ttl=settings.MESSAGE_MAP_TTL)
+        if not args.telegram_limits:
+            # Лимиты Telegram не дали бы увидеть пределы самого бота
+            main.sender = SendScheduler(global_rate=1e6, global_burst=1e6, chat_rate=1e6, chat_burst=1e6,
+                                        max_retries=settings.SEND_MAX_RETRIES, max_queue=10 ** 7)
+
+        application = main.build_application(TOKEN, base_url=api.url, serve_mode='polling',
+                                             concurrent_updates=args.concurrent_updates)
+        await application.initialize()
+        await application.updater.start_polling(poll_interval=0, timeout=1, allowed_updates=main.ALLOWED_UPDATES)
+        await application.start()
+        # Запускает фоновые задачи бота, в том числе пакетный подбор
+        await application.post_init(application)
+
+    stats = {'time_to_register': [], 'time_to_match': [], 'messages': 0, 'replies': 0, 'edits': 0, 'searches': 0, 'next': 0, 'stop': 0,
+             'partner_left': 0}
+    start = time.perf_counter()
+    deadline = start + args.duration
+    sims = [SimUser(api, user_id, args, random.Random(rng.random()), stats) for user_id in users]
+    await asyncio.gather(*(sim.run(deadline) for sim in sims))
+
+    # Даем боту дообработать накопившиеся обновления: ждем, пока заглушка перестанет получать вызовы
+    drain_deadline = time.perf_counter() + args.drain
+    last_calls = -1
+    while time.perf_counter() < drain_deadline:
+        queued = application.update_queue.qsize() if application else 0
+        calls = sum(api.calls.values()) - api.calls['getUpdates']
+        if not api.pending_updates and not queued and calls == last_calls:
+            break
+        last_calls = calls
+        await asyncio.sleep(0.5)
+    elapsed = time.perf_counter() - start
+    backlog = api.pending_updates + (application.update_queue.qsize() if application else 0)
+
+    gc.collect()
+    snapshot = tracemalloc.take_snapshot() if args.tracemalloc else None
+    if application:
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        state = (len(main.active_searches), main.store.count_chats(), main.store.count_mapped())
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        await application.post_shutdown(application)
+    else:
+        shards.terminate()
+        await asyncio.get_running_loop().run_in_executor(None, shards.join)
+        # Самый большой из завершившихся дочерних процессов
+        rss_after = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    await api.stop()
+
+    # /start и три нажатия кнопок на каждую регистрацию
+    pushed = (stats['messages'] + stats['edits'] + stats['searches'] + stats['next'] + stats['stop']
+              + 4 * len(stats['time_to_register']))
+    api_calls = sum(n for method, n in api.calls.items() if method != 'getUpdates')
+    print(f"\nПользователей {args.users}, {elapsed:.1f} с (нагрузка {args.duration} с), "
+          f"задержка API {args.latency * 1000:.0f}±{args.jitter * 1000:.0f} мс, 429: {args.flood:.1%}, "
+          f"лимиты Telegram: {'да' if args.telegram_limits else 'нет'}, "
+          f"обновлений одновременно: {args.concurrent_updates}, процессов: {args.shards}")
+    print(f"Обновлений отправлено: {pushed} ({pushed / elapsed:.0f}/с), не обработано к концу: {backlog}")
+    print(f"  поисков {stats['searches']}, сообщений {stats['messages']}, правок {stats['edits']}, "
+          f"/next {stats['next']}, /stop {stats['stop']}, собеседник ушел {stats['partner_left']}")
+    print(f"Вызовов Bot API: {api_calls} ({api_calls / elapsed:.0f}/с), ответов 429: {sum(api.flooded.values())}")
+    for method, n in api.calls.most_common():
+        print(f"  {method:>18}: {n}")
+    print(f"Пересылка сообщения, мс: {describe(api.relay_latencies)} (n={len(api.relay_latencies)})")
+    print(f"Ответов (reply): отправлено {stats['replies']}, переслано ответом {api.threaded}")
+    print(f"Пересылка правки, мс:    {describe(api.edit_latencies)} (n={len(api.edit_latencies)})")
+    print(f"Регистрация, мс:         {describe(stats['time_to_register'])} (n={len(stats['time_to_register'])})")
+    print(f"До собеседника, мс:      {describe(stats['time_to_match'])} (n={len(stats['time_to_match'])})")
+    if application:
+        print(f"Планировщик отправки: {main.sender.counters}")
+        print(f"Состояние: в поиске {state[0]}, диалогов {state[1]}, записей соответствия {state[2]}")
+        print(f"Пиковый RSS: {rss_after / 1024:.1f} МиБ (до запуска бота {rss_before / 1024:.1f} МиБ)")
+    else:
+        print(f"Пиковый RSS процесса бота: {rss_after / 1024:.1f} МиБ")
+    if snapshot:
+        print("Крупнейшие места выделения памяти:")
+        for stat in snapshot.statistics('lineno')[:10]:
+            print(f"  {stat}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=30, help='время подачи нагрузки, секунды')
+    parser.add_argument('--ramp', type=float, default=5, help='за сколько секунд приходят все пользователи')
+    parser.add_argument('--drain', type=float, default=30, help='сколько ждать обработки хвоста, секунды')
+    parser.add_argument('--messages', type=int, default=8, help='сообщений от каждого за диалог')
+    parser.add_argument('--think', type=float, default=1.0, help='средняя пауза между сообщениями, секунды')
+    parser.add_argument('--reply-rate', type=float, default=0.3)
+    parser.add_argument('--edit-rate', type=float, default=0.1)
+    parser.add_argument('--latency', type=float, default=0.02, help='задержка заглушки Bot API, секунды')
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--flood', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--concurrent-updates', type=int, default=settings.CONCURRENT_UPDATES,
+                        help='обновлений одновременно (1 - по одному)')
+    parser.add_argument('--shards', type=int, default=1, help='процессов-воркеров (больше 1 - режим шардов)')
+    parser.add_argument('--telegram-limits', action='store_true', help='оставить лимиты отправки из settings')
+    parser.add_argument('--tracemalloc', action='store_true', help='показать места выделения памяти (медленно)')
+    parser.add_argument('--seed', type=int, default=1)
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,77 @@
+"""
+Бенчмарк поиска пары: линейный проход по словарю против MatchQueue.
+
+Худший случай для линейного поиска: в очереди N пользователей, никто из
+которых не подходит новичку, и один подходящий в самом конце.
+
+Запуск: python benchmarks/bench_matchmaking.py
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from matchmaking import MatchQueue
+
+SIZES = [100, 1_000, 10_000, 100_000]
+ROUNDS = 200
+
+
+def legacy_find(active_searches: dict, users: dict, user_id: int):
+    # Копия старого алгоритма find_partner
+    for uid, data in active_searches.items():
+        if uid == user_id:
+            continue
+        if not data['gender'] or data['gender'] == users[user_id]['gender']:
+            return uid
+    return None
+
+
+def bench_legacy(n: int) -> float:
+    users = {uid: {'gender': 'female'} for uid in range(n)}
+    # Все ожидающие ищут только девушек, новичок - парень
+    active_searches = {uid: {'gender': 'female'} for uid in range(n)}
+    total = 0.0
+    for i in range(ROUNDS):
+        newcomer, partner = n + 2 * i, n + 2 * i + 1
+        users[newcomer] = {'gender': 'male'}
+        users[partner] = {'gender': 'female'}
+        active_searches[partner] = {'gender': None}
+        start = time.perf_counter()
+        active_searches[newcomer] = {'gender': None}
+        found = legacy_find(active_searches, users, newcomer)
+        del active_searches[newcomer]
+        del active_searches[found]
+        total += time.perf_counter() - start
+    return total / ROUNDS
+
+
+def bench_queue(n: int) -> float:
+    queue = MatchQueue()
+    for uid in range(n):
+        queue.add(uid, 'female', 'female')
+    total = 0.0
+    for i in range(ROUNDS):
+        newcomer, partner = n + 2 * i, n + 2 * i + 1
+        queue.add(partner, 'female', None)
+        start = time.perf_counter()
+        queue.add(newcomer, 'male', None)
+        found = queue.pop_match(newcomer)
+        total += time.perf_counter() - start
+        assert found.user_id == partner
+    return total / ROUNDS
+
+
+def main():
+    # Прогрев интерпретатора, чтобы первая строка таблицы не искажалась
+    bench_queue(SIZES[0])
+    print(f"{'ожидающих':>10} | {'линейный, мкс':>14} | {'MatchQueue, мкс':>16}")
+    for n in SIZES:
+        legacy = bench_legacy(n) * 1e6
+        queue = bench_queue(n) * 1e6
+        print(f"{n:>10} | {legacy:>14.1f} | {queue:>16.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Память на соответствие сообщений: словарь int -> int против MessageMap.
+
+Каждое пересланное сообщение дает по записи у отправителя и у получателя,
+поэтому 10 000 сообщений в диалоге - это 20 000 записей.
+
+Запуск: python benchmarks/bench_message_map.py
+"""
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from message_map import MessageMap
+
+MESSAGES = 10_000
+# Реалистичные ID: больше диапазона кэшируемых Python маленьких int
+BASE_ID = 1_000_000
+
+
+def fill(make_map) -> tuple:
+    sender, receiver = make_map(), make_map()
+    for i in range(MESSAGES):
+        original, copy = BASE_ID + 2 * i, BASE_ID + 2 * i + 1
+        sender[original] = copy
+        receiver[copy] = original
+    return sender, receiver
+
+
+def measure(make_map) -> int:
+    tracemalloc.start()
+    maps = fill(make_map)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del maps
+    return size
+
+
+class _MapAdapter(MessageMap):
+    __slots__ = ()
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+
+def lookup_time(maps, rounds: int = 100_000) -> float:
+    sender = maps[0]
+    start = time.perf_counter()
+    for i in range(rounds):
+        sender.get(BASE_ID + 2 * (i % MESSAGES))
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    dict_bytes = measure(dict)
+    map_bytes = measure(lambda: _MapAdapter(window=MESSAGES))
+    print(f"{MESSAGES} сообщений в диалоге ({2 * MESSAGES} записей)")
+    print(f"  dict:       {dict_bytes / 1024:8.1f} КиБ")
+    print(f"  MessageMap: {map_bytes / 1024:8.1f} КиБ")
+    print(f"  экономия:   {(dict_bytes - map_bytes) / 1024:8.1f} КиБ ({dict_bytes / map_bytes:.1f}x)")
+
+    print("Поиск для reply:")
+    print(f"  dict:       {lookup_time(fill(dict)) * 1e9:6.0f} нс")
+    print(f"  MessageMap: {lookup_time(fill(lambda: _MapAdapter(window=MESSAGES))) * 1e9:6.0f} нс")
+
+    # Окно ограничивает память, сколько бы ни длился диалог
+    window = _MapAdapter(window=1_000)
+    for i in range(1_000_000):
+        window[i] = i
+    print(f"После 1 000 000 сообщений с окном 1000 хранится записей: {len(window)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Бенчмарк хранения профилей пользователей (profiles.ProfileTable).
+
+1. Память на --users пользователей (tracemalloc, вместе с самими user_id):
+   - прежний MemoryStore: словарь строк на пользователя;
+   - прежний кэш SQLiteStore: то же в OrderedDict, строки из базы у каждого свои;
+   - ProfileTable без ограничения и с max_size (кэш LRU).
+2. Скорость get_user() и save_user() в MemoryStore.
+3. SQLite: база на --users профилей, запись строками из ProfileTable.rows(),
+   загрузка кэша при открытии одним запросом против запроса на пользователя.
+
+Запуск: python benchmarks/bench_profiles.py --users 1000000
+"""
+import argparse
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from profiles import ProfileTable
+from storage import MemoryStore, SQLiteStore, _SAVE_USER_SQL, _SCHEMA
+
+COUNTRIES = ["Россия", "Украина", "Беларусь", "Казахстан", "Узбекистан", "Страны ЕС", "США", "Другая"]
+AGE_GROUPS = ["до 14 лет", "От 15 до 17 лет", "от 18 до 21 года", "от 22 до 25 лет", "от 26 до 35", "от 36 лет"]
+
+
+def profiles(n: int, seed: int) -> list:
+    """(user_id, gender, country, age): ID как у Telegram, поля - индексы в списках регистрации"""
+    rng = random.Random(seed)
+    return [(rng.randrange(10 ** 8, 8 * 10 ** 9), rng.randrange(2), rng.randrange(len(COUNTRIES)),
+             rng.randrange(len(AGE_GROUPS))) for _ in range(n)]
+
+
+def old_memory(rows: list) -> dict:
+    return {user_id: {'gender': ('male', 'female')[g], 'country': COUNTRIES[c], 'age': AGE_GROUPS[a]}
+            for user_id, g, c, a in rows}
+
+
+def fresh(value: str) -> str:
+    """Новый объект str, как в каждой строке результата SELECT"""
+    return value.encode().decode()
+
+
+def old_cache(rows: list) -> OrderedDict:
+    return OrderedDict((user_id, {'gender': fresh(('male', 'female')[g]), 'country': fresh(COUNTRIES[c]),
+                                  'age': fresh(AGE_GROUPS[a])}) for user_id, g, c, a in rows)
+
+
+def new_table(rows: list, max_size: int = None) -> ProfileTable:
+    table = ProfileTable(max_size)
+    for user_id, g, c, a in rows:
+        table.put(user_id, {'gender': fresh(('male', 'female')[g]), 'country': fresh(COUNTRIES[c]),
+                            'age': fresh(AGE_GROUPS[a])})
+    return table
+
+
+def measure(build, rows: list) -> float:
+    """Байт на пользователя, включая объекты user_id"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    rows = [(int(str(user_id)), g, c, a) for user_id, g, c, a in rows]
+    result = build(rows)
+    rows.clear()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def bench_memory(rows: list) -> None:
+    n = len(rows)
+    cases = (('словарь на пользователя (MemoryStore)', old_memory),
+             ('словарь в OrderedDict (кэш SQLiteStore)', old_cache),
+             ('ProfileTable', new_table),
+             ('ProfileTable с max_size', lambda r: new_table(r, max_size=len(r))))
+    for title, build in cases:
+        size = measure(build, rows)
+        print(f"  {title:42} {size / 2 ** 20:7.1f} МиБ, {size / n:4.0f} байт на пользователя")
+
+
+def bench_speed(rows: list) -> None:
+    store = MemoryStore()
+    n = len(rows)
+    start = time.perf_counter()
+    for user_id, g, c, a in rows:
+        store.save_user(user_id, {'gender': ('male', 'female')[g], 'country': COUNTRIES[c], 'age': AGE_GROUPS[a]})
+    save = time.perf_counter() - start
+    start = time.perf_counter()
+    for user_id, _, _, _ in rows:
+        store.get_user(user_id)['gender']
+    get = time.perf_counter() - start
+    print(f"  save_user {save / n * 1e9:.0f} нс, get_user {get / n * 1e9:.0f} нс")
+
+
+def bench_sqlite(rows: list, cache: int) -> None:
+    path = Path(tempfile.mkdtemp(prefix='bench-profiles-')) / 'bot.sqlite3'
+    table = new_table(rows)
+    conn = sqlite3.connect(path)
+    conn.executescript(_SCHEMA)
+    start = time.perf_counter()
+    with conn:
+        conn.executemany(_SAVE_USER_SQL, table.rows())
+    print(f"  запись {len(table)} профилей из ProfileTable.rows(): {time.perf_counter() - start:.1f} с")
+    conn.close()
+
+    start = time.perf_counter()
+    store = SQLiteStore(path, user_cache_size=cache)
+    store.open()
+    opened = time.perf_counter() - start
+    loaded = len(store.users)
+    print(f"  открытие с загрузкой {loaded} профилей одним запросом: {opened:.1f} с")
+    store.close()
+
+    store = SQLiteStore(path, user_cache_size=cache)
+    store.open()
+    store.users = ProfileTable(max_size=cache)
+    sample = [user_id for user_id, _, _, _ in rows[:min(cache, 100_000)]]
+    start = time.perf_counter()
+    for user_id in sample:
+        store.get_user(user_id)
+    lazy = time.perf_counter() - start
+    store.close()
+    print(f"  без загрузки - запрос на пользователя: {lazy / len(sample) * 1e6:.0f} мкс, "
+          f"на {loaded} профилей ~{lazy / len(sample) * loaded:.1f} с по ходу работы")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--cache', type=int, default=500_000, help='размер кэша SQLiteStore (USER_CACHE_SIZE)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rows = profiles(args.users, args.seed)
+
+    print(f"1. Память на {args.users} пользователей")
+    bench_memory(rows)
+    print("\n2. Скорость MemoryStore")
+    bench_speed(rows)
+    print("\n3. SQLite")
+    bench_sqlite(rows, args.cache)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Бенчмарк завершения простаивающих диалогов и поисков (reap_idle в main.py).
+
+Хранилище держит диалоги в порядке последней пересылки, очередь поиска -
+в порядке постановки, поэтому проход смотрит только истекшие записи.
+Для сравнения - прямой проход по словарю времени активности всех диалогов.
+
+1. Диалоги: --dialogues пар в памяти, стоимость отметки активности
+   при пересылке в случайных парах и проходы take_idle(),
+   когда истекает малая доля диалогов.
+2. Поиски: --searches пользователей в очереди, проходы take_stale().
+
+Запуск: python benchmarks/bench_reaper.py --dialogues 1000000
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from matchmaking import MatchQueue
+from storage import MemoryStore
+
+TIMEOUT = 1800.0
+
+
+def scan_idle(activity: dict, timeout: float, now: float) -> list:
+    """Прямой проход по всем диалогам"""
+    return [user_id for user_id, last in activity.items() if now - last >= timeout]
+
+
+def bench_dialogues(n: int, messages: int, expire: float, rng: random.Random) -> None:
+    store = MemoryStore()
+    start = time.perf_counter()
+    for i in range(n):
+        store.link(2 * i, 2 * i + 1)
+    print(f"  {n} диалогов созданы за {time.perf_counter() - start:.1f} с")
+
+    # Время активности равномерно за последние TIMEOUT секунд: истекает expire доля
+    now = time.monotonic()
+    for i, user_id in enumerate(store.chat_activity):
+        store.chat_activity[user_id] = now - TIMEOUT * (1 + expire) + TIMEOUT * (1 + expire) * i / n
+
+    users = [rng.randrange(2 * n) for _ in range(messages)]
+    start = time.perf_counter()
+    for user_id in users:
+        store.active_chats.get(user_id)
+    lookup = time.perf_counter() - start
+    start = time.perf_counter()
+    for user_id in users:
+        store._touch(user_id, store.active_chats.get(user_id))
+    touch = time.perf_counter() - start - lookup
+    start = time.perf_counter()
+    for i, user_id in enumerate(users[:messages // 10]):
+        store.map_message(user_id, i, i)
+    relay = (time.perf_counter() - start) / (messages // 10)
+    store.message_mapping.clear()
+    print(f"  отметка активности: {touch / messages * 1e9:.0f} нс на пересылку "
+          f"(map_message целиком {relay * 1e9:.0f} нс)")
+
+    activity = dict(store.chat_activity)
+    start = time.perf_counter()
+    naive = scan_idle(activity, TIMEOUT, now)
+    scan = time.perf_counter() - start
+    start = time.perf_counter()
+    idle = store.take_idle(TIMEOUT, now)
+    take = time.perf_counter() - start
+    start = time.perf_counter()
+    again = store.take_idle(TIMEOUT, now)
+    empty = time.perf_counter() - start
+    same = sorted(naive) == sorted(user_id for user_id, _ in idle)
+    print(f"  истекло {len(idle)}: take_idle {take * 1000:.1f} мс, "
+          f"проход по словарю {scan * 1000:.0f} мс; результаты совпадают: {same}")
+    print(f"  проход без истекших: take_idle {empty * 1e6:.1f} мкс (найдено {len(again)}), "
+          f"проход по словарю ~{scan * 1000:.0f} мс на каждой проверке")
+
+
+def bench_searches(n: int, expire: float) -> None:
+    queue = MatchQueue()
+    for i in range(n):
+        queue.add(i, 'male', None, None, 'Россия', 'от 18 до 21 года')
+    now = time.monotonic()
+    stale = int(n * expire)
+    for i, entry in enumerate(queue._entries.values()):
+        entry.since = now - TIMEOUT - 1 if i < stale else now
+    start = time.perf_counter()
+    naive = [entry.user_id for entry in queue if now - entry.since >= TIMEOUT]
+    scan = time.perf_counter() - start
+    start = time.perf_counter()
+    taken = queue.take_stale(TIMEOUT, now)
+    take = time.perf_counter() - start
+    start = time.perf_counter()
+    queue.take_stale(TIMEOUT, now)
+    empty = time.perf_counter() - start
+    print(f"  {n} в поиске, истекло {len(taken)}: take_stale {take * 1000:.1f} мс, "
+          f"проход по очереди {scan * 1000:.0f} мс; совпадают: {naive == [e.user_id for e in taken]}")
+    print(f"  проход без истекших: {empty * 1e6:.1f} мкс, в очереди осталось {len(queue)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dialogues', type=int, default=1_000_000)
+    parser.add_argument('--searches', type=int, default=200_000)
+    parser.add_argument('--messages', type=int, default=500_000, help='пересылок в замере отметки активности')
+    parser.add_argument('--expire', type=float, default=0.01, help='доля истекших к проходу')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    print("1. Диалоги")
+    bench_dialogues(args.dialogues, args.messages, args.expire, rng)
+    print("\n2. Поиски")
+    bench_searches(args.searches, args.expire)
+
+
+if __name__ == '__main__':
+    main()
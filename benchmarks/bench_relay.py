@@ -0,0 +1,151 @@
+"""
+Бенчмарк пересылки: старая цепочка send_* по типам против relay_message.
+
+Бот подменен заглушкой с фиксированной задержкой на вызов, чтобы
+сравнить число вызовов Bot API и время пересылки одного сообщения
+в обычном режиме и в режиме отладки (с префиксом).
+
+Запуск: python benchmarks/bench_relay.py
+"""
+import asyncio
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from telegram import (
+    Animation, Audio, Chat, Contact, Dice, Document, Location, Message, MessageEntity,
+    PhotoSize, Sticker, User, Video, VideoNote, Voice,
+)
+
+from relay import relay_message
+
+# Задержка одного вызова Bot API, секунды
+API_LATENCY = 0.02
+PREFIX = "🔧 [DEBUG]"
+
+
+class CountingBot:
+    def __init__(self):
+        self.calls = 0
+
+    async def call(self, method: str, **params):
+        self.calls += 1
+        await asyncio.sleep(API_LATENCY)
+        return Message(self.calls, datetime.now(), Chat(1, Chat.PRIVATE))
+
+    def __getattr__(self, method):
+        async def bound(*args, **params):
+            return await self.call(method, **params)
+        return bound
+
+
+async def legacy_send(bot, chat_id, message, debug_prefix=None, reply_to_message_id=None):
+    # Копия старой send_any_message
+    if message.video_note:
+        sent = await bot.send_video_note(chat_id=chat_id, video_note=message.video_note.file_id,
+                                         reply_to_message_id=reply_to_message_id)
+        return sent.message_id
+    text, caption, sent = message.text, message.caption, None
+    if debug_prefix:
+        if text:
+            text = f"{debug_prefix}: {text}"
+        if caption:
+            caption = f"{debug_prefix}: {caption}"
+    if text:
+        sent = await bot.send_message(chat_id=chat_id, text=text, reply_to_message_id=reply_to_message_id)
+    elif message.photo:
+        sent = await bot.send_photo(chat_id=chat_id, photo=message.photo[-1].file_id, caption=caption,
+                                    reply_to_message_id=reply_to_message_id)
+    elif message.video:
+        sent = await bot.send_video(chat_id=chat_id, video=message.video.file_id, caption=caption,
+                                    reply_to_message_id=reply_to_message_id)
+    elif message.document:
+        sent = await bot.send_document(chat_id=chat_id, document=message.document.file_id, caption=caption,
+                                       reply_to_message_id=reply_to_message_id)
+    elif message.audio:
+        sent = await bot.send_audio(chat_id=chat_id, audio=message.audio.file_id, caption=caption,
+                                    reply_to_message_id=reply_to_message_id)
+    elif message.voice:
+        if debug_prefix:
+            text_msg = await bot.send_message(chat_id=chat_id, text=f"{debug_prefix}: Голосовое сообщение",
+                                              reply_to_message_id=reply_to_message_id)
+            await bot.send_voice(chat_id=chat_id, voice=message.voice.file_id)
+            return text_msg.message_id
+        sent = await bot.send_voice(chat_id=chat_id, voice=message.voice.file_id,
+                                    reply_to_message_id=reply_to_message_id)
+    elif message.sticker:
+        if debug_prefix:
+            text_msg = await bot.send_message(chat_id=chat_id, text=f"{debug_prefix}: Стикер",
+                                              reply_to_message_id=reply_to_message_id)
+            await bot.send_sticker(chat_id=chat_id, sticker=message.sticker.file_id)
+            return text_msg.message_id
+        sent = await bot.send_sticker(chat_id=chat_id, sticker=message.sticker.file_id,
+                                      reply_to_message_id=reply_to_message_id)
+    return sent.message_id if sent else None
+
+
+def sample_messages() -> dict:
+    chat = Chat(42, Chat.PRIVATE)
+    user = User(42, 'user', False)
+
+    def make(**content):
+        return Message(1, datetime.now(), chat, from_user=user, **content)
+
+    return {
+        'текст': make(text='привет'),
+        'текст с разметкой': make(text='жирный текст', entities=[MessageEntity(MessageEntity.BOLD, 0, 6)]),
+        'фото с подписью': make(photo=[PhotoSize('p', 'p', 90, 90)], caption='фото'),
+        'видео': make(video=Video('v', 'v', 1, 1, 1)),
+        'документ': make(document=Document('d', 'd')),
+        'аудио': make(audio=Audio('a', 'a', 1)),
+        'голосовое': make(voice=Voice('vo', 'vo', 1)),
+        'стикер': make(sticker=Sticker('s', 's', 1, 1, False, False, Sticker.REGULAR)),
+        'кружок': make(video_note=VideoNote('n', 'n', 1, 1)),
+        'GIF': make(animation=Animation('g', 'g', 1, 1, 1)),
+        'геопозиция': make(location=Location(1.0, 2.0)),
+        'контакт': make(contact=Contact('+100', 'Имя')),
+        'кубик': make(dice=Dice(3, Dice.DICE)),
+    }
+
+
+async def measure(send, message, prefix) -> tuple:
+    bot = CountingBot()
+    start = time.perf_counter()
+    result = await send(bot, message, prefix)
+    return bot.calls, (time.perf_counter() - start) * 1000, result is not None
+
+
+async def main():
+    async def old(bot, message, prefix):
+        return await legacy_send(bot, 1, message, prefix)
+
+    async def new(bot, message, prefix):
+        return await relay_message(bot.call, 1, message, prefix)
+
+    totals = {'old': [0, 0.0, 0], 'new': [0, 0.0, 0]}
+    for prefix in (None, PREFIX):
+        print(f"\nРежим: {'отладка' if prefix else 'обычный'} (задержка API {API_LATENCY * 1000:.0f} мс)")
+        print(f"{'тип':>18} | {'старый: вызовов, мс':>22} | {'новый: вызовов, мс':>22}")
+        for name, message in sample_messages().items():
+            row = []
+            for key, send in (('old', old), ('new', new)):
+                calls, ms, delivered = await measure(send, message, prefix)
+                if delivered:
+                    totals[key][0] += calls
+                    totals[key][1] += ms
+                    totals[key][2] += 1
+                row.append(f"{calls:>3}, {ms:6.1f}" if delivered else f"{'потеряно':>11}")
+            print(f"{name:>18} | {row[0]:>22} | {row[1]:>22}")
+
+    count = 2 * len(sample_messages())
+    for key, title in (('old', 'старый'), ('new', 'новый')):
+        calls, ms, delivered = totals[key]
+        print(f"{title}: доставлено {delivered}/{count}, на доставленное сообщение "
+              f"{calls / delivered:.2f} вызова API и {ms / delivered:.1f} мс")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,141 @@
+"""
+Бенчмарк рассылки сообщения по анонимной комнате (post_to_room в main.py).
+
+Бот собирается как в main() и работает против локальной заглушки Bot API.
+В комнату из --sizes участников один пишет сообщение, замеряется время от
+отправки до получения копии каждым участником:
+- параллельно: как в боте, каждая копия - своя задача в очереди чата
+  получателя, общий лимит отправки соблюдает планировщик;
+- последовательно: N вызовов send_any_message подряд.
+
+Часть участников (--blocked) заблокировала бота, а у --slow участников
+заглушка отвечает на --slow-latency секунд дольше обычного.
+Больше SEND_GLOBAL_RATE копий в секунду не уходит ни в одном режиме.
+
+Запуск: python benchmarks/bench_rooms.py --sizes 10,100,1000
+"""
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import settings
+
+settings.METRICS_PORT = None
+
+import main
+from rooms import RoomDirectory
+from sender import BULK, SendScheduler
+from storage import MemoryStore
+
+from bench_load import describe
+from fake_bot_api import FakeBotAPI
+
+TOKEN = '123456:ROOMS'
+PROFILE = {'gender': 'male', 'country': 'Россия', 'age': 'от 18 до 21 года'}
+
+
+def sequential_post(context, user_id: int, messages: list) -> bool:
+    """Прежний подход: копии уходят по одной, каждая ждет предыдущую"""
+    post = main.rooms.post(user_id, [message.message_id for message in messages])
+    if post is None:
+        return False
+    room_id, number, seqs, targets = post
+
+    async def relay() -> None:
+        for member_id, reply_id in targets:
+            sent_id = await main.send_any_message(context, member_id, messages[0], main.room_prefix(number),
+                                                  reply_id, BULK)
+            if sent_id:
+                main.rooms.record(room_id, member_id, seqs, [sent_id])
+
+    context.application.create_task(relay())
+    return True
+
+
+async def wait_idle(api: FakeBotAPI) -> None:
+    while api.pending_updates or main.sender.stats()['queued'] or main.sender.stats()['in_flight']:
+        await asyncio.sleep(0.05)
+
+
+async def fan_out(api: FakeBotAPI, members: list, args, rng: random.Random) -> tuple:
+    """Одно сообщение в комнату: (задержки получателей, время до последнего)"""
+    main.rooms = RoomDirectory(('Бенчмарк',), capacity=len(members))
+    for user_id in members:
+        main.store.save_user(user_id, PROFILE)
+        main.rooms.join(user_id, 1)
+    author, others = members[0], members[1:]
+    api.blocked = set(rng.sample(others, int(len(others) * args.blocked)))
+    api.slow = {user_id: args.slow_latency
+                for user_id in rng.sample([u for u in others if u not in api.blocked], min(args.slow, len(others)))}
+    receivers = [user_id for user_id in others if user_id not in api.blocked]
+
+    start = time.perf_counter()
+    api.push_message(author, 'всем привет')
+    latencies = []
+    deadline = start + args.timeout
+    for user_id in receivers:
+        try:
+            delivery = await asyncio.wait_for(api.inbox(user_id).get(), max(deadline - time.perf_counter(), 0.01))
+        except asyncio.TimeoutError:
+            continue
+        latencies.append(delivery.at - start)
+    await wait_idle(api)
+    return latencies, len(receivers)
+
+
+async def run(args) -> None:
+    api = FakeBotAPI(TOKEN, latency=args.latency, jitter=args.jitter, seed=args.seed)
+    await api.start()
+    main.store = MemoryStore()
+    main.sender = SendScheduler(
+        global_rate=settings.SEND_GLOBAL_RATE, global_burst=settings.SEND_GLOBAL_BURST,
+        chat_rate=settings.SEND_CHAT_RATE, chat_burst=settings.SEND_CHAT_BURST)
+    application = main.build_application(TOKEN, base_url=api.url, serve_mode='polling')
+    await application.initialize()
+    await application.updater.start_polling(poll_interval=0, timeout=1)
+    await application.start()
+    print(f"Лимит отправки {settings.SEND_GLOBAL_RATE:g}/с, задержка API {args.latency * 1000:.0f}"
+          f"±{args.jitter * 1000:.0f} мс; заблокировали бота {args.blocked:.0%}, "
+          f"медленных {args.slow} (+{args.slow_latency:g} с)")
+
+    concurrent = main.post_to_room
+    next_id = 100_000
+    for size in args.sizes:
+        print(f"\nКомната на {size} участников")
+        for title, post in (('параллельно', concurrent), ('последовательно', sequential_post)):
+            main.post_to_room = post
+            members = list(range(next_id, next_id + size))
+            next_id += size
+            latencies, receivers = await fan_out(api, members, args, random.Random(args.seed + size))
+            last = max(latencies) if latencies else 0.0
+            print(f"  {title:16} получили {len(latencies)} из {receivers} за {last:.2f} с, "
+                  f"задержка (мс) {describe(latencies)}")
+            # Полный лимит к следующему замеру
+            await asyncio.sleep(settings.SEND_GLOBAL_BURST / settings.SEND_GLOBAL_RATE)
+    main.post_to_room = concurrent
+
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    await main.sender.close()
+    await api.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=lambda s: [int(x) for x in s.split(',')], default=[10, 100, 1000])
+    parser.add_argument('--blocked', type=float, default=0.05, help='доля участников, заблокировавших бота')
+    parser.add_argument('--slow', type=int, default=1, help='участников с медленными ответами API')
+    parser.add_argument('--slow-latency', type=float, default=2.0, help='их дополнительная задержка, с')
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка заглушки Bot API, секунды')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--timeout', type=float, default=300.0, help='сколько ждать доставки, с')
+    parser.add_argument('--seed', type=int, default=1)
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(run(parser.parse_args()))
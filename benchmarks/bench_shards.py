@@ -0,0 +1,175 @@
+"""
+Бенчмарк режима шардов: один процесс против координатора с воркерами.
+
+--pairs пар пользователей заранее в диалогах и пишут собеседникам с общей
+частотой --rate сообщений в секунду в течение --duration секунд. Бот
+работает в отдельном процессе (воркеры - его дочерние процессы),
+заглушка Bot API - в процессе бенчмарка.
+
+Для каждого числа процессов из --shards (1 - обычный режим без координатора):
+- сколько пересылок доставлено и их задержка;
+- процессорное время на обновление у координатора и у воркеров (из /proc);
+- обращений воркеров к общему состоянию на обновление;
+- предельная пропускная способность, если у каждого процесса свое ядро:
+  для одного процесса 1 / время на обновление, для шардов -
+  min(1 / время координатора, N / время воркеров).
+На машине с одним ядром процессы делят его, и измеренная задержка шардов
+выше, чем у одного процесса: там важна именно последняя оценка.
+
+Запуск: python benchmarks/bench_shards.py --shards 1,2,4 --rate 100
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import settings
+
+settings.METRICS_PORT = None
+
+import main
+from sender import SendScheduler
+from sharding import run_sharded
+from storage import MemoryStore
+
+from bench_load import describe
+from fake_bot_api import FakeBotAPI
+
+TOKEN = main.TOKEN
+PROFILE = {'gender': 'male', 'country': 'Россия', 'age': 'от 18 до 21 года'}
+_TICK = os.sysconf('SC_CLK_TCK')
+
+
+def serve(shards: int, overrides: dict, pairs: int, result_path: str) -> None:
+    """Процесс бота (spawn): пары уже в диалогах, остановка - SIGTERM"""
+    vars(settings).update(overrides)
+    store = MemoryStore(map_window=settings.MESSAGE_MAP_WINDOW, map_ttl=settings.MESSAGE_MAP_TTL)
+    for i in range(pairs):
+        a, b = 100_000 + 2 * i, 100_001 + 2 * i
+        store.save_user(a, PROFILE)
+        store.save_user(b, PROFILE)
+        store.link(a, b)
+
+    calls = {}
+    if shards > 1:
+        coordinator = run_sharded(shards, store, main.ALLOWED_UPDATES, main.matcher)
+        calls = dict(coordinator.state.calls)
+    else:
+        main.store = store
+        main.sender = SendScheduler(global_rate=1e6, global_burst=1e6, chat_rate=1e6, chat_burst=1e6,
+                                    max_queue=10 ** 7)
+        application = main.build_application(TOKEN, base_url=settings.BOT_API_BASE_URL, serve_mode='polling')
+        application.run_polling(allowed_updates=main.ALLOWED_UPDATES, poll_interval=0, timeout=1)
+    Path(result_path).write_text(json.dumps({'calls': calls}))
+
+
+def cpu_times(root: int) -> dict:
+    """pid -> процессорное время (с) для процесса root и его дочерних"""
+    times = {}
+    for entry in Path('/proc').iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / 'stat').read_text()
+        except OSError:
+            continue
+        fields = stat[stat.rindex(')') + 2:].split()
+        pid, ppid = int(entry.name), int(fields[1])
+        if pid == root or ppid == root:
+            times[pid] = (int(fields[11]) + int(fields[12])) / _TICK
+    return times
+
+
+async def measure(shards: int, args) -> dict:
+    api = FakeBotAPI(TOKEN, latency=args.latency, jitter=args.jitter, seed=args.seed)
+    await api.start()
+    result_path = Path(tempfile.mkdtemp(prefix='bench-shards-')) / 'result.json'
+    overrides = {'BOT_API_BASE_URL': api.url, 'SERVE_MODE': 'polling', 'STORAGE_BACKEND': 'memory',
+                 'FLOOD_RATE': 0, 'SEND_GLOBAL_RATE': 1e6, 'SEND_GLOBAL_BURST': 1e6,
+                 'SEND_CHAT_RATE': 1e6, 'SEND_CHAT_BURST': 1e6, 'SEND_MAX_QUEUE': 10 ** 7}
+    process = multiprocessing.get_context('spawn').Process(
+        target=serve, args=(shards, overrides, args.pairs, str(result_path)))
+    process.start()
+    while api.calls['getMe'] < shards:
+        await asyncio.sleep(0.1)
+    await asyncio.sleep(args.warmup)
+
+    rng = random.Random(args.seed)
+    users = range(100_000, 100_000 + 2 * args.pairs)
+    before = cpu_times(process.pid)
+    start = time.perf_counter()
+    sent = 0
+    while (now := time.perf_counter()) - start < args.duration:
+        due = int((now - start) * args.rate)
+        while sent < due:
+            api.push_message(rng.choice(users), 'привет')
+            sent += 1
+        await asyncio.sleep(0.01)
+
+    deadline = time.perf_counter() + args.drain
+    while len(api.relay_latencies) < sent and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    elapsed = time.perf_counter() - start
+    after = cpu_times(process.pid)
+
+    process.terminate()
+    await asyncio.get_running_loop().run_in_executor(None, process.join)
+    await api.stop()
+    result = json.loads(result_path.read_text()) if result_path.exists() else {}
+
+    cpu = {pid: after[pid] - before.get(pid, 0.0) for pid in after}
+    coordinator = cpu.get(process.pid, 0.0)
+    workers = sum(seconds for pid, seconds in cpu.items() if pid != process.pid)
+    return {'sent': sent, 'delivered': len(api.relay_latencies), 'elapsed': elapsed,
+            'latencies': api.relay_latencies, 'coordinator': coordinator, 'workers': workers,
+            'calls': result.get('calls', {})}
+
+
+def report(shards: int, m: dict) -> None:
+    sent = m['sent']
+    print(f"\n{'Один процесс' if shards == 1 else f'Координатор и {shards} воркера(ов)'}")
+    print(f"  доставлено {m['delivered']} из {sent} за {m['elapsed']:.1f} с, задержка (мс) {describe(m['latencies'])}")
+    if shards == 1:
+        per_update = (m['coordinator'] + m['workers']) / sent
+        print(f"  процессор на обновление: {per_update * 1000:.2f} мс")
+        print(f"  предел при отдельном ядре: {1 / per_update:.0f} обновлений/с")
+        return
+    coordinator, workers = m['coordinator'] / sent, m['workers'] / sent
+    print(f"  процессор на обновление: координатор {coordinator * 1000:.2f} мс, "
+          f"воркеры {workers * 1000:.2f} мс (всего {(coordinator + workers) * 1000:.2f})")
+    calls = sorted(m['calls'].items(), key=lambda item: -item[1])
+    print(f"  обращений к общему состоянию на обновление: {sum(m['calls'].values()) / sent:.2f} ("
+          + ", ".join(f"{method} {n / sent:.2f}" for method, n in calls[:4]) + ")")
+    limit = min(1 / coordinator if coordinator else float('inf'), shards / workers)
+    print(f"  предел при ядре на каждый процесс: {limit:.0f} обновлений/с")
+
+
+async def run(args) -> None:
+    print(f"Пар в диалогах {args.pairs}, {args.rate:g} сообщений/с {args.duration:g} с, "
+          f"задержка API {args.latency * 1000:.0f}±{args.jitter * 1000:.0f} мс, ядер {os.cpu_count()}")
+    for shards in args.shards:
+        report(shards, await measure(shards, args))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=lambda s: [int(x) for x in s.split(',')], default=[1, 2, 4])
+    parser.add_argument('--pairs', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=100.0, help='сообщений в секунду от всех пользователей')
+    parser.add_argument('--duration', type=float, default=20.0, help='время подачи нагрузки, с')
+    parser.add_argument('--warmup', type=float, default=2.0, help='пауза после запуска бота, с')
+    parser.add_argument('--drain', type=float, default=30.0, help='сколько ждать доставки хвоста, с')
+    parser.add_argument('--latency', type=float, default=0.02, help='задержка заглушки Bot API, секунды')
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=1)
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(parser.parse_args()))
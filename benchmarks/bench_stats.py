@@ -0,0 +1,101 @@
+"""
+Бенчмарк статистики /top и /search.
+
+Хранилище и очередь поиска заполняются как у большого бота: --users
+зарегистрированных, --searches в поиске, --dialogues диалогов. Сравнивается
+подсчет по счетчикам (render_top и render_search из main) с подсчетом
+обходом всех пользователей, очереди и диалогов, затем - поток из
+--requests запросов /top с кэшем ответа: сколько раз ответ считался заново.
+
+Запуск: python benchmarks/bench_stats.py --users 1000000
+"""
+import argparse
+import random
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import settings
+
+settings.METRICS_PORT = None
+
+import main
+from matchmaking import MatchQueue
+from storage import MemoryStore
+
+GENDERS = ('male', 'female')
+
+
+def populate(args, rng: random.Random) -> None:
+    main.store = MemoryStore()
+    main.active_searches = MatchQueue(main.matcher)
+    for user_id in range(1, args.users + 1):
+        main.store.save_user(user_id, {'gender': rng.choice(GENDERS), 'country': rng.choice(main.COUNTRIES),
+                                       'age': rng.choice(main.AGE_GROUPS)})
+    users = rng.sample(range(1, args.users + 1), 2 * args.dialogues + args.searches)
+    for i in range(args.dialogues):
+        main.store.link(users[2 * i], users[2 * i + 1])
+    for user_id in users[2 * args.dialogues:]:
+        profile = main.store.get_user(user_id)
+        main.active_searches.add(user_id, profile['gender'], rng.choice(GENDERS + (None,)), None,
+                                 profile['country'], profile['age'])
+
+
+def scan_stats() -> tuple:
+    """Те же числа обходом всех данных"""
+    countries, ages, wanted = Counter(), Counter(), Counter()
+    for user_id in main.store.users:
+        profile = main.store.users.get(user_id)
+        countries[profile['country']] += 1
+        ages[profile['age']] += 1
+    for entry in main.active_searches:
+        wanted[entry.wanted] += 1
+    chats = sum(1 for user_id, partner_id in main.store.active_chats.items() if user_id < partner_id)
+    return countries, ages, wanted, chats
+
+
+def timed(function, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def run(args) -> None:
+    start = time.perf_counter()
+    populate(args, random.Random(args.seed))
+    print(f"Пользователей {args.users}, в поиске {args.searches}, диалогов {args.dialogues} "
+          f"(заполнено за {time.perf_counter() - start:.0f} с)\n")
+
+    print("1. Подсчет одного ответа")
+    print(f"  счетчики: /top {timed(main.render_top, 100) * 1e6:.0f} мкс, "
+          f"/search {timed(main.render_search, 100) * 1e6:.0f} мкс")
+    print(f"  обход данных: {timed(scan_stats, 1) * 1000:.0f} мс")
+
+    print(f"\n2. Поток из {args.requests} запросов /top, кэш {settings.STATS_CACHE_TTL:g} с")
+    renders = 0
+
+    def render() -> str:
+        nonlocal renders
+        renders += 1
+        return main.render_top()
+
+    main.stats_cache.clear()
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        main.cached_stats('top', render)
+    elapsed = time.perf_counter() - start
+    print(f"  {elapsed * 1000:.0f} мс ({elapsed / args.requests * 1e6:.1f} мкс на запрос), ответ считался {renders} раз")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--searches', type=int, default=50_000)
+    parser.add_argument('--dialogues', type=int, default=100_000)
+    parser.add_argument('--requests', type=int, default=100_000, help='запросов /top в потоке')
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
@@ -0,0 +1,351 @@
+"""
+Локальная заглушка Bot API для нагрузочного тестирования.
+
+Отвечает на методы, которые использует бот (getUpdates, sendMessage,
+copyMessage, sendMediaGroup, edit*, deleteMessage, ...), с настраиваемой
+задержкой и случайными ответами 429 (flood control). Чаты из blocked
+отвечают 403, как заблокировавшие бота пользователи. Обновления от
+"пользователей" кладутся методами push_*, а все, что бот отправил в чат,
+попадает в очередь inbox(chat_id).
+
+Бот подключается к заглушке через BOT_API_BASE_URL (или base_url в
+main.build_application). Отдельный запуск:
+
+    python benchmarks/fake_bot_api.py --port 8081 --latency 0.05 --flood 0.01
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from urllib.parse import parse_qsl
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from httpserver import HTTPServer, Request
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'LoadTestBot', 'username': 'load_test_bot'}
+
+# Методы, которые не подвергаются искусственному flood control
+_SERVICE_METHODS = {'getMe', 'getUpdates', 'deleteWebhook', 'setWebhook', 'getWebhookInfo', 'close', 'logOut'}
+# Параметры, которые PTB передает строкой без JSON-кодирования
+_RAW_PARAMS = {'text', 'caption', 'callback_query_id', 'media_group_id', 'parse_mode'}
+
+
+class Delivery:
+    """Запрос бота, адресованный чату: то, что увидел бы пользователь"""
+    __slots__ = ('method', 'params', 'message_id', 'at')
+
+    def __init__(self, method: str, params: dict, message_id: int, at: float):
+        self.method = method
+        self.params = params
+        self.message_id = message_id
+        self.at = at
+
+    @property
+    def text(self) -> str:
+        return self.params.get('text') or ''
+
+
+class FakeBotAPI:
+    def __init__(self, token: str, host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0.0, jitter: float = 0.0, flood_rate: float = 0.0, retry_after: int = 1,
+                 seed: int = None, method_latency: dict = None):
+        self.token = token
+        self.latency = latency
+        # Метод -> своя задержка (например, медленная загрузка медиа)
+        self.method_latency = method_latency or {}
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._server = HTTPServer(host, port)
+
+        self._updates = []
+        self._next_update_id = 1
+        self._updates_event = asyncio.Event()
+        self._message_ids = {}
+        self._inboxes = {}
+
+        # (чат, сообщение) -> время появления сообщения пользователя или его правки
+        self._sent_at = {}
+        self._edited_at = {}
+        # (чат, копия) -> (чат, оригинал): для замера задержки пересылки правок
+        self._copies = {}
+
+        # Чаты пользователей, заблокировавших бота
+        self.blocked = set()
+        # Чат -> дополнительная задержка ответа (медленный получатель)
+        self.slow = {}
+
+        self.calls = Counter()
+        self.flooded = Counter()
+        # Запросы в чаты из blocked, получившие 403
+        self.forbidden = Counter()
+        self.relay_latencies = []
+        self.edit_latencies = []
+        # Пересылки, которые пришли ответом на сообщение (reply сохранился)
+        self.threaded = 0
+
+    # --- Сервер ---
+
+    @property
+    def url(self) -> str:
+        return f"http://{self._server.host}:{self._server.bound_port}"
+
+    async def start(self) -> None:
+        await self._server.start()
+        self._route_all()
+
+    async def stop(self) -> None:
+        # Будим долгий опрос getUpdates, чтобы соединения закрылись до остановки цикла
+        self._updates_event.set()
+        await asyncio.sleep(0)
+        await self._server.stop()
+
+    def _route_all(self) -> None:
+        for name in dir(self):
+            if name.startswith('api_'):
+                method = name[4:]
+                self._server.route(f"/bot{self.token}/{method}", self._make_route(method), ('GET', 'POST'))
+
+    def _make_route(self, method: str):
+        handler = getattr(self, f'api_{method}')
+
+        async def route(request: Request) -> tuple:
+            self.calls[method] += 1
+            params = self._parse(request)
+            if method not in _SERVICE_METHODS:
+                latency = self.method_latency.get(method, self.latency)
+                if self.slow:
+                    latency += self.slow.get(int(params.get('chat_id') or 0), 0.0)
+                if latency or self.jitter:
+                    await asyncio.sleep(latency + self._random.random() * self.jitter)
+                if self.flood_rate and self._random.random() < self.flood_rate:
+                    self.flooded[method] += 1
+                    return self._reply(False, error_code=429,
+                                       description=f"Too Many Requests: retry after {self.retry_after}",
+                                       parameters={'retry_after': self.retry_after})
+                if self.blocked and int(params.get('chat_id') or 0) in self.blocked:
+                    self.forbidden[method] += 1
+                    return self._reply(False, error_code=403, description="Forbidden: bot was blocked by the user")
+            return self._reply(True, result=await handler(params))
+
+        return route
+
+    @staticmethod
+    def _parse(request: Request) -> dict:
+        if request.headers.get('content-type', '').startswith('application/json'):
+            return json.loads(request.body or b'{}')
+        params = {}
+        for name, value in parse_qsl(request.body.decode() or request.query, keep_blank_values=True):
+            if name in _RAW_PARAMS:
+                params[name] = value
+                continue
+            try:
+                params[name] = json.loads(value)
+            except ValueError:
+                params[name] = value
+        return params
+
+    @staticmethod
+    def _reply(ok: bool, **fields) -> tuple:
+        status = fields.get('error_code', 200)
+        body = json.dumps({'ok': ok, **fields}, ensure_ascii=False).encode()
+        return status, 'application/json', body
+
+    # --- Состояние чатов ---
+
+    def next_message_id(self, chat_id: int) -> int:
+        message_id = self._message_ids.get(chat_id, 0) + 1
+        self._message_ids[chat_id] = message_id
+        return message_id
+
+    def inbox(self, chat_id: int) -> asyncio.Queue:
+        queue = self._inboxes.get(chat_id)
+        if queue is None:
+            queue = self._inboxes[chat_id] = asyncio.Queue()
+        return queue
+
+    def _deliver(self, method: str, params: dict, message_id: int = None) -> Delivery:
+        delivery = Delivery(method, params, message_id, time.perf_counter())
+        self.inbox(int(params['chat_id'])).put_nowait(delivery)
+        return delivery
+
+    def _message(self, chat_id: int, message_id: int, **content) -> dict:
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': f'user{chat_id}'},
+            'from': BOT_USER,
+            **content,
+        }
+
+    # --- Обновления от пользователей ---
+
+    def _push(self, kind: str, payload: dict) -> int:
+        update_id = self._next_update_id
+        self._next_update_id += 1
+        self._updates.append({'update_id': update_id, kind: payload})
+        self._updates_event.set()
+        return update_id
+
+    def _user(self, user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+
+    def push_message(self, user_id: int, text: str = None, reply_to: int = None, **content) -> int:
+        """Сообщение пользователя боту. Возвращает его message_id"""
+        message_id = self.next_message_id(user_id)
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': f'user{user_id}'},
+            'from': self._user(user_id),
+            **content,
+        }
+        if text is not None:
+            message['text'] = text
+            if text.startswith('/'):
+                command = text.split()[0]
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        if reply_to is not None:
+            message['reply_to_message'] = self._message(user_id, reply_to, text='...')
+        self._sent_at[(user_id, message_id)] = time.perf_counter()
+        self._push('message', message)
+        return message_id
+
+    def push_edit(self, user_id: int, message_id: int, text: str = None, **content) -> None:
+        """Правка сообщения пользователя: новый текст или content (photo=[...], caption=...)"""
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'edit_date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': f'user{user_id}'},
+            'from': self._user(user_id),
+            **content,
+        }
+        if text is not None:
+            message['text'] = text
+        self._edited_at[(user_id, message_id)] = time.perf_counter()
+        self._push('edited_message', message)
+
+    def push_callback(self, user_id: int, message_id: int, data: str) -> None:
+        self._push('callback_query', {
+            'id': str(self._next_update_id),
+            'from': self._user(user_id),
+            'chat_instance': str(user_id),
+            'message': self._message(user_id, message_id, text='...'),
+            'data': data,
+        })
+
+    @property
+    def pending_updates(self) -> int:
+        return len(self._updates)
+
+    # --- Методы Bot API ---
+
+    async def api_getMe(self, params: dict):
+        return BOT_USER
+
+    async def api_deleteWebhook(self, params: dict):
+        return True
+
+    async def api_setWebhook(self, params: dict):
+        return True
+
+    async def api_getUpdates(self, params: dict):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+        # Подтвержденные обновления больше не отдаются
+        if offset:
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+        if not self._updates and timeout:
+            self._updates_event.clear()
+            try:
+                await asyncio.wait_for(self._updates_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    async def api_sendMessage(self, params: dict):
+        chat_id = int(params['chat_id'])
+        message_id = self.next_message_id(chat_id)
+        self._deliver('sendMessage', params, message_id)
+        return self._message(chat_id, message_id, text=params.get('text', ''))
+
+    async def api_copyMessage(self, params: dict):
+        chat_id = int(params['chat_id'])
+        message_id = self.next_message_id(chat_id)
+        source = (int(params['from_chat_id']), int(params['message_id']))
+        sent_at = self._sent_at.pop(source, None)
+        delivery = self._deliver('copyMessage', params, message_id)
+        if sent_at is not None:
+            self.relay_latencies.append(delivery.at - sent_at)
+        self._copies[(chat_id, message_id)] = source
+        if params.get('reply_parameters') or params.get('reply_to_message_id'):
+            self.threaded += 1
+        return {'message_id': message_id}
+
+    async def api_sendMediaGroup(self, params: dict):
+        chat_id = int(params['chat_id'])
+        sent = []
+        for item in params.get('media') or []:
+            message_id = self.next_message_id(chat_id)
+            sent.append(self._message(chat_id, message_id, caption=item.get('caption')))
+        self._deliver('sendMediaGroup', params, sent[0]['message_id'] if sent else None)
+        return sent
+
+    async def _edit(self, method: str, params: dict):
+        chat_id = int(params['chat_id'])
+        message_id = int(params['message_id'])
+        delivery = self._deliver(method, params, message_id)
+        source = self._copies.get((chat_id, message_id))
+        edited_at = self._edited_at.pop(source, None) if source else None
+        if edited_at is not None:
+            self.edit_latencies.append(delivery.at - edited_at)
+        return self._message(chat_id, message_id, text=params.get('text', ''))
+
+    async def api_editMessageText(self, params: dict):
+        return await self._edit('editMessageText', params)
+
+    async def api_editMessageCaption(self, params: dict):
+        return await self._edit('editMessageCaption', params)
+
+    async def api_editMessageMedia(self, params: dict):
+        return await self._edit('editMessageMedia', params)
+
+    async def api_deleteMessage(self, params: dict):
+        self._deliver('deleteMessage', params, int(params['message_id']))
+        return True
+
+    async def api_answerCallbackQuery(self, params: dict):
+        return True
+
+
+async def _serve(args) -> None:
+    api = FakeBotAPI(args.token, args.host, args.port, args.latency, args.jitter, args.flood, args.retry_after)
+    await api.start()
+    print(f"Заглушка Bot API: {api.url} (BOT_API_BASE_URL)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--token', default='123456:TEST')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа, секунды')
+    parser.add_argument('--jitter', type=float, default=0.0, help='случайная добавка к задержке, секунды')
+    parser.add_argument('--flood', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from pathlib import Path
+
+import metrics
+from sender import BULK, TokenBucket, is_dead_chat
+
+
+class Broadcast:
+    """
+    Рассылка одного сообщения всем зарегистрированным пользователям.
+
+    Получатели читаются из хранилища порциями по chunk_size в порядке
+    user_id. Отправка идет через планировщик с приоритетом BULK не быстрее
+    rate сообщений в секунду и не больше window запросов сразу, поэтому
+    пересылка в диалогах всегда обгоняет рассылку, а очередь планировщика
+    не раздувается.
+
+    Состояние (сообщение, счетчики и cursor - user_id, до которого все
+    обработано) раз в checkpoint_interval секунд сохраняется в файл. После
+    сбоя рассылка продолжается с cursor: повторно сообщение могут получить
+    только те, кому оно ушло после последнего сохранения. Остановить
+    рассылку из другого процесса можно через request_stop(): файл
+    состояния пишет только процесс, который ее ведет. Заблокировавшие
+    бота и удаленные аккаунты только считаются в state['dead']: отметку
+    недоступности хранит хранилище, и оно само их больше не отдает.
+    Размер состояния не зависит от числа получателей, а файл пишется
+    в отдельном потоке, чтобы сохранение не задерживало цикл бота.
+    """
+
+    def __init__(self, state: dict, path: str, rate: float = 10.0, chunk_size: int = 500, window: int = 50,
+                 checkpoint_interval: float = 5.0):
+        self.state = state
+        self.path = Path(path)
+        self.rate = rate
+        self.chunk_size = chunk_size
+        self.window = window
+        self.checkpoint_interval = checkpoint_interval
+        self.stop_path = self.path.with_name(self.path.name + '.stop')
+        # Обработано в этом запуске и его начало (для скорости)
+        self._processed = 0
+        self._started = None
+
+    @classmethod
+    def create(cls, admin_id: int, message: dict, total: int, path: str, **options) -> 'Broadcast':
+        """message - {'text': ...} или {'from_chat_id': ..., 'message_id': ...} для копии сообщения"""
+        state = {
+            'id': int(time.time()), 'admin_id': admin_id, 'message': message, 'total': total,
+            'cursor': 0, 'sent': 0, 'failed': 0, 'dead': 0,
+            'done': False, 'cancelled': False,
+        }
+        return cls(state, path, **options)
+
+    @classmethod
+    def load(cls, path: str, **options) -> 'Broadcast':
+        """Незавершенная рассылка из файла состояния или None"""
+        try:
+            state = json.loads(Path(path).read_text())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.error(f"Не удалось прочитать состояние рассылки {path}: {e}")
+            return None
+        if isinstance(state.get('dead'), list):
+            # Старый формат: список недоступных получателей
+            state['dead'] = len(state['dead'])
+        return cls(state, path, **options)
+
+    @property
+    def active(self) -> bool:
+        return not (self.state['done'] or self.state['cancelled'])
+
+    @property
+    def processed(self) -> int:
+        return self.state['sent'] + self.state['failed'] + self.state['dead']
+
+    def send_rate(self) -> float:
+        """Достигнутая скорость отправки в этом запуске, сообщений в секунду"""
+        if self._started is None:
+            return 0.0
+        return self._processed / max(time.monotonic() - self._started, 1e-9)
+
+    def progress(self) -> str:
+        state = self.state
+        status = 'завершена' if state['done'] else 'отменена' if state['cancelled'] else 'идет'
+        total = max(state['total'], self.processed)
+        percent = self.processed / total if total else 1.0
+        text = (f"📣 Рассылка {state['id']} {status}: обработано {self.processed} из {total} ({percent:.0%})\n"
+                f"Доставлено {state['sent']}, ошибок {state['failed']}, недоступны {state['dead']}")
+        if self._started is not None:
+            text += f"\nСкорость {self.send_rate():.1f} сообщ./с"
+        return text
+
+    def save(self) -> None:
+        """Атомарно записывает состояние: после сбоя файл либо старый, либо новый"""
+        self._write(json.dumps(self.state, ensure_ascii=False))
+
+    async def save_async(self) -> None:
+        """save() без блокировки цикла: снимок состояния берется сразу, запись - в потоке"""
+        await asyncio.to_thread(self._write, json.dumps(self.state, ensure_ascii=False))
+
+    def _write(self, data: str) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        tmp.write_text(data)
+        os.replace(tmp, self.path)
+
+    def request_stop(self) -> None:
+        """Просит процесс, который ведет рассылку, остановить ее на ближайшем сохранении"""
+        self.stop_path.parent.mkdir(parents=True, exist_ok=True)
+        self.stop_path.write_text(str(self.state['id']))
+
+    def stop_requested(self) -> bool:
+        try:
+            return self.stop_path.read_text().strip() == str(self.state['id'])
+        except OSError:
+            return False
+
+    async def run(self, bot, sender, store, on_progress=None, report_interval: float = 60.0,
+                  on_dead=None) -> None:
+        """
+        Отправляет сообщение всем после state['cursor']. on_progress() вызывается
+        в фоне раз в report_interval секунд, on_dead(user_id) - для каждого
+        недоступного получателя. Отмена задачи или request_stop() отменяют и
+        отправки, еще ждущие в очереди планировщика, и сохраняют состояние
+        """
+        self._started = now = time.monotonic()
+        bucket = TokenBucket(self.rate, 1, now)
+        slots = asyncio.Semaphore(self.window)
+        pending = deque()   # (user_id, задача) в порядке отправки
+        last_save = last_report = now
+        after = self.state['cursor']
+        stopped = self.stop_requested()
+        try:
+            while not stopped and (user_ids := store.user_ids(after, self.chunk_size)):
+                for user_id in user_ids:
+                    while (wait := bucket.wait_time(time.monotonic())) > 0:
+                        await asyncio.sleep(wait)
+                    await slots.acquire()
+                    bucket.take(time.monotonic())
+                    pending.append((user_id, asyncio.create_task(
+                        self._send(bot, sender, user_id, slots, on_dead))))
+                    self._advance(pending)
+
+                    now = time.monotonic()
+                    if now - last_save >= self.checkpoint_interval:
+                        if self.stop_requested():
+                            stopped = True
+                            break
+                        await self.save_async()
+                        last_save = time.monotonic()
+                    if on_progress and now - last_report >= report_interval:
+                        asyncio.create_task(on_progress())
+                        last_report = now
+                after = user_ids[-1]
+            if stopped:
+                self.state['cancelled'] = True
+            else:
+                await asyncio.gather(*(task for _, task in pending))
+                self._advance(pending)
+                self.state['done'] = True
+        finally:
+            unfinished = [task for _, task in pending if not task.done()]
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+            # Отмененные и не подтвержденные отправки остаются за cursor
+            self._advance(pending)
+            await self.save_async()
+            if not self.active:
+                self.stop_path.unlink(missing_ok=True)
+
+    def _advance(self, pending: deque) -> None:
+        """Сдвигает cursor за всех, чья отправка уже завершилась"""
+        while pending and pending[0][1].done() and not pending[0][1].cancelled():
+            self.state['cursor'] = pending.popleft()[0]
+
+    async def _send(self, bot, sender, user_id: int, slots: asyncio.Semaphore, on_dead=None) -> None:
+        message = self.state['message']
+        try:
+            if 'text' in message:
+                await sender.call(bot, 'send_message', BULK, chat_id=user_id, text=message['text'])
+            else:
+                await sender.call(bot, 'copy_message', BULK, chat_id=user_id, **message)
+            self.state['sent'] += 1
+            metrics.broadcast_messages.inc('sent')
+        except Exception as e:
+            if is_dead_chat(e):
+                self.state['dead'] += 1
+                metrics.broadcast_messages.inc('dead')
+                if on_dead is not None:
+                    await on_dead(user_id)
+            else:
+                self.state['failed'] += 1
+                metrics.broadcast_messages.inc('failed')
+                logging.warning(f"Рассылка: не удалось отправить пользователю {user_id}: {e}")
+        finally:
+            self._processed += 1
+            slots.release()
@@ -0,0 +1 @@
+TOKEN = "123456:TEST"
@@ -0,0 +1,55 @@
+import asyncio
+import logging
+
+from telegram import Message
+
+
+class _PendingEdit:
+    __slots__ = ('message', 'on_flush')
+
+    def __init__(self, message: Message, on_flush):
+        self.message = message
+        self.on_flush = on_flush
+
+
+class EditCoalescer:
+    """
+    Схлопывает серии правок одного сообщения.
+
+    Первая правка сообщения откладывается на window секунд; правки,
+    пришедшие за это время, только заменяют сохраненную версию. По
+    истечении окна вызывается on_flush(message) первой правки с последней
+    версией сообщения - собеседник получает один запрос вместо серии.
+    Окно не продлевается, поэтому задержка правки не больше window.
+    """
+
+    def __init__(self, window: float = 0.3):
+        self.window = window
+        self._pending = {}
+        # Сколько правок не пришлось пересылать
+        self.coalesced = 0
+        # Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+        self._tasks = set()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, message: Message, on_flush) -> None:
+        key = (message.chat_id, message.message_id)
+        pending = self._pending.get(key)
+        if pending is None:
+            self._pending[key] = _PendingEdit(message, on_flush)
+            task = asyncio.create_task(self._wait_and_flush(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            pending.message = message
+            self.coalesced += 1
+
+    async def _wait_and_flush(self, key: tuple) -> None:
+        await asyncio.sleep(self.window)
+        pending = self._pending.pop(key)
+        try:
+            await pending.on_flush(pending.message)
+        except Exception as e:
+            logging.error(f"Ошибка при пересылке правки сообщения {key[1]}: {e}")
@@ -0,0 +1,212 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+# Типы событий
+REGISTERED = 1
+SEARCH = 2
+MATCHED = 3
+ENDED = 4
+KINDS = {REGISTERED: 'registered', SEARCH: 'search', MATCHED: 'matched', ENDED: 'ended'}
+
+# Причины завершения диалога (только для ENDED)
+STOP = 1
+NEXT = 2
+UNREACHABLE = 3
+DEBUG = 4
+IDLE = 5
+REASONS = {STOP: 'stop', NEXT: 'next', UNREACHABLE: 'unreachable', DEBUG: 'debug', IDLE: 'idle'}
+
+# Запись 32 байта: время (мс), пользователь, собеседник, длительность диалога (с),
+# тип, причина, корзина длительности. Поля фиксированы по смещению, поэтому
+# читатель берет столбец срезом с шагом прямо из mmap, не разбирая записи
+RECORD = struct.Struct('<qqqiBBBx')
+_DURATION_WORD = 6                       # номер int32 с длительностью внутри записи
+_KIND, _REASON, _BUCKET = 28, 29, 30     # смещения однобайтовых полей
+# Корзина длительности: 1 + число двоичных разрядов в секундах (0 - неизвестна)
+DURATION_BUCKETS = 33
+
+SUFFIX = '.events'
+
+
+def duration_bucket(seconds: int) -> int:
+    return min(DURATION_BUCKETS - 1, 1 + seconds.bit_length())
+
+
+class EventLog:
+    """
+    Журнал событий жизненного цикла чатов для аналитики.
+
+    emit() только упаковывает запись в буфер под блокировкой, файлы пишет
+    фоновый поток раз в flush_interval секунд. Сегменты - по одному на час
+    (UTC) и процесс: events-ГГГГММДДЧЧ-pid.events, только дозапись. Пока
+    журнал не запущен, emit() ничего не делает
+    """
+
+    def __init__(self, directory: str, flush_interval: float = 1.0):
+        self.directory = Path(directory) if directory else None
+        self.flush_interval = flush_interval
+        self.written = 0
+        self._lock = threading.Lock()
+        self._hour = None
+        self._buffer = bytearray()
+        # Буферы прошедших часов, еще не записанные: (час, данные)
+        self._ready = []
+        self._stopped = threading.Event()
+        self._writer = None
+
+    def start(self) -> None:
+        if self.directory is None or self._writer is not None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._stopped.clear()
+        self._writer = threading.Thread(target=self._write_loop, name='event-writer', daemon=True)
+        self._writer.start()
+
+    def close(self) -> None:
+        """Останавливает поток и дописывает все накопленное"""
+        if self._writer is None:
+            return
+        self._stopped.set()
+        self._writer.join()
+        self._writer = None
+
+    def emit(self, kind: int, user_id: int, partner_id: int = 0, reason: int = 0, duration: float = None) -> None:
+        if self._writer is None:
+            return
+        now = time.time()
+        if duration is None:
+            seconds = bucket = 0
+        else:
+            seconds = int(duration)
+            bucket = duration_bucket(seconds)
+        record = RECORD.pack(int(now * 1000), user_id, partner_id or 0, seconds, kind, reason, bucket)
+        hour = int(now // 3600)
+        with self._lock:
+            if hour != self._hour:
+                if self._buffer:
+                    self._ready.append((self._hour, self._buffer))
+                    self._buffer = bytearray()
+                self._hour = hour
+            self._buffer += record
+
+    def _write_loop(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            self._flush()
+        self._flush()
+
+    def _flush(self) -> None:
+        with self._lock:
+            batches, self._ready = self._ready, []
+            if self._buffer:
+                batches.append((self._hour, self._buffer))
+                self._buffer = bytearray()
+        for hour, data in batches:
+            with open(self.segment_path(hour), 'ab') as f:
+                f.write(data)
+            self.written += len(data) // RECORD.size
+
+    def segment_path(self, hour: int) -> Path:
+        stamp = time.strftime('%Y%m%d%H', time.gmtime(hour * 3600))
+        return self.directory / f"events-{stamp}-{os.getpid()}{SUFFIX}"
+
+
+def segment_hour(path: Path) -> str:
+    """'ГГГГММДДЧЧ' из имени сегмента"""
+    return path.name.split('-')[1]
+
+
+class EventStats:
+    """
+    Агрегаты по сегментам журнала. Каждый сегмент отображается в память,
+    а каждый агрегат - это подсчет байтов или сумма по срезу с шагом в
+    размер записи: циклы идут в C, без объекта Python на событие
+    """
+
+    def __init__(self):
+        self.events = 0
+        self.kinds = Counter()
+        self.reasons = Counter()
+        self.matches_by_hour = Counter()
+        self.durations = [0] * DURATION_BUCKETS
+        self.total_duration = 0
+        self.first = None
+        self.last = None
+
+    def add_segment(self, path: Path) -> None:
+        size = path.stat().st_size
+        # Недописанный хвост (процесс упал посреди записи) отбрасывается
+        size -= size % RECORD.size
+        if size == 0:
+            return
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as data:
+            count = size // RECORD.size
+            self.events += count
+            kinds = data[_KIND:size:RECORD.size]
+            for kind in KINDS:
+                self.kinds[kind] += kinds.count(kind)
+            self.matches_by_hour[segment_hour(path)] += kinds.count(MATCHED)
+            reasons = data[_REASON:size:RECORD.size]
+            for reason in REASONS:
+                self.reasons[reason] += reasons.count(reason)
+            buckets = data[_BUCKET:size:RECORD.size]
+            for bucket in range(1, DURATION_BUCKETS):
+                self.durations[bucket] += buckets.count(bucket)
+            with memoryview(data) as view, view.cast('i') as words:
+                self.total_duration += sum(words[_DURATION_WORD::RECORD.size // 4])
+            first, last = RECORD.unpack_from(data, 0)[0], RECORD.unpack_from(data, size - RECORD.size)[0]
+        self.first = first if self.first is None else min(self.first, first)
+        self.last = last if self.last is None else max(self.last, last)
+
+    def duration_percentile(self, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает q-й процентиль длительности (с)"""
+        known = sum(self.durations)
+        if not known:
+            return 0.0
+        rank = known * q / 100
+        seen = 0
+        for bucket, n in enumerate(self.durations):
+            seen += n
+            if n and seen >= rank:
+                return float(2 ** (bucket - 1))
+        return float(2 ** (DURATION_BUCKETS - 2))
+
+    def report(self) -> str:
+        if not self.events:
+            return "Событий нет"
+        span = (time.strftime('%Y-%m-%d %H:%M', time.gmtime(self.first / 1000)),
+                time.strftime('%Y-%m-%d %H:%M', time.gmtime(self.last / 1000)))
+        lines = [f"Событий {self.events} с {span[0]} по {span[1]} UTC"]
+        lines.append("По типам: " + ', '.join(f"{name} {self.kinds[kind]}" for kind, name in KINDS.items()))
+        searches, matched = self.kinds[SEARCH], self.kinds[MATCHED]
+        if searches:
+            lines.append(f"Поисков, закончившихся диалогом: {min(1.0, 2 * matched / searches):.0%}")
+        ended = self.kinds[ENDED]
+        if ended:
+            lines.append("Завершение диалогов: " + ', '.join(
+                f"{name} {self.reasons[reason]} ({self.reasons[reason] / ended:.0%})"
+                for reason, name in REASONS.items()))
+        known = sum(self.durations)
+        if known:
+            lines.append(f"Длительность диалога: в среднем {self.total_duration / known:.0f} с, "
+                         f"медиана до {self.duration_percentile(50):.0f} с, "
+                         f"p90 до {self.duration_percentile(90):.0f} с (известна для {known} из {ended})")
+        lines.append("Диалогов в час (UTC):")
+        for hour, n in sorted(self.matches_by_hour.items()):
+            lines.append(f"  {hour[:4]}-{hour[4:6]}-{hour[6:8]} {hour[8:]}:00  {n}")
+        return '\n'.join(lines)
+
+
+def segments(directory: str) -> list:
+    return sorted(Path(directory).glob(f'*{SUFFIX}'))
+
+
+def summarize(directory: str) -> EventStats:
+    stats = EventStats()
+    for path in segments(directory):
+        stats.add_segment(path)
+    return stats
@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict
+
+
+class _Bucket:
+    __slots__ = ('tokens', 'updated', 'seen', 'muted_until', 'strikes', 'flooded_at', 'media_group')
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.seen = now
+        self.muted_until = 0.0
+        self.strikes = 0
+        self.flooded_at = 0.0
+        self.media_group = None
+
+
+class FloodControl:
+    """
+    Входящий лимит сообщений на пользователя.
+
+    У каждого пользователя token bucket: burst сообщений сразу и rate в
+    секунду дальше. Части одного альбома считаются одним сообщением -
+    пересылаются они тоже одним запросом. Сообщение сверх лимита включает
+    молчание на mute секунд, каждое следующее в течение forgive секунд -
+    вдвое дольше, но не больше mute_max.
+
+    Записи хранятся в порядке последнего обращения и удаляются, как только
+    становятся неотличимы от новой: bucket восстановился, молчание
+    закончилось и нарушения прощены. Поэтому в памяти только недавно
+    писавшие, а max_users ограничивает и этот объем.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: float = 10, mute: float = 10.0, mute_max: float = 600.0,
+                 forgive: float = 600.0, max_users: int = 1_000_000):
+        self.rate = rate
+        self.burst = burst
+        self.mute = mute
+        self.mute_max = mute_max
+        self.forgive = forgive
+        self.max_users = max_users
+        # За это время пустой bucket восстанавливается полностью
+        self._refill_time = burst / rate
+        self._buckets = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def check(self, user_id: int, media_group_id: str = None, now: float = None):
+        """
+        Учитывает сообщение пользователя. None - сообщение можно обрабатывать,
+        иначе его надо отбросить: число секунд, если молчание только что
+        началось (об этом стоит сказать пользователю), или 0, если оно уже идет
+        """
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = _Bucket(self.burst, now)
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+            bucket.seen = now
+
+        if bucket.muted_until > now:
+            return 0
+        if media_group_id is not None and media_group_id == bucket.media_group:
+            return None
+        bucket.media_group = media_group_id
+
+        bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+        bucket.updated = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return None
+
+        if now - bucket.flooded_at > self.forgive:
+            bucket.strikes = 0
+        bucket.strikes += 1
+        bucket.flooded_at = now
+        duration = min(self.mute_max, self.mute * 2 ** (bucket.strikes - 1))
+        bucket.muted_until = now + duration
+        return duration
+
+    def _expire(self, now: float) -> None:
+        buckets = self._buckets
+        while buckets:
+            user_id, bucket = next(iter(buckets.items()))
+            if now - bucket.seen < self._refill_time:
+                return
+            if bucket.muted_until > now or (bucket.strikes and now - bucket.flooded_at <= self.forgive):
+                # Нарушителя еще рано забывать: проверим снова через refill_time
+                bucket.seen = now
+                buckets.move_to_end(user_id)
+            else:
+                del buckets[user_id]
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+
+# Ограничение на размер тела запроса: обновления Telegram намного меньше
+MAX_BODY_SIZE = 1024 * 1024
+# Ограничение на число заголовков (длину строки ограничивает буфер StreamReader)
+MAX_HEADERS = 100
+
+_REASONS = {
+    200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+    405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error',
+}
+
+
+class Request:
+    __slots__ = ('method', 'path', 'query', 'headers', 'body')
+
+    def __init__(self, method: str, path: str, query: str, headers: dict, body: bytes):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+
+class HTTPServer:
+    """
+    Минимальный HTTP/1.1 сервер на asyncio для вебхука и служебных страниц.
+
+    Обработчик маршрута - корутина handler(request) -> (status, content_type, body).
+    Соединения keep-alive поддерживаются, чтобы Telegram не открывал
+    новое соединение на каждое обновление.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._routes = {}
+        self._server = None
+
+    def route(self, path: str, handler, methods=('GET',)) -> None:
+        self._routes[path] = (handler, tuple(methods))
+
+    @property
+    def bound_port(self) -> int:
+        """Фактический порт (полезно при port=0 в тестах)"""
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logging.info(f"HTTP сервер слушает {self.host}:{self.bound_port}")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                if isinstance(request, int):
+                    await self._respond(writer, request, 'text/plain', b'', keep_alive=False)
+                    break
+                status, content_type, body = await self._dispatch(request)
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, status, content_type, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        """Request, код ошибки для ответа или None, если клиент закрыл соединение"""
+        try:
+            line = await reader.readline()
+            if not line:
+                return None
+            try:
+                method, target, _ = line.decode('latin-1').split(' ', 2)
+            except ValueError:
+                return 400
+
+            headers = {}
+            for _ in range(MAX_HEADERS + 1):
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            else:
+                return 400
+        except ValueError:
+            # readline превращает LimitOverrunError (строка длиннее лимита буфера) в ValueError
+            return 400
+
+        length = headers.get('content-length', '0') or '0'
+        # int() принял бы и '-1', и ' 1_0', и не-ASCII цифры
+        if not (length.isascii() and length.isdigit()):
+            return 400
+        length = int(length)
+        if length > MAX_BODY_SIZE:
+            return 413
+        body = await reader.readexactly(length) if length else b''
+        path, _, query = target.partition('?')
+        return Request(method.upper(), path, query, headers, body)
+
+    async def _dispatch(self, request: Request) -> tuple:
+        route = self._routes.get(request.path)
+        if route is None:
+            return 404, 'text/plain', b'not found'
+        handler, methods = route
+        if request.method not in methods:
+            return 405, 'text/plain', b'method not allowed'
+        try:
+            return await handler(request)
+        except Exception as e:
+            logging.error(f"Ошибка обработки HTTP запроса {request.path}: {e}")
+            return 500, 'text/plain', b'internal error'
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, content_type: str, body: bytes, keep_alive: bool) -> None:
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
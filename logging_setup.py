@@ -0,0 +1,149 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+from pathlib import Path
+
+import settings
+
+
+# Создаем фильтр для разделения логов
+class ConsoleFilter(logging.Filter):
+    def filter(self, record):
+        # Разрешаем только сообщения от корневого логгера (наши сообщения)
+        return record.name == "root"
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает только каждую N-ю запись DEBUG/INFO от шумных логгеров.
+    Предупреждения и ошибки проходят всегда
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        # Префикс имени логгера -> доля сохраняемых записей
+        self.rates = rates
+        self._every = {}
+        self._counters = {}
+
+    def _every_for(self, name: str) -> int:
+        every = self._every.get(name)
+        if every is None:
+            rate = 1.0
+            # Самый длинный подходящий префикс: 'httpcore.http11' попадает под 'httpcore'
+            for prefix in sorted(self.rates, key=len, reverse=True):
+                if name == prefix or name.startswith(prefix + '.'):
+                    rate = self.rates[prefix]
+                    break
+            every = self._every[name] = 0 if rate <= 0 else max(1, round(1 / rate))
+        return every
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        every = self._every_for(record.name)
+        if every == 1:
+            return True
+        if every == 0:
+            return False
+        n = self._counters.get(record.name, 0) + 1
+        self._counters[record.name] = n
+        return n % every == 0
+
+
+class JsonFormatter(logging.Formatter):
+    """Компактная запись в одну строку JSON"""
+
+    def format(self, record):
+        data = {
+            't': round(record.created, 3),
+            'lvl': record.levelname,
+            'log': record.name,
+            'msg': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Кладет запись в ограниченную очередь и никогда не блокирует:
+    если фоновый поток не успевает, запись отбрасывается и считается
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _make_file_handler(log_file: Path) -> logging.Handler:
+    if settings.LOG_ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(
+            log_file, when=settings.LOG_ROTATE_WHEN, backupCount=settings.LOG_BACKUP_COUNT, encoding='utf-8')
+    return logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=settings.LOG_ROTATE_BYTES, backupCount=settings.LOG_BACKUP_COUNT, encoding='utf-8')
+
+
+# Настройка логгирования
+def setup_logging(log_name: str = 'bot'):
+    """
+    Логи пишутся через QueueHandler: в цикле событий запись только кладется
+    в очередь, а форматирование и файловый ввод-вывод выполняет поток
+    QueueListener. Файл один на процесс (log_name.log) и ротируется по
+    размеру или времени
+    """
+    # Создаем папку для логов
+    log_dir = Path(settings.LOG_DIR)
+    log_dir.mkdir(exist_ok=True)
+
+    # Настройка основного логгера
+    logger = logging.getLogger()
+    logger.setLevel(settings.LOG_LEVEL)
+
+    # Форматтер для логов (подробный или JSON)
+    if settings.LOG_FORMAT == 'json':
+        detailed_formatter = JsonFormatter()
+    else:
+        detailed_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    # Форматтер для консоли (простой)
+    simple_formatter = logging.Formatter('%(message)s')
+
+    # Обработчик для файла (все сообщения) с ротацией
+    file_handler = _make_file_handler(log_dir / f'{log_name}.log')
+    file_handler.setLevel(settings.LOG_LEVEL)
+    file_handler.setFormatter(detailed_formatter)
+
+    # Обработчик для консоли (только наши сообщения)
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(simple_formatter)
+
+    # Добавляем фильтр, который пропускает только сообщения от корневого логгера
+    console_handler.addFilter(ConsoleFilter())
+
+    # Запись в очередь на месте вызова, вывод - в отдельном потоке
+    log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(settings.LOG_SAMPLING))
+    listener = logging.handlers.QueueListener(
+        log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger.addHandler(queue_handler)
+
+    # Устанавливаем уровень логирования для библиотек
+    for name, level in settings.LOG_LIBRARY_LEVELS.items():
+        logging.getLogger(name).setLevel(level)
+
+    return logger
@@ -1,8 +1,10 @@
+import asyncio
 import logging
 import os
+import signal
 import time
-from pathlib import Path
 import warnings
+from collections import Counter
 from telegram import (
     Update,
     InlineKeyboardButton,
@@ -12,242 +14,222 @@ from telegram import (
 )
 from telegram.ext import (
     Application,
+    CallbackContext,
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
+    TypeHandler,
+    ApplicationHandlerStop,
     filters,
-    ContextTypes,
-    ConversationHandler
+    ContextTypes
 )
+from telegram.error import BadRequest
 from telegram.warnings import PTBUserWarning
 
 # Импорт токена из конфигурационного файла
 from config import TOKEN
+import settings
+from matchmaking import BatchMatcher, MatchQueue
+from relay import plan_edit, plan_relay, relay_album, relay_message, takes_prefix
+from albums import AlbumAggregator
+from broadcast import Broadcast
+from edits import EditCoalescer
+import events
+from flood import FloodControl
+from logging_setup import setup_logging
+import metrics
+from ordering import DialogueLocks, DialogueUpdateProcessor
+from profiling import MODES as PROFILE_MODES, ProfileSession
+from transport import Pool, PooledRequest, route_media
+from rooms import RoomDirectory
+from sender import BULK, NOTICE, RELAY, SendScheduler, is_dead_chat
+from sharding import run_sharded
+from storage import MemoryStore, create_store
+from webhook import start_webhook
 
 # Подавляем специфические предупреждения PTB
 warnings.filterwarnings("ignore", category=PTBUserWarning)
 
-# Создаем фильтр для разделения логов
-class ConsoleFilter(logging.Filter):
-    def filter(self, record):
-        # Разрешаем только сообщения от корневого логгера (наши сообщения)
-        return record.name == "root"
-
-# Настройка логгирования
-def setup_logging():
-    # Создаем папку для логов
-    log_dir = Path("logs")
-    log_dir.mkdir(exist_ok=True)
-    
-    # Создаем уникальное имя файла
-    log_file = log_dir / f"bot_{time.strftime('%Y%m%d_%H%M%S')}.log"
-    
-    # Настройка основного логгера
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
-    
-    # Форматтер для логов (подробный)
-    detailed_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    
-    # Форматтер для консоли (простой)
-    simple_formatter = logging.Formatter('%(message)s')
-    
-    # Обработчик для файла (все сообщения)
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
-    file_handler.setLevel(logging.DEBUG)
-    file_handler.setFormatter(detailed_formatter)
-    
-    # Обработчик для консоли (только наши сообщения)
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(simple_formatter)
-    
-    # Добавляем фильтр, который пропускает только сообщения от корневого логгера
-    console_handler.addFilter(ConsoleFilter())
-    
-    # Добавляем обработчики
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    
-    # Устанавливаем уровень логирования для библиотек
-    logging.getLogger("httpx").setLevel(logging.DEBUG)
-    logging.getLogger("httpcore").setLevel(logging.DEBUG)
-    logging.getLogger("telegram").setLevel(logging.DEBUG)
-    logging.getLogger("asyncio").setLevel(logging.DEBUG)
-    
-    return logger
-
 # Глобальные переменные для хранения данных
-users = {}
-active_searches = {}
-active_chats = {}
-debug_mode = {}  # Словарь для хранения режима отладки по пользователям
-message_mapping = {}  # Словарь для отслеживания соответствия сообщений между пользователями
+active_searches = MatchQueue()  # Очередь поиска с индексом по полу
+# Анонимные комнаты: состав и соответствие сообщений участников
+rooms = RoomDirectory(settings.ROOMS, settings.ROOM_CAPACITY, settings.ROOM_HISTORY)
+# Пользователи, диалоги, режим отладки и соответствие сообщений между пользователями.
+# В main() заменяется на хранилище из настроек
+store = MemoryStore()
+# Все исходящие запросы к Bot API идут через планировщик с учетом лимитов Telegram
+sender = SendScheduler(
+    global_rate=settings.SEND_GLOBAL_RATE,
+    global_burst=settings.SEND_GLOBAL_BURST,
+    chat_rate=settings.SEND_CHAT_RATE,
+    chat_burst=settings.SEND_CHAT_BURST,
+    max_retries=settings.SEND_MAX_RETRIES,
+    max_queue=settings.SEND_MAX_QUEUE)
+# Серии правок одного сообщения пересылаются последней версией
+edits = EditCoalescer(window=settings.EDIT_WINDOW)
+# Обновления обрабатываются параллельно, но по очереди внутри каждого диалога
+dialogue_locks = DialogueLocks(lambda user_id: store.get_partner(user_id))
+# Части альбомов собираются и пересылаются одним запросом. Альбом пересылается
+# вне обработки обновления, поэтому сам берет блокировку диалога
+albums = AlbumAggregator(window=settings.ALBUM_WINDOW, hold=dialogue_locks.hold)
+# Журнал событий чатов для аналитики (tools/event_stats.py)
+event_log = events.EventLog(settings.EVENTS_DIR, settings.EVENTS_FLUSH_INTERVAL)
+# Входящий лимит сообщений на пользователя: флуд одного не тратит общий лимит отправки
+flood = FloodControl(
+    rate=settings.FLOOD_RATE or 1.0,
+    burst=settings.FLOOD_BURST,
+    mute=settings.FLOOD_MUTE,
+    mute_max=settings.FLOOD_MUTE_MAX,
+    forgive=settings.FLOOD_FORGIVE,
+    max_users=settings.FLOOD_MAX_USERS)
+# Незавершенные уведомления о молчании (чтобы задачи не собрал сборщик мусора)
+flood_warnings = set()
+
+
+async def notify(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str, reply_markup=None) -> None:
+    """Отправка системного уведомления (с приоритетом ниже пересылки сообщений)"""
+    try:
+        await sender.call(context.bot, 'send_message', NOTICE, chat_id=chat_id, text=text, reply_markup=reply_markup)
+    except Exception as e:
+        await handle_send_error(context, chat_id, e, f"отправке уведомления пользователю {chat_id}")
+
+
+async def handle_send_error(context: ContextTypes.DEFAULT_TYPE, chat_id: int, error: Exception, action: str) -> None:
+    """Ошибка отправки в чат: недоступный чат завершает диалог пользователя, остальные пишутся в лог"""
+    if is_dead_chat(error):
+        await drop_unreachable(context, chat_id)
+    else:
+        logging.error(f"Ошибка при {action}: {error}")
+
+
+async def drop_unreachable(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
+    """
+    Пользователь заблокировал бота или удалил аккаунт: его диалог завершается
+    сразу, а не после каждой следующей неудачной пересылки. Отметка убирает
+    его из поиска и рассылок, пока он снова не напишет боту
+    """
+    if not store.is_unreachable(user_id):
+        store.set_unreachable(user_id, True)
+        metrics.dead_chats.inc()
+        logging.info(f"Пользователь {user_id} недоступен, диалог завершен")
+    active_searches.discard(user_id)
+    rooms.leave(user_id)
+    partner_id = end_dialogue(user_id, events.UNREACHABLE)
+    store.clear_mapping(user_id)
+    if partner_id is not None:
+        store.clear_mapping(partner_id)
+        await notify(
+            context, partner_id,
+            "❌ Собеседник покинул чат: сообщения ему больше не доставляются\n\n"
+            "🔍 Чтобы начать новый, используйте /start",
+            reply_markup=main_keyboard)
+
+
+def end_dialogue(user_id: int, reason: int) -> int:
+    """Завершает диалог пользователя с обеих сторон и пишет событие. Возвращает ID собеседника или None"""
+    started = store.dialogue_started(user_id)
+    partner_id = store.unlink(user_id)
+    if partner_id is not None:
+        event_log.emit(events.ENDED, user_id, partner_id, reason,
+                       None if started is None else time.time() - started)
+    return partner_id
+
+
+def mark_reachable(user_id: int) -> None:
+    """Пользователь снова пишет боту - значит, сообщения ему доходят"""
+    if store.is_unreachable(user_id):
+        store.set_unreachable(user_id, False)
+
 
+async def track_reachable(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Раньше всех обработчиков: любое обновление от пользователя снимает отметку недоступности"""
+    if update.effective_user is not None:
+        mark_reachable(update.effective_user.id)
 
-async def send_any_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message: Update.message, debug_prefix: str = None, reply_to_message_id: int = None) -> int:
+async def flush_albums(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Раньше всех обработчиков: собираемый альбом пользователя уходит до его следующего сообщения"""
+    message = update.message
+    if message is not None and message.from_user is not None:
+        await albums.flush(message.from_user.id, message.media_group_id)
+
+
+async def send_any_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message: Update.message, debug_prefix: str = None, reply_to_message_id: int = None, priority: int = RELAY) -> int:
     """
-    Универсальная функция для отправки любого типа сообщения
+    Универсальная функция для отправки любого типа сообщения (один вызов Bot API)
     """
+    async def call(method, **params):
+        return await sender.call(context.bot, method, priority, **params)
+
     try:
-        sent_message = None
-        
-        # Для видеосообщений (кружков) особая обработка
-        if message.video_note:
-            if debug_prefix:
-                # Для видеосообщений в режиме отладки просто пересылаем как есть
-                sent_message = await context.bot.send_video_note(
-                    chat_id=chat_id, 
-                    video_note=message.video_note.file_id,
-                    reply_to_message_id=reply_to_message_id
-                )
-            else:
-                sent_message = await context.bot.send_video_note(
-                    chat_id=chat_id, 
-                    video_note=message.video_note.file_id,
-                    reply_to_message_id=reply_to_message_id
-                )
-            return sent_message.message_id if sent_message else None
-        
-        # Обработка остальных типов сообщений
-        text = message.text
-        caption = message.caption
-        
-        if debug_prefix:
-            if text:
-                text = f"{debug_prefix}: {text}"
-            if caption:
-                caption = f"{debug_prefix}: {caption}"
-        
-        if text:
-            sent_message = await context.bot.send_message(
-                chat_id=chat_id, 
-                text=text,
-                reply_to_message_id=reply_to_message_id
-            )
-        
-        elif message.photo:
-            sent_message = await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=message.photo[-1].file_id,
-                caption=caption,
-                reply_to_message_id=reply_to_message_id
-            )
-        
-        elif message.video:
-            sent_message = await context.bot.send_video(
-                chat_id=chat_id,
-                video=message.video.file_id,
-                caption=caption,
-                reply_to_message_id=reply_to_message_id
-            )
-        
-        elif message.document:
-            sent_message = await context.bot.send_document(
-                chat_id=chat_id,
-                document=message.document.file_id,
-                caption=caption,
-                reply_to_message_id=reply_to_message_id
-            )
-        
-        elif message.audio:
-            sent_message = await context.bot.send_audio(
-                chat_id=chat_id,
-                audio=message.audio.file_id,
-                caption=caption,
-                reply_to_message_id=reply_to_message_id
-            )
-        
-        elif message.voice:
-            if debug_prefix:
-                # Для голосовых в режиме отладки отправляем текст + голосовое
-                text_msg = await context.bot.send_message(
-                    chat_id=chat_id, 
-                    text=f"{debug_prefix}: Голосовое сообщение",
-                    reply_to_message_id=reply_to_message_id
-                )
-                sent_message = await context.bot.send_voice(
-                    chat_id=chat_id, 
-                    voice=message.voice.file_id
-                )
-                return text_msg.message_id  # Возвращаем ID текстового сообщения
-            else:
-                sent_message = await context.bot.send_voice(
-                    chat_id=chat_id, 
-                    voice=message.voice.file_id,
-                    reply_to_message_id=reply_to_message_id
-                )
-        
-        elif message.sticker:
-            if debug_prefix:
-                # Для стикеров в режиме отладки отправляем текст + стикер
-                text_msg = await context.bot.send_message(
-                    chat_id=chat_id, 
-                    text=f"{debug_prefix}: Стикер",
-                    reply_to_message_id=reply_to_message_id
-                )
-                sent_message = await context.bot.send_sticker(
-                    chat_id=chat_id, 
-                    sticker=message.sticker.file_id
-                )
-                return text_msg.message_id  # Возвращаем ID текстового сообщения
-            else:
-                sent_message = await context.bot.send_sticker(
-                    chat_id=chat_id, 
-                    sticker=message.sticker.file_id,
-                    reply_to_message_id=reply_to_message_id
-                )
-        
-        return sent_message.message_id if sent_message else None
-    
+        return await relay_message(call, chat_id, message, debug_prefix, reply_to_message_id)
     except Exception as e:
-        logging.error(f"Ошибка при отправке сообщения: {e}")
+        await handle_send_error(context, chat_id, e, "отправке сообщения")
         return None
 
 
-async def edit_any_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int, new_message: Update.message, debug_prefix: str = None) -> bool:
+async def send_with_header(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message: Update.message, header: str, reply_to_message_id: int = None, priority: int = RELAY) -> int:
     """
-    Универсальная функция для редактирования сообщений
+    Копия сообщения без места для префикса, а перед ней заголовок отдельным сообщением.
+    Оба запроса встают в очередь чата подряд, без ожидания между ними, поэтому чужое
+    сообщение не окажется между заголовком и копией. ID копии или None при ошибке
+    """
+    method, params = plan_relay(chat_id, message, None, reply_to_message_id)
+    try:
+        sent = [sender.submit(context.bot, 'send_message', priority, chat_id=chat_id, text=header),
+                sender.submit(context.bot, method, priority, **params)]
+    except Exception as e:
+        await handle_send_error(context, chat_id, e, "отправке сообщения")
+        return None
+    header_result, copy_result = await asyncio.gather(*sent, return_exceptions=True)
+    for result in (header_result, copy_result):
+        if isinstance(result, Exception):
+            await handle_send_error(context, chat_id, result, "отправке сообщения")
+            break
+    return copy_result.message_id if copy_result and not isinstance(copy_result, Exception) else None
+
+
+async def send_album(context: ContextTypes.DEFAULT_TYPE, chat_id: int, messages: list, debug_prefix: str = None, reply_to_message_id: int = None, priority: int = RELAY) -> list:
+    """
+    Отправка альбома одним send_media_group
+    :return: ID отправленных сообщений в порядке messages (пустой список при ошибке)
+    """
+    async def call(method, **params):
+        return await sender.call(context.bot, method, priority, **params)
+
+    try:
+        return await relay_album(call, chat_id, messages, debug_prefix, reply_to_message_id)
+    except Exception as e:
+        await handle_send_error(context, chat_id, e, "отправке альбома")
+        return []
+
+
+async def edit_any_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int, new_message: Update.message, debug_prefix: str = None, priority: int = RELAY) -> bool:
+    """
+    Переносит правку на копию сообщения одним вызовом (текст, подпись или само медиа)
     :param context: контекст бота
     :param chat_id: ID чата
     :param message_id: ID сообщения для редактирования
     :param new_message: новое сообщение
     :param debug_prefix: префикс для режима отладки
-    :return: True если успешно, False если ошибка
+    :param priority: класс приоритета планировщика отправки
+    :return: True если успешно, False если правку не перенести
     """
+    plan = plan_edit(chat_id, message_id, new_message, debug_prefix)
+    if plan is None:
+        return False
+    method, params = plan
     try:
-        if new_message.text:
-            # Редактирование текстового сообщения
-            text = f"{debug_prefix}: {new_message.text}" if debug_prefix else new_message.text
-            await context.bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text=text
-            )
-            return True
-        
-        elif new_message.caption and (new_message.photo or new_message.video or new_message.document or new_message.audio):
-            # Редактирование подписи медиафайла
-            caption = f"{debug_prefix}: {new_message.caption}" if debug_prefix and new_message.caption else new_message.caption
-            await context.bot.edit_message_caption(
-                chat_id=chat_id,
-                message_id=message_id,
-                caption=caption
-            )
-            return True
-            
-        # Для других типов медиафайлов (фото, видео и т.д.) редактирование не поддерживается Telegram API
-        # Нужно удалить старое сообщение и отправить новое
-        await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-        await send_any_message(context, chat_id, new_message, debug_prefix)
+        await sender.call(context.bot, method, priority, **params)
         return True
-        
     except Exception as e:
-        logging.error(f"Ошибка при редактировании сообщения: {e}")
+        # Правку откатили до исходного текста - копия и так совпадает
+        if isinstance(e, BadRequest) and 'not modified' in str(e):
+            return True
+        await handle_send_error(context, chat_id, e, "редактировании сообщения")
         return False
 
-# Состояния регистрации
-GENDER, COUNTRY, AGE = range(3)
+# Типы обновлений, которые обрабатывает бот: остальные Telegram не присылает
+ALLOWED_UPDATES = [Update.MESSAGE, Update.EDITED_MESSAGE, Update.CALLBACK_QUERY]
 
 # Настройки клавиатур
 main_keyboard = ReplyKeyboardMarkup(
@@ -267,39 +249,66 @@ AGE_GROUPS = [
     "от 22 до 25 лет", "от 26 до 35", "от 36 лет"
 ]
 
+GENDERS = ('male', 'female')
+
+# Клавиатуры регистрации собираются один раз. Выбор каждого шага
+# дописывается в callback_data: 'reg:male' -> 'reg:male:0' -> 'reg:male:0:2'
+GENDER_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Я - парень", callback_data='reg:male'),
+     InlineKeyboardButton("Я - девушка", callback_data='reg:female')]
+])
+
+def _country_keyboard(prefix: str) -> InlineKeyboardMarkup:
+    buttons = [InlineKeyboardButton(c, callback_data=f'{prefix}:{i}') for i, c in enumerate(COUNTRIES)]
+    return InlineKeyboardMarkup([buttons[i:i+2] for i in range(0, len(buttons), 2)])
+
+def _age_keyboard(prefix: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton(age, callback_data=f'{prefix}:{i}')] for i, age in enumerate(AGE_GROUPS)])
+
+COUNTRY_KEYBOARDS = {gender: _country_keyboard(f'reg:{gender}') for gender in GENDERS}
+# Ключ - callback_data кнопки страны, которая ведет к этой клавиатуре
+AGE_KEYBOARDS = {
+    f'reg:{gender}:{i}': _age_keyboard(f'reg:{gender}:{i}')
+    for gender in GENDERS for i in range(len(COUNTRIES))
+}
+
+# Пакетный подбор пар с учетом страны и возраста
+matcher = BatchMatcher(
+    AGE_GROUPS,
+    country_weight=settings.MATCH_COUNTRY_WEIGHT,
+    age_weight=settings.MATCH_AGE_WEIGHT,
+    relax_step=settings.MATCH_RELAX_STEP,
+    budget=settings.MATCH_BUDGET)
+active_searches.matcher = matcher
+
 async def debug(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Включение/выключение режима отладки"""
     user_id = update.message.from_user.id
-    
-    if user_id in debug_mode and debug_mode[user_id]:
-        debug_mode[user_id] = False
+
+    if store.is_debug(user_id):
+        store.set_debug(user_id, False)
         # Очищаем mapping сообщений
-        if user_id in message_mapping:
-            del message_mapping[user_id]
-        await update.message.reply_text(
+        store.clear_mapping(user_id)
+        await notify(
+            context, user_id,
             "🔧 Режим отладки выключен\n"
             "Теперь бот работает в обычном режиме",
             reply_markup=main_keyboard
         )
     else:
         # Выходим из всех активных состояний
-        if user_id in active_searches:
-            del active_searches[user_id]
-        if user_id in active_chats:
-            partner_id = active_chats[user_id]
-            if partner_id in active_chats:
-                del active_chats[partner_id]
-            del active_chats[user_id]
+        active_searches.discard(user_id)
+        rooms.leave(user_id)
+        end_dialogue(user_id, events.DEBUG)
         
         # Очищаем mapping сообщений
-        if user_id in message_mapping:
-            del message_mapping[user_id]
+        store.clear_mapping(user_id)
         
-        debug_mode[user_id] = True
-        # Инициализируем mapping для режима отладки
-        message_mapping[user_id] = {}
+        store.set_debug(user_id, True)
         
-        await update.message.reply_text(
+        await notify(
+            context, user_id,
             "🔧 Режим отладки включен\n\n"
             "Все сообщения будут отправляться обратно вам.\n"
             "Поддерживаются ответы (reply) и редактирование сообщений.\n"
@@ -307,301 +316,403 @@ async def debug(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             reply_markup=ReplyKeyboardRemove()
         )
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = update.message.from_user.id
-    
-    # Проверяем режим отладки
-    if user_id in debug_mode and debug_mode[user_id]:
-        await update.message.reply_text(
-            "🔧 Вы в режиме отладки. Используйте /debug для выхода.\n"
-            "Все сообщения будут отправляться обратно вам."
-        )
-        return ConversationHandler.END
-    
-    if user_id in users:
-        if user_id in active_chats:
-            await update.message.reply_text(
-                "❌ Вы уже в диалоге! Завершите текущий диалог командой /stop",
-                reply_markup=ReplyKeyboardRemove()
-            )
-        elif user_id in active_searches:
-            await update.message.reply_text(
-                "🔍 Вы уже в поиске! Остановите поиск командой /stop",
-                reply_markup=main_keyboard
-            )
-        else:
-            await start_search(update, context)
-    else:
-        # Начало процесса регистрации
-        keyboard = [
-            [InlineKeyboardButton("Я - парень", callback_data='male'),
-             InlineKeyboardButton("Я - девушка", callback_data='female')]
-        ]
-        await update.message.reply_text(
-            "👋 Добро пожаловать в анонимный чат!\n\n"
-            "🛠️ Для использования бота требуется регистрация\n\n"
-            "Шаг 1: Ваш пол",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        return GENDER
-    return ConversationHandler.END
+def admit_update(update: Update) -> bool:
+    """Входящий лимит сообщений: False - обновление отбрасывается без обработки"""
+    message = update.message or update.edited_message
+    if message is None or message.from_user is None:
+        return True
+    user_id = message.from_user.id
+    if user_id in settings.ADMIN_IDS:
+        return True
+    # Не считается только /stop: и во время молчания можно выйти из диалога.
+    # Остальные команды (/top, /next...) шлют ответы и лимитируются как текст
+    if message.text and message.text.split(maxsplit=1)[0].split('@')[0] == '/stop':
+        return True
+
+    muted = flood.check(user_id, message.media_group_id)
+    if muted is None:
+        return True
+    metrics.flood_dropped.inc()
+    if muted:
+        # Предупреждаем один раз на все время молчания
+        metrics.flood_mutes.inc()
+        # Application здесь недоступно: ссылку на задачу держит flood_warnings
+        task = asyncio.create_task(flood_warning(update.get_bot(), user_id, muted))
+        flood_warnings.add(task)
+        task.add_done_callback(flood_warnings.discard)
+    return False
+
+async def flood_warning(bot, user_id: int, seconds: float) -> None:
+    try:
+        await sender.call(bot, 'send_message', NOTICE, chat_id=user_id,
+                          text=f"⚠️ Слишком много сообщений подряд. Следующие {seconds:.0f} с они не будут доставлены")
+    except Exception as e:
+        logging.error(f"Ошибка при отправке уведомления пользователю {user_id}: {e}")
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def flood_control(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Входящий лимит при последовательной обработке: выполняется до всех обработчиков"""
+    if not admit_update(update):
+        raise ApplicationHandlerStop
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.message.from_user.id
-    
+
     # Проверяем режим отладки
-    if user_id in debug_mode and debug_mode[user_id]:
-        await update.message.reply_text(
+    if store.is_debug(user_id):
+        await notify(
+            context, user_id,
             "🔧 Вы в режиме отладки. Используйте /debug для выхода.\n"
             "Все сообщения будут отправляться обратно вам."
         )
-        return ConversationHandler.END
-    
-    if user_id in users:
-        if user_id in active_chats:
-            await update.message.reply_text(
+        return
+
+    if store.is_registered(user_id):
+        if store.get_partner(user_id) is not None:
+            await notify(
+                context, user_id,
                 "❌ Вы уже в диалоге! Завершите текущий диалог командой /stop",
                 reply_markup=ReplyKeyboardRemove()
             )
         elif user_id in active_searches:
-            await update.message.reply_text(
+            await notify(
+                context, user_id,
                 "🔍 Вы уже в поиске! Остановите поиск командой /stop",
                 reply_markup=main_keyboard
             )
         else:
             await start_search(update, context)
     else:
-        # Начало процесса регистрации
-        keyboard = [
-            [InlineKeyboardButton("Я - парень", callback_data='male'),
-             InlineKeyboardButton("Я - девушка", callback_data='female')]
-        ]
-        await update.message.reply_text(
+        # Начало регистрации: дальше это сообщение редактируется на каждом шаге
+        await notify(
+            context, user_id,
             "👋 Добро пожаловать в анонимный чат!\n\n"
             "🛠️ Для использования бота требуется регистрация\n\n"
             "Шаг 1: Ваш пол",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=GENDER_KEYBOARD
         )
-        return GENDER
-    return ConversationHandler.END
 
-async def registration_gender(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    users[user_id] = {'gender': query.data}
-    
-    # Клавиатура для выбора страны
-    country_buttons = [InlineKeyboardButton(c, callback_data=c) for c in COUNTRIES]
-    keyboard = [country_buttons[i:i+2] for i in range(0, len(country_buttons), 2)]
-    
-    await query.edit_message_text("Шаг 2: Ваша страна")
-    await query.message.reply_text(
-        "Выберите страну:",
-        reply_markup=InlineKeyboardMarkup(keyboard))
-    return COUNTRY
-
-async def registration_country(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    users[user_id]['country'] = query.data
-    
-    # Клавиатура для выбора возраста
-    keyboard = [[InlineKeyboardButton(age, callback_data=age)] for age in AGE_GROUPS]
-    
-    await query.edit_message_text("Шаг 3: Ваш возраст")
-    await query.message.reply_text(
-        "Выберите возрастную категорию:",
-        reply_markup=InlineKeyboardMarkup(keyboard))
-    return AGE
-
-async def registration_age(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+def parse_registration(data: str):
+    """
+    Разбирает callback_data шага регистрации: 'reg:пол[:страна[:возраст]]',
+    страна и возраст - индексы в COUNTRIES и AGE_GROUPS.
+    Возвращает (пол, страна, возраст) с None для невыбранных или None, если данные неверны
+    """
+    parts = data.split(':')[1:]
+    # isdigit пропускает и не-ASCII цифры ('²', '٣'), которые int не всегда принимает
+    if not 1 <= len(parts) <= 3 or parts[0] not in GENDERS or \
+            not all(p.isascii() and p.isdigit() for p in parts[1:]):
+        return None
+    try:
+        choices = [options[int(index)] for options, index in zip((COUNTRIES, AGE_GROUPS), parts[1:])]
+    except IndexError:
+        return None
+    return parts[0], *choices, *[None] * (2 - len(choices))
+
+async def registration(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Шаг регистрации. Ответы предыдущих шагов лежат в callback_data кнопок,
+    поэтому состояние нигде не хранится и переживает перезапуск бота
+    """
     query = update.callback_query
-    await query.answer()
     user_id = query.from_user.id
-    users[user_id]['age'] = query.data
-    
-    await query.edit_message_text("✅ Регистрация завершена!")
-    await query.message.reply_text(
-        "Теперь вы можете начать поиск собеседника с помощью /start",
-        reply_markup=main_keyboard)
-    return ConversationHandler.END
+    choice = parse_registration(query.data)
+    if choice is None:
+        await query.answer("Кнопка устарела, отправьте /start")
+        return
+    gender, country, age = choice
+
+    registered = False
+    if country is None:
+        text, keyboard = "Шаг 2: Ваша страна", COUNTRY_KEYBOARDS[gender]
+    elif age is None:
+        # Ключ собирается заново: в query.data индекс мог прийти как '00'
+        text, keyboard = "Шаг 3: Ваш возраст", AGE_KEYBOARDS[f'reg:{gender}:{COUNTRIES.index(country)}']
+    else:
+        # Профиль сохраняется целиком, только после последнего шага.
+        # Повторное нажатие той же кнопки ничего не меняет
+        profile = {'gender': gender, 'country': country, 'age': age}
+        if store.get_user(user_id) != profile:
+            store.save_user(user_id, profile)
+            event_log.emit(events.REGISTERED, user_id)
+            registered = True
+        text, keyboard = "✅ Регистрация завершена!", None
+
+    # Ответ на нажатие убирает индикатор загрузки кнопки, правка - следующий шаг
+    results = await asyncio.gather(
+        query.answer(),
+        sender.call(context.bot, 'edit_message_text', NOTICE, chat_id=query.message.chat.id,
+                    message_id=query.message.message_id, text=text, reply_markup=keyboard),
+        return_exceptions=True)
+    for result in results:
+        # Повторное нажатие той же кнопки не меняет сообщение
+        if isinstance(result, Exception) and "not modified" not in str(result):
+            logging.error(f"Ошибка шага регистрации пользователя {user_id}: {result}")
+
+    if registered:
+        # Обычную клавиатуру нельзя прикрепить правкой, только новым сообщением
+        await notify(
+            context, user_id,
+            "Теперь вы можете начать поиск собеседника с помощью /start",
+            reply_markup=main_keyboard)
 
 async def start_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.message.from_user.id
-    
+
     # Проверяем режим отладки
-    if user_id in debug_mode and debug_mode[user_id]:
-        await update.message.reply_text(
+    if store.is_debug(user_id):
+        await notify(
+            context, user_id,
             "🔧 Вы в режиме отладки. Используйте /debug для выхода.\n"
             "Все сообщения будут отправляться обратно вам."
         )
         return
-    
-    if user_id not in users:
-        await update.message.reply_text("❌ Вы не зарегистрированы! Введите /start")
+
+    if not store.is_registered(user_id):
+        await notify(context, user_id, "❌ Вы не зарегистрированы! Введите /start")
         return
-    
+
     # Определение пола для поиска
     search_gender = None
     if update.message.text == 'Найти девушку':
         search_gender = 'female'
     elif update.message.text == 'Найти парня':
         search_gender = 'male'
-    
-    # Добавление в активный поиск
-    active_searches[user_id] = {
-        'gender': search_gender,
-        'message_id': update.message.message_id
-    }
-    
-    await update.message.reply_text(
+
+    # Добавление в активный поиск (страна и возраст нужны пакетному подбору)
+    rooms.leave(user_id)
+    profile = store.get_user(user_id)
+    active_searches.add(user_id, profile['gender'], search_gender, update.message.message_id,
+                        profile.get('country'), profile.get('age'))
+    event_log.emit(events.SEARCH, user_id)
+
+    await notify(
+        context, user_id,
         "🔍 Ищем собеседника...\n"
         "🛑 Чтобы остановить поиск, используйте /stop",
         reply_markup=ReplyKeyboardRemove())
-    
-    # Поиск партнера
-    await find_partner(user_id, search_gender, context)
+
+    # Поиск партнера: сразу или на ближайшем проходе пакетного подбора
+    if not settings.MATCH_INTERVAL:
+        await find_partner(user_id, search_gender, context)
 
 async def find_partner(user_id: int, search_gender: str, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Проверяем режим отладки
-    if user_id in debug_mode and debug_mode[user_id]:
+    if store.is_debug(user_id):
         return
-    
-    # Поиск подходящего партнера
-    partner_id = None
-    for uid, data in active_searches.items():
-        if uid == user_id:
-            continue
-        if not data['gender'] or data['gender'] == users[user_id]['gender']:
-            partner_id = uid
-            break
-    
-    if partner_id:
+
+    # Поиск подходящего партнера (фильтры проверяются в обе стороны).
+    # Проверка и изменение очереди и диалогов идут без await между ними,
+    # поэтому параллельные обработчики не могут разобрать одну пару дважды
+    entry = active_searches.get(user_id)
+    if entry is None:
+        # Пока отправлялось уведомление, пользователя уже выбрал другой ищущий
+        return
+    partner = active_searches.pop_match(user_id)
+
+    if partner:
         # Создание чата
-        del active_searches[user_id]
-        del active_searches[partner_id]
-        
-        active_chats[user_id] = partner_id
-        active_chats[partner_id] = user_id
-        
-        # Инициализируем mapping сообщений для обоих пользователей
-        message_mapping[user_id] = {}
-        message_mapping[partner_id] = {}
+        link_pair(entry, partner)
         
         # Отправка уведомлений
-        await context.bot.send_message(
-            user_id,
-            "💬 Собеседник найден! Начинайте общение\n\n"
-            "🔄 /next - новый собеседник\n"
-            "🛑 /stop - завершить диалог",
-            reply_markup=ReplyKeyboardRemove())
-        
-        await context.bot.send_message(
-            partner_id,
+        await announce_partner(context, user_id, partner.user_id)
+
+def link_pair(entry, partner) -> None:
+    """Создает диалог из двух пользователей, уже убранных из очереди поиска"""
+    # Время ожидания обоих собеседников
+    now = time.monotonic()
+    metrics.match_wait.observe(now - partner.since)
+    metrics.match_wait.observe(now - entry.since)
+
+    store.link(entry.user_id, partner.user_id)
+    event_log.emit(events.MATCHED, entry.user_id, partner.user_id)
+
+async def announce_partner(context: ContextTypes.DEFAULT_TYPE, user_id: int, partner_id: int) -> None:
+    for chat_id in (user_id, partner_id):
+        await notify(
+            context, chat_id,
             "💬 Собеседник найден! Начинайте общение\n\n"
             "🔄 /next - новый собеседник\n"
             "🛑 /stop - завершить диалог",
             reply_markup=ReplyKeyboardRemove())
 
+# Секунд на обработку одной пары после подбора, по прошлым проходам; начальная - с запасом
+match_pair_cost = 20e-6
+
+async def match_waiting(context: ContextTypes.DEFAULT_TYPE) -> int:
+    """
+    Проход пакетного подбора по всей очереди поиска. Возвращает число новых диалогов.
+    Бюджет MATCH_BUDGET покрывает весь проход: подбор оставляет время на
+    создание диалогов и запуск уведомлений для найденных пар
+    """
+    global match_pair_cost
+    start = time.perf_counter()
+    pairs = active_searches.take_batch(pair_cost=match_pair_cost)
+    applied = time.perf_counter()
+    for entry, partner, score in pairs:
+        link_pair(entry, partner)
+        metrics.match_pairs.inc(str(score))
+        # Уведомления уходят в фоне, чтобы лимиты отправки не задерживали следующий проход
+        context.application.create_task(announce_partner(context, entry.user_id, partner.user_id))
+    end = time.perf_counter()
+    metrics.match_tick.observe(end - start)
+
+    if pairs:
+        # Скользящее среднее: оценка следует за нагрузкой на хранилище, но не скачет от одного прохода
+        match_pair_cost += ((end - applied) / len(pairs) - match_pair_cost) / 4
+    return len(pairs)
+
+async def run_matcher(application: Application) -> None:
+    context = CallbackContext(application)
+    while True:
+        await asyncio.sleep(settings.MATCH_INTERVAL)
+        try:
+            await match_waiting(context)
+        except Exception as e:
+            logging.error(f"Ошибка пакетного подбора собеседников: {e}")
+
+async def reap_idle(context: ContextTypes.DEFAULT_TYPE) -> int:
+    """
+    Завершает простаивающие диалоги и слишком долгие поиски. Хранилище и очередь
+    поиска держат записи в порядке активности, поэтому проход смотрит только
+    истекшие, а не всех пользователей. Возвращает число завершенных
+    """
+    idle = store.take_idle(settings.DIALOGUE_IDLE_TIMEOUT) if settings.DIALOGUE_IDLE_TIMEOUT else []
+    stale = active_searches.take_stale(settings.SEARCH_TIMEOUT) if settings.SEARCH_TIMEOUT else []
+    notices = []
+    for user_id, partner_id in idle:
+        if end_dialogue(user_id, events.IDLE) is None:
+            continue
+        store.clear_mapping(user_id)
+        store.clear_mapping(partner_id)
+        metrics.reaped.inc('dialogue')
+        text = "⌛ Диалог завершен: долго не было сообщений\n\n🔍 Чтобы начать новый, используйте /start"
+        notices += [(user_id, text), (partner_id, text)]
+    for entry in stale:
+        metrics.reaped.inc('search')
+        notices.append((entry.user_id, "⌛ Поиск остановлен: собеседник не нашелся\n\n"
+                                       "🔍 Чтобы попробовать еще раз, используйте /start"))
+
+    # Уведомления уходят в фоне: после перезапуска их может быть много сразу
+    for chat_id, text in notices:
+        context.application.create_task(notify(context, chat_id, text, reply_markup=main_keyboard))
+    return len(idle) + len(stale)
+
+async def run_reaper(application: Application) -> None:
+    context = CallbackContext(application)
+    while True:
+        await asyncio.sleep(settings.REAPER_INTERVAL)
+        try:
+            await reap_idle(context)
+        except Exception as e:
+            logging.error(f"Ошибка завершения простаивающих диалогов: {e}")
+
 async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.message.from_user.id
-    
+
     # Проверяем режим отладки
-    if user_id in debug_mode and debug_mode[user_id]:
-        await update.message.reply_text(
+    if store.is_debug(user_id):
+        await notify(
+            context, user_id,
             "🔧 Вы в режиме отладки. Используйте /debug для выхода."
         )
         return
-    
+
     if user_id in active_searches:
         # Остановка поиска
-        del active_searches[user_id]
-        await update.message.reply_text(
+        active_searches.discard(user_id)
+        await notify(
+            context, user_id,
             "🛑 Поиск остановлен",
             reply_markup=main_keyboard)
-    
-    elif user_id in active_chats:
+
+    elif store.get_partner(user_id) is not None:
         # Завершение диалога
-        partner_id = active_chats[user_id]
-        
-        if partner_id in active_chats:
-            del active_chats[partner_id]
-            await context.bot.send_message(
-                partner_id,
-                "❌ Собеседник завершил диалог\n\n"
-                "🔍 Чтобы начать новый, используйте /start",
-                reply_markup=main_keyboard)
-        
-        if user_id in active_chats:
-            del active_chats[user_id]
+        partner_id = end_dialogue(user_id, events.STOP)
         
         # Очищаем mapping сообщений
-        if user_id in message_mapping:
-            del message_mapping[user_id]
-        if partner_id in message_mapping:
-            del message_mapping[partner_id]
+        store.clear_mapping(user_id)
+        store.clear_mapping(partner_id)
+        
+        await notify(
+            context, partner_id,
+            "❌ Собеседник завершил диалог\n\n"
+            "🔍 Чтобы начать новый, используйте /start",
+            reply_markup=main_keyboard)
         
-        await update.message.reply_text(
+        await notify(
+            context, user_id,
             "🛑 Диалог завершен\n\n"
             "🔍 Чтобы начать новый, используйте /start",
             reply_markup=main_keyboard)
-    
+
+    elif (title := rooms.leave(user_id)) is not None:
+        await notify(
+            context, user_id,
+            f"🚪 Вы вышли из комнаты «{title}»\n\n"
+            "🔍 Чтобы начать поиск, используйте /start",
+            reply_markup=main_keyboard)
+
     else:
-        await update.message.reply_text(
+        await notify(
+            context, user_id,
             "🛑 Диалог остановлен\n\n"
             "🔍 Отправьте /start, чтобы начать поиск",
             reply_markup=main_keyboard)
 
 async def next(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.message.from_user.id
-    
+
     # Проверяем режим отладки
-    if user_id in debug_mode and debug_mode[user_id]:
-        await update.message.reply_text(
+    if store.is_debug(user_id):
+        await notify(
+            context, user_id,
             "🔧 Вы в режиме отладки. Используйте /debug для выхода."
         )
         return
-    
-    if user_id in active_chats:
+
+    if store.get_partner(user_id) is not None:
         # Завершение текущего диалога
-        partner_id = active_chats[user_id]
-        del active_chats[user_id]
-        
-        if partner_id in active_chats:
-            del active_chats[partner_id]
-            await context.bot.send_message(
-                partner_id,
-                "❌ Собеседник завершил диалог\n\n"
-                "🔍 Чтобы начать новый, используйте /start",
-                reply_markup=main_keyboard)
+        partner_id = end_dialogue(user_id, events.NEXT)
         
         # Очищаем mapping сообщений
-        if user_id in message_mapping:
-            del message_mapping[user_id]
-        if partner_id in message_mapping:
-            del message_mapping[partner_id]
+        store.clear_mapping(user_id)
+        store.clear_mapping(partner_id)
+        
+        await notify(
+            context, partner_id,
+            "❌ Собеседник завершил диалог\n\n"
+            "🔍 Чтобы начать новый, используйте /start",
+            reply_markup=main_keyboard)
         
         # Начало нового поиска
-        await update.message.reply_text(
+        await notify(
+            context, user_id,
             "🔄 Ищем нового собеседника...\n"
             "🛑 Чтобы остановить поиск, используйте /stop",
             reply_markup=ReplyKeyboardRemove())
-        active_searches[user_id] = {'gender': None}
-        await find_partner(user_id, None, context)
-    
+        profile = store.get_user(user_id)
+        active_searches.add(user_id, profile['gender'], None, None, profile.get('country'), profile.get('age'))
+        event_log.emit(events.SEARCH, user_id)
+        if not settings.MATCH_INTERVAL:
+            await find_partner(user_id, None, context)
+
     else:
-        await update.message.reply_text(
+        await notify(
+            context, user_id,
             "ℹ️ Вы не в диалоге\n"
             "🔍 Чтобы начать поиск, используйте /start",
             reply_markup=main_keyboard)
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.message.from_user.id
-    
+
+    # Части альбома приходят отдельными обновлениями: собираем их и пересылаем вместе
+    if update.message.media_group_id:
+        albums.add(update.message, lambda parts: handle_album(user_id, parts, context))
+        return
+
     # Проверяем режим отладки
-    if user_id in debug_mode and debug_mode[user_id]:
+    if store.is_debug(user_id):
         # В режиме отладки отправляем сообщение обратно пользователю
         
         # Определяем ID сообщения для ответа (если это reply)
@@ -614,176 +725,670 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         sent_message_id = await send_any_message(context, user_id, update.message, "🔧 [DEBUG]", reply_to_message_id)
         
         # Сохраняем mapping сообщений для режима отладки (только для редактирования)
-        if sent_message_id and user_id in message_mapping:
-            message_mapping[user_id][update.message.message_id] = sent_message_id
+        if sent_message_id:
+            store.map_message(user_id, update.message.message_id, sent_message_id)
         
         return
 
-    
-    if user_id in active_chats:
-        partner_id = active_chats[user_id]
-        
+
+    partner_id = store.get_partner(user_id)
+    if partner_id is not None:
         # Определяем ID сообщения для ответа (если это reply)
         reply_to_message_id = None
-        if update.message.reply_to_message and user_id in message_mapping:
+        if update.message.reply_to_message:
             # Ищем соответствующее сообщение у партнера
             original_message_id = update.message.reply_to_message.message_id
-            if original_message_id in message_mapping[user_id]:
-                reply_to_message_id = message_mapping[user_id][original_message_id]
+            reply_to_message_id = store.get_mapped(user_id, original_message_id)
         
         # Пересылаем сообщение собеседнику
         sent_message_id = await send_any_message(context, partner_id, update.message, None, reply_to_message_id)
         
         # Сохраняем mapping сообщений
-        if sent_message_id and user_id in message_mapping:
-            message_mapping[user_id][update.message.message_id] = sent_message_id
-            if partner_id in message_mapping:
-                message_mapping[partner_id][sent_message_id] = update.message.message_id
-    
-    else:
-        await update.message.reply_text(
+        if sent_message_id:
+            store.map_message(user_id, update.message.message_id, sent_message_id)
+            store.map_message(partner_id, sent_message_id, update.message.message_id)
+
+    elif not post_to_room(context, user_id, [update.message]):
+        await notify(
+            context, user_id,
             "ℹ️ Вы не в диалоге\n"
             "🔍 Чтобы начать поиск, используйте /start",
             reply_markup=main_keyboard
         )
 
-async def handle_edited_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработка редактированных сообщений"""
-    user_id = update.edited_message.from_user.id
-    
-    # Проверяем режим отладки
-    if user_id in debug_mode and debug_mode[user_id]:
-        # В режиме отладки редактируем сообщение у самого пользователя
-        if user_id in message_mapping and update.edited_message.message_id in message_mapping[user_id]:
-            debug_message_id = message_mapping[user_id][update.edited_message.message_id]
-            
-            # Пытаемся редактировать
-            success = await edit_any_message(context, user_id, debug_message_id, update.edited_message, "🔧 [DEBUG]")
-            
-            if not success:
-                # Если редактирование не удалось, переотправляем
-                try:
-                    await context.bot.delete_message(chat_id=user_id, message_id=debug_message_id)
-                except:
-                    pass
-                new_message_id = await send_any_message(context, user_id, update.edited_message, "🔧 [DEBUG]")
-                if new_message_id:
-                    message_mapping[user_id][update.edited_message.message_id] = new_message_id
-        else:
-            # Сообщение не найдено в mapping - возможно, отправлено до включения режима
-            # Создаем новый mapping
-            if user_id not in message_mapping:
-                message_mapping[user_id] = {}
-            new_message_id = await send_any_message(context, user_id, update.edited_message, "🔧 [DEBUG]")
-            if new_message_id:
-                message_mapping[user_id][update.edited_message.message_id] = new_message_id
+async def handle_album(user_id: int, parts: list, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Пересылка собранного альбома, аналог handle_message для группы сообщений"""
+    first = parts[0]
+
+    if store.is_debug(user_id):
+        reply_to_message_id = first.reply_to_message.message_id if first.reply_to_message else None
+        sent_ids = await send_album(context, user_id, parts, "🔧 [DEBUG]", reply_to_message_id)
+        for part, sent_id in zip(parts, sent_ids):
+            store.map_message(user_id, part.message_id, sent_id)
         return
-    
-    if user_id in active_chats:
-        partner_id = active_chats[user_id]
+
+    partner_id = store.get_partner(user_id)
+    if partner_id is not None:
+        reply_to_message_id = None
+        if first.reply_to_message:
+            reply_to_message_id = store.get_mapped(user_id, first.reply_to_message.message_id)
         
-        # Ищем соответствующее сообщение у партнера
-        if user_id in message_mapping and update.edited_message.message_id in message_mapping[user_id]:
-            partner_message_id = message_mapping[user_id][update.edited_message.message_id]
-            
-            # Редактируем сообщение у партнера
-            success = await edit_any_message(context, partner_id, partner_message_id, update.edited_message)
-            
-            if not success:
-                # Если редактирование не удалось, отправляем новое сообщение
-                await send_any_message(context, partner_id, update.edited_message)
-
-async def handle_debug_edited_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработка редактированных сообщений в режиме отладки"""
+        # Каждая часть получает свое соответствие, чтобы работали reply и редактирование
+        sent_ids = await send_album(context, partner_id, parts, None, reply_to_message_id)
+        for part, sent_id in zip(parts, sent_ids):
+            store.map_message(user_id, part.message_id, sent_id)
+            store.map_message(partner_id, sent_id, part.message_id)
+
+    elif not post_to_room(context, user_id, parts):
+        await notify(
+            context, user_id,
+            "ℹ️ Вы не в диалоге\n"
+            "🔍 Чтобы начать поиск, используйте /start",
+            reply_markup=main_keyboard
+        )
+
+async def handle_edited_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработка редактированных сообщений (в диалоге и в режиме отладки)"""
     user_id = update.edited_message.from_user.id
-    
-    # Убедимся, что mapping существует
-    if user_id not in message_mapping:
-        message_mapping[user_id] = {}
-    
-    # Проверим, есть ли уже отправленная копия этого сообщения
-    if update.edited_message.message_id in message_mapping[user_id]:
-        # Сообщение уже было отправлено - редактируем его
-        debug_message_id = message_mapping[user_id][update.edited_message.message_id]
-        success = await edit_any_message(context, user_id, debug_message_id, update.edited_message, "🔧 [DEBUG]")
-        
-        if not success:
-            # Если редактирование не удалось, удаляем старое и отправляем новое
-            try:
-                await context.bot.delete_message(chat_id=user_id, message_id=debug_message_id)
-            except:
-                pass  # Игнорируем ошибки удаления
-            new_message_id = await send_any_message(context, user_id, update.edited_message, "🔧 [DEBUG]")
+
+    if not settings.EDIT_WINDOW:
+        await relay_edit(user_id, update.edited_message, context)
+        return
+
+    async def flush_edit(message):
+        # Правка пересылается вне обработки обновления, поэтому сама берет блокировку диалога
+        async with dialogue_locks.hold(user_id):
+            await relay_edit(user_id, message, context)
+    edits.add(update.edited_message, flush_edit)
+
+async def relay_edit(user_id: int, message: Update.message, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Переносит правку на копию сообщения у собеседника (в режиме отладки - у самого пользователя)"""
+    debug_mode = store.is_debug(user_id)
+    if debug_mode:
+        chat_id, prefix = user_id, "🔧 [DEBUG]"
+    else:
+        chat_id, prefix = store.get_partner(user_id), None
+        if chat_id is None:
+            edit_room_copies(context, user_id, message)
+            return
+
+    copy_id = store.get_mapped(user_id, message.message_id)
+    if copy_id is None:
+        # Сообщение отправлено до включения режима отладки - показываем его как новое.
+        # Собеседнику не пересылаем: оно было написано не ему
+        if debug_mode:
+            new_message_id = await send_any_message(context, user_id, message, prefix)
             if new_message_id:
-                message_mapping[user_id][update.edited_message.message_id] = new_message_id
+                store.map_message(user_id, message.message_id, new_message_id)
+        return
+
+    if await edit_any_message(context, chat_id, copy_id, message, prefix):
+        return
+
+    # Правку не перенести (например, тип без редактирования): заменяем копию новой
+    try:
+        await sender.call(context.bot, 'delete_message', RELAY, chat_id=chat_id, message_id=copy_id)
+    except Exception:
+        pass  # Игнорируем ошибки удаления
+    new_message_id = await send_any_message(context, chat_id, message, prefix)
+    if new_message_id:
+        store.map_message(user_id, message.message_id, new_message_id)
+        if not debug_mode:
+            store.map_message(chat_id, new_message_id, message.message_id)
+
+def room_prefix(number: int) -> str:
+    """Анонимная подпись участника комнаты в копиях его сообщений"""
+    return f"👤 {number}"
+
+def post_to_room(context: ContextTypes.DEFAULT_TYPE, user_id: int, messages: list) -> bool:
+    """
+    Рассылает сообщение (или альбом) остальным участникам комнаты. Копии
+    уходят параллельно в фоне, каждая в очередь чата своего получателя, поэтому
+    медленный или заблокировавший бота участник не задерживает остальных,
+    а общий лимит отправки соблюдает планировщик. Возвращает False, если
+    пользователь не в комнате
+    """
+    first = messages[0]
+    reply_to = first.reply_to_message.message_id if first.reply_to_message else None
+    post = rooms.post(user_id, [message.message_id for message in messages], reply_to)
+    if post is None:
+        return False
+    room_id, number, seqs, targets = post
+    prefix = room_prefix(number)
+
+    async def deliver(member_id: int, reply_to_message_id: int) -> None:
+        if len(messages) > 1:
+            sent_ids = await send_album(context, member_id, messages, prefix, reply_to_message_id, BULK)
+        elif not takes_prefix(first):
+            # Подпись у стикеров, кружков и прочего не вписать: автор - отдельным сообщением
+            sent_ids = [await send_with_header(context, member_id, first, prefix, reply_to_message_id, BULK)]
+        else:
+            sent_ids = [await send_any_message(context, member_id, first, prefix, reply_to_message_id, BULK)]
+        # Соответствие у каждого получателя свое: по нему работают reply и правки
+        if sent_ids and sent_ids[0]:
+            rooms.record(room_id, member_id, seqs, sent_ids)
+
+    async def fan_out() -> None:
+        start = time.perf_counter()
+        await asyncio.gather(*(deliver(member_id, reply_id) for member_id, reply_id in targets))
+        metrics.room_fanout.observe(time.perf_counter() - start)
+
+    # Задачи создаются по порядку сообщений, поэтому у каждого получателя порядок сохраняется
+    if targets:
+        context.application.create_task(fan_out())
+    return True
+
+def edit_room_copies(context: ContextTypes.DEFAULT_TYPE, user_id: int, message: Update.message) -> None:
+    """Переносит правку на копии сообщения у всех участников комнаты (в фоне)"""
+    found = rooms.copies(user_id, message.message_id)
+    if not found or not found[1]:
+        return
+    number, copies = found
+    context.application.create_task(asyncio.gather(*(
+        edit_any_message(context, member_id, copy_id, message, room_prefix(number), BULK)
+        for member_id, copy_id in copies)))
+
+def rooms_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"{title} ({count})", callback_data=f'room:{room_id}')]
+        for room_id, title, count in rooms.list_rooms()])
+
+def room_blocker(user_id: int) -> str:
+    """Почему пользователь не может войти в комнату, или None"""
+    if store.is_debug(user_id):
+        return "🔧 Вы в режиме отладки. Используйте /debug для выхода."
+    if not store.is_registered(user_id):
+        return "❌ Вы не зарегистрированы! Введите /start"
+    if store.get_partner(user_id) is not None:
+        return "ℹ️ Сначала завершите диалог: /stop"
+    return None
+
+async def rooms_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Кнопка "Комнаты": список комнат с числом участников"""
+    user_id = update.message.from_user.id
+    blocker = room_blocker(user_id)
+    if blocker is not None:
+        await notify(context, user_id, blocker)
+        return
+    await notify(
+        context, user_id,
+        "🏠 Анонимные комнаты: сообщения видят все участники, вместо имени - номер.\n"
+        "Выберите комнату:",
+        reply_markup=rooms_keyboard())
+
+async def join_room(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Вход в комнату кнопкой из списка"""
+    query = update.callback_query
+    user_id = query.from_user.id
+    room_id = query.data.split(':', 1)[1]
+    blocker = room_blocker(user_id)
+    # Только ASCII-цифры: '²' проходит isdigit, но int() на нем падает
+    if blocker is not None or not (room_id.isascii() and room_id.isdigit()):
+        await query.answer(blocker or "Кнопка устарела")
+        return
+
+    # Проверка и вход идут без await между ними: подбор не может связать пользователя в диалог
+    active_searches.discard(user_id)
+    joined = rooms.join(user_id, int(room_id))
+    if joined is None:
+        await query.answer("Комната заполнена или недоступна, выберите другую")
+        return
+    title, count = joined
+    await query.answer()
+    await notify(
+        context, user_id,
+        f"🏠 Вы в комнате «{title}», участников: {count}\n\n"
+        "Пишите - сообщение получат все участники\n"
+        "🚪 /stop - выйти из комнаты",
+        reply_markup=ReplyKeyboardRemove())
+
+def broadcast_options() -> dict:
+    return dict(
+        rate=settings.BROADCAST_RATE,
+        chunk_size=settings.BROADCAST_CHUNK,
+        window=settings.BROADCAST_WINDOW,
+        checkpoint_interval=settings.BROADCAST_CHECKPOINT_INTERVAL)
+
+def start_broadcast(application: Application, job: Broadcast) -> None:
+    """Запускает рассылку в фоне, по окончании администратор получает итог"""
+    context = CallbackContext(application)
+
+    async def report() -> None:
+        await notify(context, job.state['admin_id'], job.progress())
+
+    async def run() -> None:
+        try:
+            await job.run(application.bot, sender, store, report, settings.BROADCAST_REPORT_INTERVAL,
+                          lambda user_id: drop_unreachable(context, user_id))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Состояние сохранено: рассылка продолжится после перезапуска или отменяется через /broadcast stop
+            logging.error(f"Рассылка {job.state['id']} прервана: {e}")
+        else:
+            await report()
+
+    application.bot_data['broadcast'] = job
+    application.bot_data['broadcast_task'] = asyncio.create_task(run())
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /broadcast текст или /broadcast в ответ на сообщение - рассылка всем пользователям,
+    /broadcast - ход текущей рассылки, /broadcast stop - отмена
+    """
+    user_id = update.message.from_user.id
+    if user_id not in settings.ADMIN_IDS:
+        return
+
+    parts = update.message.text.split(None, 1)
+    arg = parts[1].strip() if len(parts) > 1 else ''
+    task = context.bot_data.get('broadcast_task')
+    running = task is not None and not task.done()
+    # В режиме шардов рассылка может идти в другом процессе: тогда она видна только по файлу
+    job = context.bot_data['broadcast'] if running else Broadcast.load(
+        settings.BROADCAST_STATE_PATH, **broadcast_options())
+
+    if arg == 'stop':
+        if job is None or not job.active:
+            await notify(context, user_id, "Нет активной рассылки")
+            return
+        if running:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        elif not context.bot_data.get('run_broadcast', True):
+            # Рассылку ведет другой процесс (режим шардов): он остановит ее сам,
+            # а запись в файл отсюда он бы перезаписал на следующем сохранении
+            job.request_stop()
+            await notify(context, user_id, f"📣 Рассылка {job.state['id']} будет остановлена в течение "
+                                           f"{settings.BROADCAST_CHECKPOINT_INTERVAL:g} с\n\n" + job.progress())
+            return
+        job.state['cancelled'] = True
+        job.save()
+        await notify(context, user_id, job.progress())
+    elif arg or update.message.reply_to_message:
+        if job is not None and job.active:
+            await notify(context, user_id, "❌ Уже идет рассылка, дождитесь ее окончания или отмените: "
+                                           "/broadcast stop\n\n" + job.progress())
+            return
+        reply = update.message.reply_to_message
+        if arg:
+            message = {'text': arg}
+        else:
+            message = {'from_chat_id': reply.chat.id, 'message_id': reply.message_id}
+        job = Broadcast.create(user_id, message, store.count_users(), settings.BROADCAST_STATE_PATH,
+                               **broadcast_options())
+        job.save()
+        start_broadcast(context.application, job)
+        await notify(
+            context, user_id,
+            f"📣 Рассылка {job.state['id']} запущена: получателей {job.state['total']}, "
+            f"до {settings.BROADCAST_RATE:g} сообщ./с\n"
+            "Ход: /broadcast, отмена: /broadcast stop")
+    elif job is not None:
+        await notify(context, user_id, job.progress())
     else:
-        # Это новое сообщение (возможно, было отправлено до включения режима отладки)
-        # Просто отправляем его как новое сообщение
-        new_message_id = await send_any_message(context, user_id, update.edited_message, "🔧 [DEBUG]")
-        if new_message_id:
-            message_mapping[user_id][update.edited_message.message_id] = new_message_id
+        await notify(context, user_id, "Рассылок еще не было")
+
+def start_profiling(application: Application, admin_id: int = None, mode: str = None,
+                    duration: float = None) -> bool:
+    """Запускает сессию профилирования в фоне. False, если уже идет другая"""
+    task = application.bot_data.get('profile_task')
+    if task is not None and not task.done():
+        return False
+    session = ProfileSession(
+        settings.LOG_DIR,
+        mode=mode or settings.PROFILE_MODE,
+        duration=min(duration or settings.PROFILE_DURATION, settings.PROFILE_MAX_DURATION),
+        sample_interval=settings.PROFILE_SAMPLE_INTERVAL,
+        slow_callback=settings.PROFILE_SLOW_CALLBACK)
+    context = CallbackContext(application)
+
+    async def run() -> None:
+        try:
+            summary = await session.run()
+        except Exception as e:
+            logging.error(f"Ошибка профилирования: {e}")
+            return
+        logging.info(summary)
+        if admin_id is not None:
+            await notify(context, admin_id, summary)
+
+    logging.info(f"Профилирование {session.path.name}: режим {session.mode}, {session.duration:g} с")
+    application.bot_data['profile_task'] = asyncio.create_task(run())
+    return True
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/profile [секунды] [sample|cprofile] - профилирование бота, /profile stop - завершить раньше"""
+    user_id = update.message.from_user.id
+    if user_id not in settings.ADMIN_IDS:
+        return
+
+    args = context.args or []
+    if args == ['stop']:
+        task = context.bot_data.get('profile_task')
+        if task is None or task.done():
+            await notify(context, user_id, "Профилирование не запущено")
+        else:
+            # Сессия записывает результаты и присылает отчет сама
+            task.cancel()
+        return
+
+    # Имя next занято обработчиком /next
+    mode = duration = None
+    for arg in args:
+        if arg in PROFILE_MODES:
+            mode = arg
+            continue
+        try:
+            duration = float(arg)
+        except ValueError:
+            await notify(context, user_id, "Использование: /profile [секунды] [sample|cprofile], /profile stop")
+            return
+    if start_profiling(context.application, user_id, mode, duration):
+        await notify(context, user_id, "⏱ Профилирование запущено, отчет придет по окончании. Досрочно: /profile stop")
+    else:
+        await notify(context, user_id, "❌ Профилирование уже идет")
+
+# Готовые ответы /top и /search: {команда: (момент устаревания, текст)}
+stats_cache = {}
+
+
+def cached_stats(name: str, render) -> str:
+    """
+    Ответ из кэша или новый, если прошло STATS_CACHE_TTL секунд. Подсчет
+    синхронный, поэтому одновременные запросы не считают его повторно
+    """
+    now = time.monotonic()
+    cached = stats_cache.get(name)
+    if cached is None or cached[0] <= now:
+        cached = stats_cache[name] = (now + (settings.STATS_CACHE_TTL or 0), render())
+    return cached[1]
+
+
+def _share(count: int, total: int) -> str:
+    return f"{count} ({count / total:.0%})" if total else str(count)
+
+
+def render_top() -> str:
+    """Сводка по счетчикам хранилища и очереди поиска, без обхода пользователей"""
+    chats = store.count_chats()
+    searching = sum(active_searches.counts().values())
+    countries, ages = Counter(), Counter()
+    for profile, count in store.count_profiles().items():
+        countries[profile.get('country', 'Не указана')] += count
+        ages[profile.get('age')] += count
+    total = sum(countries.values())
+
+    lines = [
+        "📊 Статистика\n",
+        f"💬 Общаются сейчас: {2 * chats} (диалогов {chats})",
+        f"🔍 В поиске: {searching}",
+        f"👥 Зарегистрировано: {total}",
+    ]
+    if total:
+        lines.append("\n🌍 Страны:")
+        lines += [f"{i}. {country} - {_share(count, total)}"
+                  for i, (country, count) in enumerate(countries.most_common(), 1)]
+        lines.append("\n🎂 Возраст:")
+        lines += [f"{age} - {_share(ages[age], total)}" for age in AGE_GROUPS if ages[age]]
+    return '\n'.join(lines)
+
+
+def render_search() -> str:
+    """Кто сейчас в поиске: по своему и искомому полу"""
+    counts = active_searches.counts()
+    total = sum(counts.values())
+    by_gender, by_wanted = Counter(), Counter()
+    for (gender, wanted), count in counts.items():
+        by_gender[gender] += count
+        by_wanted[wanted] += count
+    return '\n'.join([
+        f"🔍 Сейчас в поиске: {total}\n",
+        f"👨 Парней: {by_gender['male']}, 👩 девушек: {by_gender['female']}\n",
+        f"Ищут девушку: {_share(by_wanted['female'], total)}",
+        f"Ищут парня: {_share(by_wanted['male'], total)}",
+        f"Рандом: {_share(by_wanted[None], total)}",
+    ])
+
+
+async def top_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await notify(context, update.effective_chat.id, cached_stats('top', render_top))
+
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await notify(context, update.effective_chat.id, cached_stats('search', render_search))
 
-async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await update.message.reply_text("Регистрация отменена")
-    return ConversationHandler.END
 
 async def dummy_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text("🚧 В разработке")
+    await notify(context, update.effective_chat.id, "🚧 В разработке")
 
-def main() -> None:
-    # Настройка логирования
-    logger = setup_logging()
-    logger.info("Бот запущен")
-    
-    # Создаем Application
-    application = Application.builder().token(TOKEN).build()
-
-    # Обработчик регистрации
-    conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('start', start)],
-        states={
-            GENDER: [CallbackQueryHandler(registration_gender)],
-            COUNTRY: [CallbackQueryHandler(registration_country)],
-            AGE: [CallbackQueryHandler(registration_age)],
-        },
-        fallbacks=[CommandHandler('cancel', cancel)],
-        per_message=True
+def register_gauges() -> None:
+    """Метрики состояния бота, снимаются в момент запроса /metrics"""
+    metrics.REGISTRY.gauge('bot_active_searches', 'Пользователей в поиске', lambda: len(active_searches))
+    metrics.REGISTRY.gauge('bot_active_chats', 'Активных диалогов', lambda: store.count_chats())
+    metrics.REGISTRY.gauge('bot_message_mapping_entries', 'Записей в соответствии сообщений',
+                           lambda: store.count_mapped())
+    metrics.REGISTRY.gauge('bot_room_members', 'Пользователей в комнатах', lambda: rooms.count_members())
+    metrics.REGISTRY.gauge('bot_unreachable_users', 'Заблокировали бота или удалили аккаунт',
+                           lambda: store.count_unreachable())
+    metrics.REGISTRY.gauge('bot_pending_albums', 'Альбомов в сборке', lambda: len(albums))
+    metrics.REGISTRY.gauge('bot_pending_edits', 'Правок в окне схлопывания', lambda: len(edits))
+    metrics.REGISTRY.gauge('bot_edits_coalesced_total', 'Правок, замененных более поздней версией',
+                           lambda: edits.coalesced, kind='counter')
+    metrics.REGISTRY.gauge('bot_flood_tracked_users', 'Пользователей в памяти входящего лимита',
+                           lambda: len(flood))
+    metrics.REGISTRY.gauge('bot_dialogue_locks', 'Пользователей с обрабатываемыми обновлениями',
+                           lambda: len(dialogue_locks))
+    metrics.REGISTRY.gauge('bot_send_queue_depth', 'Запросов в очереди отправки', lambda: sender.stats()['queued'])
+    metrics.REGISTRY.gauge('bot_send_in_flight', 'Запросов к Bot API в полете', lambda: sender.stats()['in_flight'])
+    for key in sender.counters:
+        metrics.REGISTRY.gauge(f'bot_send_{key}_total', f'Планировщик отправки: {key}',
+                               lambda key=key: sender.counters[key], kind='counter')
+
+async def on_startup(application: Application) -> None:
+    event_log.start()
+    if settings.METRICS_PORT:
+        application.bot_data['metrics_server'] = await metrics.start_metrics_server(
+            settings.METRICS_LISTEN, settings.METRICS_PORT)
+    # В режиме шардов подбор ведет только один воркер
+    if settings.MATCH_INTERVAL and application.bot_data.get('run_matcher', True):
+        application.bot_data['matcher_task'] = asyncio.create_task(run_matcher(application))
+    if settings.REAPER_INTERVAL and application.bot_data.get('run_reaper', True):
+        application.bot_data['reaper_task'] = asyncio.create_task(run_reaper(application))
+    # kill -USR1 <pid> запускает профилирование без команды, отчет - в логе
+    if hasattr(signal, 'SIGUSR1'):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, start_profiling, application)
+    # Незавершенная рассылка продолжается с места остановки
+    if application.bot_data.get('run_broadcast', True):
+        job = Broadcast.load(settings.BROADCAST_STATE_PATH, **broadcast_options())
+        if job is not None and job.active:
+            logging.info(f"Продолжение рассылки {job.state['id']} после пользователя {job.state['cursor']}")
+            start_broadcast(application, job)
+
+async def on_shutdown(application: Application) -> None:
+    if hasattr(signal, 'SIGUSR1'):
+        asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+    if 'profile_task' in application.bot_data:
+        task = application.bot_data.pop('profile_task')
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    # Рассылка сохраняет прогресс до того, как планировщик отменит ее запросы
+    if 'broadcast_task' in application.bot_data:
+        task = application.bot_data.pop('broadcast_task')
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    # Отменяем ожидающие запросы, чтобы не держать цикл событий
+    await sender.close()
+    if 'matcher_task' in application.bot_data:
+        application.bot_data.pop('matcher_task').cancel()
+    if 'reaper_task' in application.bot_data:
+        application.bot_data.pop('reaper_task').cancel()
+    if 'metrics_server' in application.bot_data:
+        await application.bot_data.pop('metrics_server').stop()
+    event_log.close()
+
+def create_requests() -> tuple:
+    """Транспорт Bot API из настроек: (отправка, получение обновлений) с отдельными пулами"""
+    common = dict(
+        keepalive=settings.HTTP_KEEPALIVE,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+        http_version=settings.HTTP_VERSION,
+        connect_timeout=settings.HTTP_CONNECT_TIMEOUT,
+        read_timeout=settings.HTTP_READ_TIMEOUT,
+        write_timeout=settings.HTTP_WRITE_TIMEOUT,
+        pool_timeout=settings.HTTP_POOL_TIMEOUT,
+        stripe_size=settings.HTTP_POOL_STRIPE)
+    send = PooledRequest({
+        'send': Pool(settings.HTTP_POOL_SIZE, **common),
+        'media': Pool(settings.HTTP_MEDIA_POOL_SIZE, **{**common, 'pool_timeout': settings.HTTP_MEDIA_POOL_TIMEOUT}),
+    }, route_media, settings.HTTP_METHOD_TIMEOUTS)
+    updates = PooledRequest({'updates': Pool(settings.HTTP_UPDATES_POOL_SIZE, **common)})
+    return send, updates
+
+def build_application(token: str = TOKEN, base_url: str = None, serve_mode: str = None,
+                      concurrent_updates: int = None) -> Application:
+    """Создает Application со всеми обработчиками (используется и нагрузочным тестом)"""
+    serve_mode = serve_mode or settings.SERVE_MODE
+    if concurrent_updates is None:
+        concurrent_updates = settings.CONCURRENT_UPDATES
+
+    # Создаем Application (воркеру шардов и вебхуку Updater не нужен: обновления
+    # передают координатор и свой HTTP сервер).
+    # Транспорт обернут для замера задержек и ошибок каждого метода Bot API
+    send_request, updates_request = create_requests()
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(metrics.InstrumentedRequest(send_request))
+        .get_updates_request(metrics.InstrumentedRequest(updates_request))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
     )
-    application.add_handler(conv_handler)
+    if base_url:
+        # Другой сервер Bot API: свой telegram-bot-api или локальная заглушка
+        builder = builder.base_url(f"{base_url.rstrip('/')}/bot")
+    if concurrent_updates > 1:
+        # Медленная пересылка одной пары не задерживает остальных
+        # Входящий лимит проверяется до очереди за блокировкой диалога: иначе
+        # сообщения флудера ждали бы ее, занимая места параллельной обработки
+        admit = admit_update if settings.FLOOD_RATE else None
+        builder = builder.concurrent_updates(DialogueUpdateProcessor(concurrent_updates, dialogue_locks, admit))
+    if serve_mode in ('worker', 'webhook'):
+        builder = builder.updater(None)
+    application = builder.build()
+
+    # Пишущий боту снова доступен, даже если его сообщение отбросит входящий лимит
+    application.add_handler(TypeHandler(Update, track_reachable), group=-3)
+    # Собираемый альбом уходит раньше следующего сообщения или команды того же пользователя
+    application.add_handler(TypeHandler(Update, flush_albums), group=-2)
+    # Входящий лимит сообщений - раньше всех остальных обработчиков
+    if settings.FLOOD_RATE and concurrent_updates <= 1:
+        application.add_handler(TypeHandler(Update, flood_control), group=-1)
+
+    # Регистрация: /start и кнопки шагов
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CallbackQueryHandler(registration, pattern='^reg:'))
+    application.add_handler(CallbackQueryHandler(join_room, pattern='^room:'))
 
     # Обработчики команд
     application.add_handler(CommandHandler("debug", debug))
     application.add_handler(CommandHandler("stop", stop))
     application.add_handler(CommandHandler("next", next))
-    
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("top", top_command))
+    application.add_handler(CommandHandler("search", search_command))
+
     # Обработчики всех типов сообщений (кроме команд)
     application.add_handler(MessageHandler(
-        filters.Regex('^(Найти девушку|Рандом|Найти парня)$'),
+        filters.UpdateType.MESSAGE & filters.Regex('^(Найти девушку|Рандом|Найти парня)$'),
         start_search))
-    
-    # Обработчик для всех типов сообщений (текст, фото, видео, документы и т.д.)
     application.add_handler(MessageHandler(
-        ~filters.COMMAND,
+        filters.UpdateType.MESSAGE & filters.Regex('^Комнаты$'),
+        rooms_menu))
+
+    # Обработчик для всех типов сообщений (текст, фото, видео, документы и т.д.).
+    # Правки сюда не попадают: у них нет update.message
+    application.add_handler(MessageHandler(
+        filters.UpdateType.MESSAGE & ~filters.COMMAND,
         handle_message))
-    
+
     # Обработчик для редактированных сообщений
     application.add_handler(MessageHandler(
         filters.UpdateType.EDITED_MESSAGE & ~filters.COMMAND,
         handle_edited_message))
 
     # Заглушки для других команд
-    commands = ['vip', 'link', 'ref', 'issue', 'search', 'top']
+    commands = ['vip', 'link', 'ref', 'issue']
     for cmd in commands:
         application.add_handler(CommandHandler(cmd, dummy_command))
 
+    # Замер времени всех обработчиков
+    metrics.instrument_handlers(application)
+    register_gauges()
+    send_request.register_gauges()
+    updates_request.register_gauges()
+    return application
+
+async def serve_webhook(application: Application) -> None:
+    """Один процесс в режиме вебхука: работает до SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    async with application:
+        await application.post_init(application)
+        await application.start()
+        server = await start_webhook(application, ALLOWED_UPDATES)
+        try:
+            await stop_event.wait()
+        finally:
+            await server.stop()
+            await application.stop()
+    await application.post_shutdown(application)
+
+def main() -> None:
+    global store
+
+    # Настройка логирования
+    logger = setup_logging()
+    logger.info("Бот запущен")
+
+    # Открываем хранилище состояния
+    store = create_store(
+        settings.STORAGE_BACKEND,
+        path=settings.SQLITE_PATH,
+        flush_interval=settings.SQLITE_FLUSH_INTERVAL,
+        batch_size=settings.SQLITE_BATCH_SIZE,
+        user_cache_size=settings.USER_CACHE_SIZE,
+        map_window=settings.MESSAGE_MAP_WINDOW,
+        map_ttl=settings.MESSAGE_MAP_TTL)
+    store.open()
+
     # Запуск бота
-    logger.info("Бот начал работу")
+    logger.info(f"Бот начал работу (режим {settings.SERVE_MODE}, процессов {settings.SHARDS})")
     try:
-        application.run_polling()
+        if settings.SHARDS > 1:
+            # Координатор раздает обновления воркерам, хранилище общее для всех
+            run_sharded(settings.SHARDS, store, ALLOWED_UPDATES, matcher)
+            return
+        
+        application = build_application(base_url=settings.BOT_API_BASE_URL)
+        if settings.SERVE_MODE == 'webhook':
+            if not settings.WEBHOOK_SECRET:
+                raise ValueError("Для режима вебхука нужен WEBHOOK_SECRET")
+            # Тот же HTTP сервер, что у координатора шардов: проверка секрета,
+            # setWebhook с allowed_updates и max_connections, если задан WEBHOOK_URL
+            asyncio.run(serve_webhook(application))
+        else:
+            application.run_polling(allowed_updates=ALLOWED_UPDATES)
     except Exception as e:
         logger.error(f"Бот остановлен из-за ошибки: {str(e)}")
         raise
     finally:
+        # Дописываем на диск все накопленные изменения
+        store.close()
         logger.info("Бот остановлен")
 
 if __name__ == '__main__':
@@ -0,0 +1,274 @@
+import time
+from collections import OrderedDict
+from itertools import count
+
+# Возможные значения пола. None в фильтре поиска означает "любой"
+GENDERS = ('male', 'female')
+
+
+class SearchEntry:
+    """Запись об ожидающем в поиске пользователе"""
+    __slots__ = ('user_id', 'gender', 'wanted', 'message_id', 'since', 'seq', 'country', 'age')
+
+    def __init__(self, user_id: int, gender: str, wanted: str, message_id: int, since: float, seq: int,
+                 country: str = None, age: str = None):
+        self.user_id = user_id
+        self.gender = gender
+        self.wanted = wanted
+        self.message_id = message_id
+        self.since = since
+        self.seq = seq
+        self.country = country
+        self.age = age
+
+    @property
+    def profile(self) -> tuple:
+        """Ключ группы для пакетного подбора"""
+        return self.gender, self.wanted, self.country, self.age
+
+    def __getitem__(self, key):
+        # Совместимость со старым форматом active_searches[user_id]['gender']
+        return getattr(self, key)
+
+
+class MatchQueue:
+    """
+    Индекс ожидающих собеседника пользователей.
+
+    Пользователи лежат в FIFO-корзинах по ключу (свой пол, искомый пол).
+    Для нового пользователя подходят не более четырех корзин, поэтому
+    постановка в очередь, отмена и поиск пары выполняются за O(1)
+    независимо от числа ожидающих. Из подходящих корзин выбирается
+    тот, кто ждет дольше всех.
+
+    Для пакетного подбора (take_batch) ожидающие дополнительно лежат в
+    группах по профилю: (пол, фильтр, страна, возраст).
+    """
+
+    def __init__(self, matcher: 'BatchMatcher' = None):
+        self.matcher = matcher
+        self._buckets = {}
+        self._groups = {}
+        self._entries = {}
+        self._seq = count()
+        # Секунд на удаление одной пары из очереди после подбора, по прошлым проходам
+        self._removal_cost = 5e-6
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self):
+        # Обход от самых давних к самым новым: повторный add переносит запись в конец
+        return iter(self._entries.values())
+
+    def get(self, user_id: int) -> SearchEntry:
+        return self._entries.get(user_id)
+
+    def counts(self) -> dict:
+        """Число ожидающих по (свой пол, искомый пол) - длины корзин, без обхода очереди"""
+        return {key: len(bucket) for key, bucket in self._buckets.items() if bucket}
+
+    def add(self, user_id: int, gender: str, wanted: str = None, message_id: int = None,
+            country: str = None, age: str = None) -> SearchEntry:
+        """Ставит пользователя в очередь (повторный вызов обновляет фильтр и время)"""
+        self.discard(user_id)
+        entry = SearchEntry(user_id, gender, wanted, message_id, time.monotonic(), next(self._seq), country, age)
+        bucket = self._buckets.get((gender, wanted))
+        if bucket is None:
+            bucket = self._buckets[(gender, wanted)] = OrderedDict()
+        bucket[user_id] = entry
+        group = self._groups.get(entry.profile)
+        if group is None:
+            group = self._groups[entry.profile] = OrderedDict()
+        group[user_id] = entry
+        self._entries[user_id] = entry
+        return entry
+
+    def discard(self, user_id: int) -> SearchEntry:
+        """Убирает пользователя из очереди, если он там есть"""
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            del self._buckets[(entry.gender, entry.wanted)][user_id]
+            group = self._groups[entry.profile]
+            del group[user_id]
+            if not group:
+                del self._groups[entry.profile]
+        return entry
+
+    def _candidate_keys(self, entry: SearchEntry):
+        # Партнер должен подходить под наш фильтр, а мы - под его
+        partner_genders = GENDERS if entry.wanted is None else (entry.wanted,)
+        for partner_gender in partner_genders:
+            yield (partner_gender, entry.gender)
+            yield (partner_gender, None)
+
+    def find(self, user_id: int) -> SearchEntry:
+        """Возвращает самого давнего подходящего партнера, не изменяя очередь"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+
+        best = None
+        for key in self._candidate_keys(entry):
+            bucket = self._buckets.get(key)
+            if not bucket:
+                continue
+            # Голова корзины - самый давний; себя пропускаем
+            for candidate in bucket.values():
+                if candidate.user_id != user_id:
+                    break
+            else:
+                continue
+            if best is None or candidate.seq < best.seq:
+                best = candidate
+        return best
+
+    def pop_match(self, user_id: int) -> SearchEntry:
+        """Находит партнера и убирает из очереди обоих. Возвращает запись партнера или None"""
+        partner = self.find(user_id)
+        if partner is None:
+            return None
+        self.discard(user_id)
+        self.discard(partner.user_id)
+        return partner
+
+    def take_stale(self, timeout: float, now: float = None) -> list:
+        """
+        Убирает из очереди ждущих дольше timeout секунд и возвращает их записи.
+        Записи лежат в порядке постановки, поэтому просматриваются только устаревшие
+        """
+        now = time.monotonic() if now is None else now
+        stale = []
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if now - entry.since < timeout:
+                break
+            self.discard(entry.user_id)
+            stale.append(entry)
+        return stale
+
+    def take_batch(self, now: float = None, pair_cost: float = 0.0) -> list:
+        """
+        Пакетный подбор по всей очереди: убирает пары из очереди и возвращает [(запись, партнер, оценка), ...].
+        pair_cost - сколько секунд вызывающий потратит на каждую пару после (создание диалога,
+        уведомления): это время входит в тот же бюджет прохода
+        """
+        pairs = self.matcher.plan(self, self._groups, now, pair_cost + self._removal_cost)
+        start = time.perf_counter()
+        for entry, partner, score in pairs:
+            self.discard(entry.user_id)
+            self.discard(partner.user_id)
+        if pairs:
+            self._removal_cost += ((time.perf_counter() - start) / len(pairs) - self._removal_cost) / 4
+        return pairs
+
+
+def compatible(gender: str, wanted: str, other_gender: str, other_wanted: str) -> bool:
+    """Фильтры по полу выполняются в обе стороны"""
+    return (wanted is None or wanted == other_gender) and (other_wanted is None or other_wanted == gender)
+
+
+class BatchMatcher:
+    """
+    Пакетный подбор пар для всей очереди поиска за один проход.
+
+    Оценка пары: совпадение страны плюс близость возрастных групп.
+    Чем дольше пользователь ждет, тем ниже требуемая оценка: каждые
+    relax_step секунд ожидания - на единицу меньше, пока не подойдет
+    любой собеседник с подходящим полом.
+
+    Ожидающие разбираются от самых давних. Очередь хранит их в группах по
+    профилю, и для каждой группы заранее известен список совместимых групп
+    по убыванию оценки. Поэтому на одного пользователя приходится проверка
+    нескольких голов групп, а не всей очереди. Если проход вместе с
+    обработкой найденных пар не укладывается в budget секунд, оставшиеся
+    ждут следующего запуска.
+    """
+
+    def __init__(self, age_groups: list, country_weight: int = 2, age_weight: int = 2,
+                 relax_step: float = 10.0, budget: float = 0.05):
+        self.age_index = {age: i for i, age in enumerate(age_groups)}
+        self.country_weight = country_weight
+        self.age_weight = age_weight
+        self.max_score = country_weight + age_weight
+        self.relax_step = relax_step
+        self.budget = budget
+        self._known_profiles = set()
+        # Профиль -> [(оценка, [совместимые профили с этой оценкой]), ...] по убыванию оценки
+        self._tiers = {}
+
+    def score(self, profile: tuple, other: tuple) -> int:
+        score = 0
+        if profile[2] is not None and profile[2] == other[2]:
+            score += self.country_weight
+        age, other_age = self.age_index.get(profile[3]), self.age_index.get(other[3])
+        if age is not None and other_age is not None:
+            score += max(0, self.age_weight - abs(age - other_age))
+        return score
+
+    def required(self, wait: float) -> int:
+        """Минимальная оценка пары для пользователя, ждущего wait секунд"""
+        return max(0, self.max_score - int(wait / self.relax_step))
+
+    def _tiers_for(self, profile: tuple) -> list:
+        tiers = self._tiers.get(profile)
+        if tiers is None:
+            by_score = {}
+            for other in self._known_profiles:
+                if compatible(profile[0], profile[1], other[0], other[1]):
+                    by_score.setdefault(self.score(profile, other), []).append(other)
+            tiers = self._tiers[profile] = sorted(by_score.items(), reverse=True)
+        return tiers
+
+    def plan(self, entries, groups: dict, now: float = None, pair_cost: float = 0.0) -> list:
+        """
+        Подбирает пары, не изменяя очередь. Возвращает [(запись, партнер, оценка), ...].
+        entries - ожидающие от самых давних, groups - профиль -> {user_id: запись} в том же порядке.
+        На каждую найденную пару из бюджета резервируется pair_cost секунд
+        """
+        deadline = time.perf_counter() + self.budget
+        now = time.monotonic() if now is None else now
+        if not self._known_profiles.issuperset(groups):
+            # Новые комбинации признаков: списки совместимых групп пересчитываются
+            self._known_profiles.update(groups)
+            self._tiers.clear()
+
+        taken = set()
+        # Профиль -> [итератор по группе, текущая голова]; голова None - группа разобрана
+        cursors = {}
+
+        def head(profile: tuple) -> SearchEntry:
+            cursor = cursors.get(profile)
+            if cursor is None:
+                group = groups.get(profile)
+                values = iter(group.values()) if group else iter(())
+                cursor = cursors[profile] = [values, next(values, None)]
+            while cursor[1] is not None and cursor[1].user_id in taken:
+                cursor[1] = next(cursor[0], None)
+            return cursor[1]
+
+        pairs = []
+        for n, entry in enumerate(entries):
+            if not n % 64 and n and time.perf_counter() + len(pairs) * pair_cost > deadline:
+                break
+            if entry.user_id in taken:
+                continue
+            taken.add(entry.user_id)
+            required = self.required(now - entry.since)
+            for score, profiles in self._tiers_for(entry.profile):
+                if score < required:
+                    break
+                # Среди групп с одинаковой оценкой - тот, кто ждет дольше
+                best = None
+                for profile in profiles:
+                    candidate = head(profile)
+                    if candidate is not None and (best is None or candidate.seq < best.seq):
+                        best = candidate
+                if best is not None:
+                    taken.add(best.user_id)
+                    pairs.append((entry, best, score))
+                    break
+        return pairs
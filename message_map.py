@@ -0,0 +1,90 @@
+import time
+from array import array
+from bisect import bisect_left
+
+# message_id в Bot API помещается в 32 бита
+_ID_TYPECODE = 'i'
+_STAMP_TYPECODE = 'I'
+
+
+class MessageMap:
+    """
+    Компактное соответствие сообщений одного пользователя.
+
+    Ключи - ID сообщений в чате пользователя с ботом (и его собственные,
+    и копии от собеседника), значения - ID соответствующих сообщений
+    у собеседника. В одном чате ID растут монотонно, поэтому записи лежат
+    в трех отсортированных массивах (ключ, значение, время) и ищутся
+    бинарным поиском. Хранится окно из последних window записей не старше
+    ttl секунд, старые записи отбрасываются сдвигом начала кольца.
+    Запись занимает 12 байт вместо ~150 байт в словаре с int-объектами.
+    """
+    __slots__ = ('window', 'ttl', '_keys', '_values', '_stamps', '_head')
+
+    def __init__(self, window: int = 10_000, ttl: float = None):
+        self.window = window
+        self.ttl = ttl
+        self._keys = array(_ID_TYPECODE)
+        self._values = array(_ID_TYPECODE)
+        self._stamps = array(_STAMP_TYPECODE)
+        # Индекс первой живой записи: все, что левее, уже вытеснено
+        self._head = 0
+
+    def __len__(self) -> int:
+        return len(self._keys) - self._head
+
+    def __contains__(self, key: int) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: int, default: int = None) -> int:
+        keys = self._keys
+        i = bisect_left(keys, key, self._head)
+        if i < len(keys) and keys[i] == key:
+            if self.ttl is None or self._stamps[i] >= time.time() - self.ttl:
+                return self._values[i]
+        return default
+
+    def oldest_key(self) -> int:
+        """Самый старый хранимый ключ или None, если окно пусто"""
+        return self._keys[self._head] if len(self) else None
+
+    def put(self, key: int, value: int) -> bool:
+        """
+        Добавляет или обновляет запись.
+        Возвращает True, если при этом вытесненные записи были физически удалены
+        """
+        keys = self._keys
+        now = int(time.time())
+        if not len(self) or key > keys[-1]:
+            # Обычный случай: новое сообщение в конец
+            keys.append(key)
+            self._values.append(value)
+            self._stamps.append(now)
+        else:
+            i = bisect_left(keys, key, self._head)
+            if i < len(keys) and keys[i] == key:
+                self._values[i] = value
+                return False
+            # Запись пришла не по порядку (параллельные пересылки) - вставляем рядом с концом
+            keys.insert(i, key)
+            self._values.insert(i, value)
+            self._stamps.insert(i, now)
+        return self._evict(now)
+
+    def _evict(self, now: int) -> bool:
+        head = max(self._head, len(self._keys) - self.window)
+        if self.ttl is not None:
+            cutoff = now - self.ttl
+            stamps = self._stamps
+            while head < len(stamps) and stamps[head] < cutoff:
+                head += 1
+        self._head = head
+
+        # Сжимаем массивы, когда мертвая часть сравнялась с живой (амортизированно O(1))
+        if head >= 64 and head * 2 >= len(self._keys):
+            del self._keys[:head]
+            del self._values[:head]
+            del self._stamps[:head]
+            self._head = 0
+            return True
+        return False
@@ -0,0 +1,217 @@
+import functools
+import logging
+import time
+from bisect import bisect_left
+
+from telegram.ext import ApplicationHandlerStop
+from telegram.request import BaseRequest
+
+from httpserver import HTTPServer, Request
+
+# Границы корзин гистограмм задержек (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Границы для времени ожидания собеседника (секунды)
+WAIT_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{n}="{v}"' for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self._values = {}
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self.buckets = buckets
+        # Значения меток -> [счетчики по корзинам..., +Inf], сумма
+        self._series = {}
+
+    def observe(self, value: float, *label_values) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def totals(self) -> dict:
+        """Значения меток -> (число наблюдений, сумма): для разницы между двумя моментами"""
+        return {values: (sum(counts), total) for values, (counts, total) in self._series.items()}
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.label_names + ('le',)
+        for values, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, values + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, values)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, values)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Значение снимается функцией в момент запроса метрик, а не поддерживается на горячем пути"""
+
+    def __init__(self, name: str, help_text: str, read, kind: str = 'gauge'):
+        self.name = name
+        self.help = help_text
+        self.read = read
+        # Счетчики, которые ведет другая подсистема, отдаются с типом counter
+        self.kind = kind
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {self.read()}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def gauge(self, name: str, help_text: str, read, kind: str = 'gauge') -> Gauge:
+        return self.register(Gauge(name, help_text, read, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logging.error(f"Ошибка при снятии метрики {metric.name}: {e}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+handler_latency = REGISTRY.register(Histogram(
+    'bot_handler_seconds', 'Время работы обработчика обновления', ('handler',)))
+handler_errors = REGISTRY.register(Counter(
+    'bot_handler_errors_total', 'Исключения в обработчиках', ('handler',)))
+api_latency = REGISTRY.register(Histogram(
+    'bot_api_request_seconds', 'Время запроса к Bot API', ('method',)))
+api_errors = REGISTRY.register(Counter(
+    'bot_api_errors_total', 'Ошибки запросов к Bot API', ('method', 'reason')))
+http_pool_wait = REGISTRY.register(Histogram(
+    'bot_http_pool_wait_seconds', 'Ожидание свободного соединения в пуле', ('pool',)))
+match_wait = REGISTRY.register(Histogram(
+    'bot_match_wait_seconds', 'Время от начала поиска до нахождения собеседника', (), WAIT_BUCKETS))
+match_tick = REGISTRY.register(Histogram(
+    'bot_match_tick_seconds', 'Время прохода пакетного подбора пар'))
+match_pairs = REGISTRY.register(Counter(
+    'bot_match_pairs_total', 'Пары пакетного подбора по оценке', ('score',)))
+flood_dropped = REGISTRY.register(Counter(
+    'bot_flood_dropped_total', 'Входящие сообщения, отброшенные лимитом'))
+flood_mutes = REGISTRY.register(Counter(
+    'bot_flood_mutes_total', 'Включений молчания за флуд'))
+dead_chats = REGISTRY.register(Counter(
+    'bot_dead_chats_total', 'Пользователей, отмеченных недоступными (заблокировали бота или удалили аккаунт)'))
+reaped = REGISTRY.register(Counter(
+    'bot_reaped_total', 'Завершено по простою: диалоги (dialogue) и поиски (search)', ('kind',)))
+room_fanout = REGISTRY.register(Histogram(
+    'bot_room_fanout_seconds', 'Время доставки сообщения комнаты всем участникам', (), WAIT_BUCKETS))
+broadcast_messages = REGISTRY.register(Counter(
+    'bot_broadcast_messages_total', 'Сообщения рассылки по результату', ('result',)))
+
+
+def timed(callback, name: str = None):
+    """Оборачивает обработчик PTB: время выполнения и исключения по имени обработчика"""
+    name = name or callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            # Штатная остановка обработки обновления, а не ошибка
+            raise
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - start, name)
+
+    return wrapper
+
+
+def instrument_handlers(application) -> None:
+    """Подключает замер времени ко всем зарегистрированным обработчикам"""
+    for group in application.handlers.values():
+        for handler in group:
+            if not getattr(handler.callback, '__wrapped__', None):
+                handler.callback = timed(handler.callback)
+
+
+class InstrumentedRequest(BaseRequest):
+    """Обертка над транспортом PTB: задержка и ошибки каждого метода Bot API"""
+
+    def __init__(self, inner: BaseRequest):
+        self._inner = inner
+
+    @property
+    def read_timeout(self):
+        return self._inner.read_timeout
+
+    async def initialize(self) -> None:
+        await self._inner.initialize()
+
+    async def shutdown(self) -> None:
+        await self._inner.shutdown()
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        api_method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            code, payload = await self._inner.do_request(
+                url, method, request_data, read_timeout=read_timeout, write_timeout=write_timeout,
+                connect_timeout=connect_timeout, pool_timeout=pool_timeout)
+        except Exception as e:
+            api_errors.inc(api_method, type(e).__name__)
+            raise
+        finally:
+            api_latency.observe(time.perf_counter() - start, api_method)
+        if code >= 400:
+            api_errors.inc(api_method, str(code))
+        return code, payload
+
+
+async def _handle_metrics(request: Request) -> tuple:
+    return 200, 'text/plain; version=0.0.4; charset=utf-8', REGISTRY.render().encode()
+
+
+async def start_metrics_server(listen: str, port: int) -> HTTPServer:
+    """Страница /metrics в текстовом формате Prometheus"""
+    server = HTTPServer(listen, port)
+    server.route('/metrics', _handle_metrics)
+    await server.start()
+    return server
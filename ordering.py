@@ -0,0 +1,107 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class DialogueLocks:
+    """
+    Блокировки пользователей для параллельной обработки обновлений.
+
+    Обновление пользователя выполняется под блокировкой его самого и его
+    собеседника: сообщения и команды обоих участников диалога идут по
+    очереди, а разные пары - параллельно. Блокировки берутся в порядке
+    возрастания ID (без взаимных блокировок) и отдаются в порядке прихода.
+    Неиспользуемые записи удаляются, так что память не растет с числом пользователей.
+    """
+
+    def __init__(self, partner_of):
+        # partner_of(user_id) -> ID собеседника или None
+        self.partner_of = partner_of
+        # ID -> [блокировка, сколько задач держат или ждут ее]
+        self._locks = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    async def _acquire(self, key: int) -> None:
+        slot = self._locks.get(key)
+        if slot is None:
+            slot = self._locks[key] = [asyncio.Lock(), 0]
+        slot[1] += 1
+        try:
+            await slot[0].acquire()
+        except BaseException:
+            self._forget(key, slot)
+            raise
+
+    def _release(self, key: int) -> None:
+        slot = self._locks[key]
+        slot[0].release()
+        self._forget(key, slot)
+
+    def _forget(self, key: int, slot: list) -> None:
+        slot[1] -= 1
+        if not slot[1]:
+            del self._locks[key]
+
+    async def _acquire_dialogue(self, user_id: int) -> list:
+        while True:
+            partner_id = self.partner_of(user_id)
+            keys = sorted({user_id, partner_id} - {None})
+            held = []
+            try:
+                for key in keys:
+                    await self._acquire(key)
+                    held.append(key)
+            except BaseException:
+                for key in held:
+                    self._release(key)
+                raise
+            # Пока ждали, собеседник мог смениться - тогда берем заново
+            partner_id = self.partner_of(user_id)
+            if partner_id is None or partner_id in keys:
+                return keys
+            for key in keys:
+                self._release(key)
+
+    @asynccontextmanager
+    async def hold(self, user_id: int):
+        keys = await self._acquire_dialogue(user_id)
+        try:
+            yield
+        finally:
+            for key in keys:
+                self._release(key)
+
+
+class DialogueUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений PTB с порядком внутри диалога.
+    Обновления без пользователя обрабатываются без блокировок.
+    admit(update) -> False отбрасывает обновление еще до очереди за
+    блокировкой, чтобы оно не занимало место среди обрабатываемых
+    """
+
+    def __init__(self, max_concurrent_updates: int, locks: DialogueLocks, admit=None):
+        super().__init__(max_concurrent_updates)
+        self.locks = locks
+        self.admit = admit
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await coroutine
+            return
+        if self.admit is not None and not self.admit(update):
+            coroutine.close()
+            return
+        async with self.locks.hold(user.id):
+            await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,131 @@
+from collections import OrderedDict
+
+FIELDS = ('gender', 'country', 'age')
+
+
+class Profile:
+    """
+    Профиль пользователя. Неизменяемый: одинаковые профили - это один
+    объект на всех пользователей (см. make_profile), а изменение профиля -
+    сохранение нового. Читается как словарь: profile['gender'], profile.get('age')
+    """
+    __slots__ = FIELDS
+
+    def __init__(self, gender: str = None, country: str = None, age: str = None):
+        object.__setattr__(self, 'gender', gender)
+        object.__setattr__(self, 'country', country)
+        object.__setattr__(self, 'age', age)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Профиль неизменяемый, сохраните новый через save_user")
+
+    def __reduce__(self):
+        # Между процессами (шарды) профиль приходит уже общим объектом
+        return make_profile, (self.as_dict(),)
+
+    def __getitem__(self, key):
+        value = getattr(self, key) if key in FIELDS else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = getattr(self, key) if key in FIELDS else None
+        return default if value is None else value
+
+    def keys(self) -> list:
+        return [field for field in FIELDS if getattr(self, field) is not None]
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def as_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.keys()}
+
+    def __eq__(self, other):
+        if isinstance(other, Profile):
+            return self is other or self.as_dict() == other.as_dict()
+        if isinstance(other, dict):
+            return self.as_dict() == other
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.gender, self.country, self.age))
+
+    def __repr__(self):
+        return f"Profile({self.as_dict()})"
+
+
+# Все различные профили процесса. Поля выбираются из коротких списков
+# регистрации, поэтому их единицы сотен при любом числе пользователей
+_shared = {}
+_strings = {}
+
+
+def make_profile(fields) -> Profile:
+    """Общий объект профиля для словаря полей (или None)"""
+    if fields is None:
+        return None
+    return _shared_profile(*map(fields.get, FIELDS))
+
+
+def _shared_profile(*values) -> Profile:
+    # Строки из базы каждый раз новые, а в общем профиле - одни и те же
+    key = tuple(None if value is None else _strings.setdefault(value, value) for value in values)
+    profile = _shared.get(key)
+    if profile is None:
+        profile = _shared[key] = Profile(*key)
+    return profile
+
+
+class ProfileTable:
+    """
+    Профили по user_id: значение - общий объект Profile, поэтому на
+    пользователя приходится только запись словаря и user_id (~75 байт
+    вместо ~260 для отдельного словаря строк). С max_size - кэш LRU, в котором можно
+    хранить и None (пользователь не зарегистрирован)
+    """
+
+    def __init__(self, max_size: int = None):
+        self.max_size = max_size
+        self._profiles = OrderedDict() if max_size else {}
+
+    def __len__(self) -> int:
+        return len(self._profiles)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._profiles
+
+    def __iter__(self):
+        return iter(self._profiles)
+
+    def get(self, user_id: int) -> Profile:
+        if self.max_size and user_id in self._profiles:
+            self._profiles.move_to_end(user_id)
+        return self._profiles.get(user_id)
+
+    def put(self, user_id: int, fields) -> Profile:
+        profile = self._profiles[user_id] = make_profile(fields)
+        if self.max_size:
+            self._profiles.move_to_end(user_id)
+            while len(self._profiles) > self.max_size:
+                self._profiles.popitem(last=False)
+        return profile
+
+    def load(self, rows) -> int:
+        """Массовая загрузка строк (user_id, gender, country, age), например из базы. Возвращает число строк"""
+        profiles = self._profiles
+        count = 0
+        for user_id, *values in rows:
+            profiles[user_id] = _shared_profile(*values)
+            count += 1
+        if self.max_size:
+            while len(profiles) > self.max_size:
+                profiles.popitem(last=False)
+        return count
+
+    def rows(self):
+        """Строки (user_id, gender, country, age) для массового сохранения"""
+        for user_id, profile in self._profiles.items():
+            if profile is not None:
+                yield (user_id, profile.gender, profile.country, profile.age)
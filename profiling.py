@@ -0,0 +1,202 @@
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+import metrics
+
+MODES = ('sample', 'cprofile')
+
+# Код обертки metrics.timed: кадр под ним в стеке - обработчик PTB
+_TIMED_CODE = metrics.timed(lambda update, context: None).__code__
+# Функции, в которых цикл событий ждет ввода-вывода
+_IDLE_FUNCTIONS = {'select', 'poll', 'epoll', 'kqueue', 'control'}
+
+
+class _Sampler(threading.Thread):
+    """
+    Раз в interval секунд снимает стек потока цикла событий.
+    Стеки копятся в формате collapsed (кадры через ';'), а выборки
+    внутри обработчиков PTB дополнительно считаются по их именам
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.handlers = Counter()
+        self.samples = 0
+        self.idle = 0
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            if frame.f_code.co_name in _IDLE_FUNCTIONS:
+                self.idle += 1
+            stack = []
+            inner = None
+            while frame is not None:
+                code = frame.f_code
+                if code is _TIMED_CODE and inner is not None:
+                    self.handlers[inner] += 1
+                inner = code.co_name
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+class _SlowCallbacks:
+    """
+    Замер каждого шага цикла событий, как в режиме отладки asyncio, но без
+    него: отладочный режим на каждом call_soon сохраняет стек вызова, и на
+    нагруженном боте это само становится главной статьей расходов.
+    Handle._run подменяется только на время сессии
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.records = []
+        self._original = None
+
+    def install(self) -> None:
+        original = self._original = asyncio.events.Handle._run
+        threshold, records = self.threshold, self.records
+
+        def run(handle):
+            start = time.perf_counter()
+            original(handle)
+            took = time.perf_counter() - start
+            if took >= threshold:
+                records.append(f"{took * 1000:.0f} мс: {_describe(handle)}")
+
+        asyncio.events.Handle._run = run
+
+    def uninstall(self) -> None:
+        asyncio.events.Handle._run = self._original
+
+
+def _describe(handle) -> str:
+    """Для шага задачи - имя корутины и место, где она остановилась после шага"""
+    task = getattr(handle._callback, '__self__', None)
+    if not isinstance(task, asyncio.Task):
+        return repr(handle)
+    coro = task.get_coro()
+    where = coro
+    while getattr(getattr(where, 'cr_await', None), 'cr_frame', None) is not None:
+        where = where.cr_await
+    frame = getattr(where, 'cr_frame', None)
+    location = f" ({Path(frame.f_code.co_filename).name}:{frame.f_lineno})" if frame else ''
+    return f"задача {task.get_name()}: {getattr(coro, '__qualname__', coro)}{location}"
+
+
+class ProfileSession:
+    """
+    Профилирование работающего цикла событий в течение duration секунд.
+
+    mode='sample' - поток-сэмплер снимает стек цикла каждые sample_interval
+    секунд (почти без влияния на бота), результат - collapsed stacks для
+    flamegraph.pl или speedscope. mode='cprofile' - cProfile по всем
+    функциям цикла, результат - файл pstats; точнее, но заметно замедляет
+    бота на время сессии.
+
+    В обоих режимах замеряется каждый шаг цикла событий и шаги дольше
+    slow_callback секунд попадают в отчет, а время обработчиков и запросов
+    к Bot API берется из разницы гистограмм метрик.
+    Пока сессия не запущена, ничего из этого не подключено.
+    Файлы пишутся в log_dir, итог - текстовый отчет там же.
+    """
+
+    def __init__(self, log_dir: str, mode: str = 'sample', duration: float = 30.0,
+                 sample_interval: float = 0.005, slow_callback: float = 0.1):
+        if mode not in MODES:
+            raise ValueError(f"Неизвестный режим профилирования: {mode}")
+        self.log_dir = Path(log_dir)
+        self.mode = mode
+        self.duration = duration
+        self.sample_interval = sample_interval
+        self.slow_callback = slow_callback
+        name = f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.path = self.log_dir / name
+
+    async def run(self) -> str:
+        """Профилирует duration секунд (отмена завершает сессию раньше) и возвращает краткий отчет"""
+        handlers_before = metrics.handler_latency.totals()
+        api_before = metrics.api_latency.totals()
+        slow = _SlowCallbacks(self.slow_callback)
+        sampler = profiler = None
+
+        if self.mode == 'sample':
+            sampler = _Sampler(threading.get_ident(), self.sample_interval)
+            sampler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        slow.install()
+        start = time.perf_counter()
+        try:
+            await asyncio.sleep(self.duration)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            elapsed = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+            if sampler is not None:
+                sampler.stop()
+            slow.uninstall()
+
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        lines = [f"Профиль {self.path.name}: режим {self.mode}, {elapsed:.1f} с"]
+        if sampler is not None:
+            data = self.path.with_suffix('.collapsed')
+            data.write_text(''.join(f"{stack} {n}\n" for stack, n in sampler.stacks.most_common()))
+            busy = 1 - sampler.idle / sampler.samples if sampler.samples else 0.0
+            lines.append(f"Выборок {sampler.samples}, цикл занят {busy:.0%}; стеки: {data}")
+            if sampler.handlers:
+                lines.append("Выборки в обработчиках:")
+                lines += [f"  {name}: {n} ({n / sampler.samples:.1%})" for name, n in sampler.handlers.most_common()]
+        else:
+            data = self.path.with_suffix('.pstats')
+            profiler.dump_stats(data)
+            lines.append(f"Статистика: {data} (python -m pstats)")
+        lines.append("Обработчики за сессию (вызовов, всего с, в среднем мс):")
+        lines += _histogram_delta(handlers_before, metrics.handler_latency.totals())
+        lines.append("Запросы к Bot API за сессию:")
+        lines += _histogram_delta(api_before, metrics.api_latency.totals())
+        lines.append(f"Шагов цикла дольше {self.slow_callback * 1000:.0f} мс: {len(slow.records)}")
+        summary = '\n'.join(lines)
+
+        report = io.StringIO()
+        report.write(summary + '\n')
+        if slow.records:
+            report.write('\nДолгие шаги цикла:\n' + '\n'.join(slow.records) + '\n')
+        if profiler is not None:
+            report.write('\n')
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(40)
+        self.path.with_suffix('.txt').write_text(report.getvalue())
+        return summary
+
+
+def _histogram_delta(before: dict, after: dict) -> list:
+    rows = []
+    for labels, (count, total) in after.items():
+        count_before, total_before = before.get(labels, (0, 0.0))
+        count, total = count - count_before, total - total_before
+        if count:
+            rows.append((total, f"  {','.join(labels)}: {count}, {total:.2f} с, {total / count * 1000:.1f} мс"))
+    return [row for _, row in sorted(rows, reverse=True)]
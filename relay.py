@@ -0,0 +1,145 @@
+from telegram import (
+    InputMediaAnimation,
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo,
+    Message,
+    MessageEntity
+)
+
+# Типы, у которых есть подпись: префикс режима отладки вписывается в нее при копировании
+CAPTIONED_TYPES = ('photo', 'video', 'document', 'audio', 'voice', 'animation')
+
+
+def takes_prefix(message: Message) -> bool:
+    """Есть ли в копии сообщения место для префикса: текст или подпись"""
+    return bool(message.text) or any(getattr(message, kind) for kind in CAPTIONED_TYPES)
+
+
+def plan_relay(chat_id: int, message: Message, prefix: str = None, reply_to_message_id: int = None) -> tuple:
+    """
+    Выбирает один вызов Bot API для пересылки сообщения: (метод, параметры).
+
+    По умолчанию - copy_message: он переносит любой копируемый тип (текст,
+    медиа, стикеры, опросы, геопозиции, контакты...) вместе с entities и
+    подписью. Отдельная отправка нужна только когда в текст надо вставить
+    префикс: тогда entities сдвигаются на длину префикса в UTF-16.
+    """
+    params = {'chat_id': chat_id, 'reply_to_message_id': reply_to_message_id}
+
+    if prefix and message.text:
+        head = f"{prefix}: "
+        params.update(
+            text=head + message.text,
+            entities=MessageEntity.shift_entities(head, message.entities) or None)
+        return 'send_message', params
+
+    params.update(from_chat_id=message.chat_id, message_id=message.message_id)
+    if prefix and takes_prefix(message):
+        if message.caption:
+            head = f"{prefix}: "
+            params.update(
+                caption=head + message.caption,
+                caption_entities=MessageEntity.shift_entities(head, message.caption_entities) or None)
+        else:
+            params['caption'] = prefix
+    # Стикеры, кружки и прочее без подписи копируются как есть - бот и так их отправитель.
+    # Комнаты отправляют префикс перед ними отдельным сообщением
+    return 'copy_message', params
+
+
+async def relay_message(call, chat_id: int, message: Message, prefix: str = None, reply_to_message_id: int = None) -> int:
+    """
+    Пересылает сообщение одним вызовом. call(method, **params) выполняет запрос
+    (обычно через планировщик отправки). Возвращает ID нового сообщения
+    """
+    method, params = plan_relay(chat_id, message, prefix, reply_to_message_id)
+    result = await call(method, **params)
+    return result.message_id if result else None
+
+
+def _input_media(message: Message, caption: str, caption_entities):
+    """Медиа сообщения как InputMedia* (для альбомов и edit_message_media) или None"""
+    params = {'caption': caption, 'caption_entities': caption_entities}
+    if message.photo:
+        return InputMediaPhoto(message.photo[-1].file_id, has_spoiler=message.has_media_spoiler, **params)
+    if message.video:
+        return InputMediaVideo(message.video.file_id, has_spoiler=message.has_media_spoiler, **params)
+    if message.animation:
+        return InputMediaAnimation(message.animation.file_id, has_spoiler=message.has_media_spoiler, **params)
+    if message.document:
+        return InputMediaDocument(message.document.file_id, **params)
+    if message.audio:
+        return InputMediaAudio(message.audio.file_id, **params)
+    return None
+
+
+def _album_item(message: Message, caption: str, caption_entities):
+    media = None if message.animation else _input_media(message, caption, caption_entities)
+    if media is None:
+        raise ValueError(f"Сообщение {message.message_id} не может быть частью альбома")
+    return media
+
+
+def _prefixed_caption(message: Message, prefix: str = None) -> tuple:
+    caption, entities = message.caption, message.caption_entities or None
+    if prefix and caption:
+        head = f"{prefix}: "
+        caption, entities = head + caption, MessageEntity.shift_entities(head, message.caption_entities) or None
+    elif prefix:
+        caption = prefix
+    return caption, entities
+
+
+def plan_album(chat_id: int, messages: list, prefix: str = None, reply_to_message_id: int = None) -> tuple:
+    """Один вызов send_media_group для всех частей альбома с их подписями"""
+    media = []
+    for i, message in enumerate(messages):
+        caption, entities = message.caption, message.caption_entities or None
+        if prefix and caption:
+            head = f"{prefix}: "
+            caption, entities = head + caption, MessageEntity.shift_entities(head, entities or ()) or None
+        elif prefix and i == 0 and not any(m.caption for m in messages):
+            caption = prefix
+        media.append(_album_item(message, caption, entities))
+    return 'send_media_group', {'chat_id': chat_id, 'media': media, 'reply_to_message_id': reply_to_message_id}
+
+
+def plan_edit(chat_id: int, message_id: int, message: Message, prefix: str = None) -> tuple:
+    """
+    Один вызов Bot API, который приводит копию message_id к правке message: (метод, параметры).
+
+    Текст меняется через edit_message_text, медиа - через edit_message_media
+    (заменяет и файл, и подпись, копия остается на месте вместе с reply).
+    У голосовых меняется только подпись. Для остальных типов правку не
+    перенести - возвращается None
+    """
+    params = {'chat_id': chat_id, 'message_id': message_id}
+
+    if message.text:
+        head = f"{prefix}: " if prefix else ''
+        params.update(
+            text=head + message.text,
+            entities=MessageEntity.shift_entities(head, message.entities) or None)
+        return 'edit_message_text', params
+
+    caption, entities = _prefixed_caption(message, prefix)
+    media = _input_media(message, caption, entities)
+    if media is not None:
+        params['media'] = media
+        return 'edit_message_media', params
+    if message.voice:
+        params.update(caption=caption, caption_entities=entities)
+        return 'edit_message_caption', params
+    return None
+
+
+async def relay_album(call, chat_id: int, messages: list, prefix: str = None, reply_to_message_id: int = None) -> list:
+    """
+    Пересылает части альбома одним вызовом.
+    Возвращает ID новых сообщений в том же порядке, что и messages
+    """
+    method, params = plan_album(chat_id, messages, prefix, reply_to_message_id)
+    sent = await call(method, **params)
+    return [m.message_id for m in sent] if sent else []
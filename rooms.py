@@ -0,0 +1,138 @@
+from message_map import MessageMap
+
+
+class Member:
+    """
+    Участник комнаты. Номер - анонимная подпись его сообщений ("👤 7").
+    Соответствие сообщений - в обе стороны между ID в чате участника с
+    ботом и сквозным номером сообщения комнаты (seq)
+    """
+    __slots__ = ('number', 'to_seq', 'from_seq')
+
+    def __init__(self, number: int, history: int):
+        self.number = number
+        self.to_seq = MessageMap(history)
+        self.from_seq = MessageMap(history)
+
+    def map(self, message_id: int, seq: int) -> None:
+        self.to_seq.put(message_id, seq)
+        self.from_seq.put(seq, message_id)
+
+
+class Room:
+    __slots__ = ('room_id', 'title', 'members', 'seq', 'numbers')
+
+    def __init__(self, room_id: int, title: str):
+        self.room_id = room_id
+        self.title = title
+        # user_id -> Member в порядке входа
+        self.members = {}
+        self.seq = 0
+        self.numbers = 0
+
+
+class RoomDirectory:
+    """
+    Анонимные комнаты: состав и соответствие сообщений участников.
+
+    Пользователь может быть только в одной комнате. Вход, выход и поиск
+    комнаты пользователя - O(1). Сообщение получает сквозной номер комнаты,
+    а каждая копия - запись в соответствии своего получателя, поэтому ответ
+    (reply) и правка находят копию у каждого участника без обхода истории.
+    Помнятся последние history сообщений на участника.
+
+    Живет только в памяти: после перезапуска комнаты пустые
+    """
+
+    def __init__(self, titles: tuple, capacity: int = 1000, history: int = 1000):
+        self.capacity = capacity
+        self.history = history
+        self.rooms = {room_id: Room(room_id, title) for room_id, title in enumerate(titles, 1)}
+        self._where = {}
+
+    def list_rooms(self) -> list:
+        """[(room_id, название, участников), ...]"""
+        return [(room.room_id, room.title, len(room.members)) for room in self.rooms.values()]
+
+    def room_of(self, user_id: int) -> int:
+        return self._where.get(user_id)
+
+    def count_members(self) -> int:
+        return len(self._where)
+
+    def join(self, user_id: int, room_id: int) -> tuple:
+        """
+        Переводит пользователя в комнату (из прежней он выходит).
+        Возвращает (название, участников) или None, если комнаты нет или она заполнена
+        """
+        room = self.rooms.get(room_id)
+        if room is None:
+            return None
+        if user_id not in room.members:
+            if len(room.members) >= self.capacity:
+                return None
+            self.leave(user_id)
+            room.numbers += 1
+            room.members[user_id] = Member(room.numbers, self.history)
+            self._where[user_id] = room_id
+        return room.title, len(room.members)
+
+    def leave(self, user_id: int) -> str:
+        """Убирает пользователя из его комнаты. Возвращает ее название или None"""
+        room_id = self._where.pop(user_id, None)
+        if room_id is None:
+            return None
+        room = self.rooms[room_id]
+        del room.members[user_id]
+        return room.title
+
+    def post(self, user_id: int, message_ids: list, reply_to: int = None) -> tuple:
+        """
+        Регистрирует сообщение (или части альбома) участника. Возвращает
+        (room_id, номер автора, номера сообщений, получатели) или None, если
+        пользователь не в комнате. Получатели - [(user_id, ID для reply или None)]
+        """
+        room_id = self._where.get(user_id)
+        if room_id is None:
+            return None
+        room = self.rooms[room_id]
+        author = room.members[user_id]
+        seqs = list(range(room.seq + 1, room.seq + 1 + len(message_ids)))
+        room.seq += len(message_ids)
+        for message_id, seq in zip(message_ids, seqs):
+            author.map(message_id, seq)
+
+        reply_seq = author.to_seq.get(reply_to) if reply_to is not None else None
+        if reply_seq is None:
+            targets = [(member_id, None) for member_id in room.members if member_id != user_id]
+        else:
+            targets = [(member_id, member.from_seq.get(reply_seq))
+                       for member_id, member in room.members.items() if member_id != user_id]
+        return room_id, author.number, seqs, targets
+
+    def record(self, room_id: int, user_id: int, seqs: list, message_ids: list) -> None:
+        """Запоминает копии сообщений seqs у получателя (если он еще в комнате)"""
+        member = self.rooms[room_id].members.get(user_id)
+        if member is not None:
+            for seq, message_id in zip(seqs, message_ids):
+                member.map(message_id, seq)
+
+    def copies(self, user_id: int, message_id: int) -> tuple:
+        """
+        Копии сообщения участника у остальных для переноса правки:
+        (номер автора, [(user_id, ID копии), ...]) или None
+        """
+        room_id = self._where.get(user_id)
+        if room_id is None:
+            return None
+        room = self.rooms[room_id]
+        author = room.members[user_id]
+        seq = author.to_seq.get(message_id)
+        if seq is None:
+            return None
+        copies = []
+        for member_id, member in room.members.items():
+            copy_id = member.from_seq.get(seq)
+            if member_id != user_id and copy_id is not None:
+                copies.append((member_id, copy_id))
+        return author.number, copies
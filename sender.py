@@ -0,0 +1,330 @@
+import asyncio
+import heapq
+import logging
+import random
+import time
+from collections import deque
+from itertools import count
+
+import httpx
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+# Классы приоритета: чем меньше, тем раньше уходит
+RELAY = 0    # пересылка сообщений между собеседниками
+NOTICE = 1   # системные уведомления и ответы на команды
+BULK = 2     # массовые рассылки
+
+# Ошибки, при которых запрос гарантированно не дошел до Telegram
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# Методы, повтор которых не создаст дубликат у получателя
+_IDEMPOTENT_PREFIXES = ('edit_', 'delete_', 'get_', 'answer_', 'set_')
+
+
+class SendDropped(Exception):
+    """Запрос не был выполнен: очередь переполнена или исчерпаны повторы"""
+
+
+def is_dead_chat(error: Exception) -> bool:
+    """
+    Постоянная ошибка чата: пользователь заблокировал бота, удалил аккаунт
+    или чата больше нет. Любой следующий запрос в этот чат тоже не пройдет.
+    Временные ошибки (сеть, 429) планировщик повторяет сам
+    """
+    if isinstance(error, Forbidden):
+        return True
+    if isinstance(error, BadRequest):
+        text = str(error).lower()
+        return 'chat not found' in text or 'peer_id_invalid' in text
+    return False
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько ждать до появления токена (0 - можно сейчас)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def full_at(self, now: float) -> float:
+        self._refill(now)
+        return now + (self.capacity - self.tokens) / self.rate
+
+
+class _Job:
+    __slots__ = ('priority', 'seq', 'bot', 'method', 'kwargs', 'future', 'attempts')
+
+    def __init__(self, priority, seq, bot, method, kwargs, future):
+        self.priority = priority
+        self.seq = seq
+        self.bot = bot
+        self.method = method
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+
+
+class _Chat:
+    __slots__ = ('chat_id', 'jobs', 'bucket', 'busy', 'not_before', 'generation')
+
+    def __init__(self, chat_id, bucket):
+        self.chat_id = chat_id
+        self.jobs = deque()
+        self.bucket = bucket
+        # В чате одновременно выполняется не больше одного запроса: так сохраняется порядок
+        self.busy = False
+        # Пауза после 429 или сетевой ошибки
+        self.not_before = 0.0
+        # Номер актуальной записи чата в кучах планировщика, старые записи игнорируются
+        self.generation = 0
+
+
+class SendScheduler:
+    """
+    Планировщик исходящих запросов к Bot API.
+
+    Запросы ставятся в очередь своего чата (FIFO, один запрос в полете на
+    чат) и выпускаются с учетом лимитов Telegram: глобальный token bucket
+    на бота и отдельный на каждый чат. Среди готовых чатов первым идет тот,
+    у кого в голове очереди запрос с более высоким приоритетом, поэтому
+    пересылка сообщений обгоняет уведомления и рассылки.
+
+    При 429 чат ставится на паузу ровно на retry_after, при сетевых ошибках
+    запрос повторяется с экспоненциальной задержкой. Повтор отправки
+    делается только если запрос точно не дошел до Telegram или метод
+    идемпотентен, иначе собеседник мог бы получить дубликат.
+    """
+
+    def __init__(self, global_rate: float = 28.0, global_burst: float = 30.0,
+                 chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 max_retries: int = 5, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 max_queue: int = 50_000, max_in_flight: int = 100):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_queue = max_queue
+        self.max_in_flight = max_in_flight
+
+        self._global = TokenBucket(global_rate, global_burst, time.monotonic())
+        self._chats = {}
+        self._ready = []     # (приоритет, seq, поколение, chat_id)
+        self._delayed = []   # (время готовности, поколение, chat_id)
+        self._seq = count()
+        self._queued = 0
+        self._in_flight = 0
+        self._wakeup = asyncio.Event()
+        self._runner = None
+
+        self.counters = {
+            'sent': 0,
+            'retried': 0,
+            'rate_limited': 0,
+            'failed': 0,
+            'dropped_overflow': 0,
+            'dropped_retries': 0,
+            'dropped_uncertain': 0,
+            'dropped_dead': 0,
+            'cancelled': 0,
+        }
+        self.queued_by_priority = {RELAY: 0, NOTICE: 0, BULK: 0}
+
+    def stats(self) -> dict:
+        """Глубина очередей и счетчики для мониторинга"""
+        return {
+            'queued': self._queued,
+            'in_flight': self._in_flight,
+            'chats': len(self._chats),
+            'queued_by_priority': dict(self.queued_by_priority),
+            **self.counters,
+        }
+
+    async def call(self, bot, method: str, priority: int = NOTICE, **kwargs):
+        """
+        Ставит вызов bot.<method>(**kwargs) в очередь и ждет результата.
+        Ошибки Telegram пробрасываются вызывающему, потеря запроса - SendDropped
+        """
+        return await self.submit(bot, method, priority, **kwargs)
+
+    def submit(self, bot, method: str, priority: int = NOTICE, **kwargs) -> asyncio.Future:
+        """
+        Ставит вызов в очередь сразу, без ожидания, и возвращает future с результатом.
+        Вызовы в один чат выполняются в порядке постановки, поэтому несколько
+        submit подряд не разделит запрос другой задачи
+        """
+        if self._queued >= self.max_queue:
+            self.counters['dropped_overflow'] += 1
+            raise SendDropped(f"очередь отправки переполнена ({self._queued})")
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+
+        chat_id = kwargs.get('chat_id')
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(
+                chat_id, TokenBucket(self.chat_rate, self.chat_burst, time.monotonic()))
+
+        job = _Job(priority, next(self._seq), bot, method, kwargs, asyncio.get_running_loop().create_future())
+        chat.jobs.append(job)
+        self._queued += 1
+        self.queued_by_priority[priority] += 1
+        self._schedule(chat, time.monotonic())
+        self._wakeup.set()
+        return job.future
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+        for chat in self._chats.values():
+            for job in chat.jobs:
+                if not job.future.done():
+                    job.future.set_exception(SendDropped("планировщик остановлен"))
+        self._chats.clear()
+
+    def _schedule(self, chat: _Chat, now: float) -> None:
+        """Ставит чат в очередь готовых или отложенных с учетом лимитов"""
+        if chat.busy:
+            return
+        chat.generation += 1
+        if not chat.jobs:
+            # Пустой чат удаляем, когда его bucket восстановится, иначе сбросили бы лимит
+            heapq.heappush(self._delayed, (chat.bucket.full_at(now), chat.generation, chat.chat_id))
+            return
+        ready_at = max(chat.not_before, now + chat.bucket.wait_time(now))
+        if ready_at <= now:
+            head = chat.jobs[0]
+            heapq.heappush(self._ready, (head.priority, head.seq, chat.generation, chat.chat_id))
+        else:
+            heapq.heappush(self._delayed, (ready_at, chat.generation, chat.chat_id))
+
+    def _promote(self, now: float) -> None:
+        while self._delayed and self._delayed[0][0] <= now:
+            _, generation, chat_id = heapq.heappop(self._delayed)
+            chat = self._chats.get(chat_id)
+            if chat is None or chat.generation != generation:
+                continue
+            if not chat.jobs and not chat.busy:
+                del self._chats[chat_id]
+            else:
+                self._schedule(chat, now)
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            self._promote(now)
+            timeout = self._delayed[0][0] - now if self._delayed else None
+
+            if self._ready and self._in_flight < self.max_in_flight:
+                wait = self._global.wait_time(now)
+                if wait <= 0:
+                    _, _, generation, chat_id = heapq.heappop(self._ready)
+                    chat = self._chats.get(chat_id)
+                    if chat is not None and chat.generation == generation and chat.jobs and not chat.busy:
+                        self._drop_cancelled(chat)
+                        if chat.jobs:
+                            self._global.take(now)
+                            self._dispatch(chat, now)
+                        else:
+                            self._schedule(chat, now)
+                    continue
+                timeout = wait if timeout is None else min(timeout, wait)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self, chat: _Chat, now: float) -> None:
+        chat.busy = True
+        chat.generation += 1
+        chat.bucket.take(now)
+        self._in_flight += 1
+        asyncio.create_task(self._execute(chat, chat.jobs[0]))
+
+    def _finish(self, chat: _Chat, job: _Job, result=None, error: Exception = None) -> None:
+        chat.jobs.popleft()
+        self._queued -= 1
+        self.queued_by_priority[job.priority] -= 1
+        # Вызывающий мог уже отменить ожидание
+        if job.future.done():
+            return
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+
+    async def _execute(self, chat: _Chat, job: _Job) -> None:
+        job.attempts += 1
+        try:
+            result = await getattr(job.bot, job.method)(**job.kwargs)
+        except RetryAfter as e:
+            self.counters['rate_limited'] += 1
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+            logging.warning(f"429 для чата {chat.chat_id}: пауза {retry_after} с")
+            self._retry_or_drop(chat, job, retry_after, e)
+        except BadRequest as e:
+            # Наследник NetworkError, но повтор того же запроса ничего не изменит
+            self.counters['failed'] += 1
+            self._finish(chat, job, error=e)
+            if is_dead_chat(e):
+                self._fail_chat(chat, e)
+        except NetworkError as e:
+            not_sent = isinstance(e.__cause__, _NOT_SENT_ERRORS)
+            if not_sent or job.method.startswith(_IDEMPOTENT_PREFIXES):
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (job.attempts - 1))
+                self._retry_or_drop(chat, job, delay * random.uniform(0.8, 1.2), e)
+            else:
+                # Запрос мог дойти: повтор рискует задвоить сообщение
+                self.counters['dropped_uncertain'] += 1
+                self._finish(chat, job, error=SendDropped(f"{job.method}: результат неизвестен ({e})"))
+        except Exception as e:
+            self.counters['failed'] += 1
+            self._finish(chat, job, error=e)
+            if is_dead_chat(e):
+                self._fail_chat(chat, e)
+        else:
+            self.counters['sent'] += 1
+            self._finish(chat, job, result)
+        finally:
+            self._in_flight -= 1
+            chat.busy = False
+            self._schedule(chat, time.monotonic())
+            self._wakeup.set()
+
+    def _drop_cancelled(self, chat: _Chat) -> None:
+        """Вызывающий отменил ожидание до отправки: такой запрос уже никому не нужен"""
+        while chat.jobs and chat.jobs[0].future.cancelled():
+            self.counters['cancelled'] += 1
+            self._finish(chat, chat.jobs[0])
+
+    def _fail_chat(self, chat: _Chat, error: Exception) -> None:
+        """Чат недоступен навсегда: остальные запросы в него завершаются той же ошибкой без отправки"""
+        while chat.jobs:
+            self.counters['dropped_dead'] += 1
+            self._finish(chat, chat.jobs[0], error=error)
+
+    def _retry_or_drop(self, chat: _Chat, job: _Job, delay: float, error: Exception) -> None:
+        if job.attempts > self.max_retries:
+            self.counters['dropped_retries'] += 1
+            self._finish(chat, job, error=SendDropped(f"{job.method}: исчерпаны повторы ({error})"))
+            return
+        self.counters['retried'] += 1
+        chat.not_before = time.monotonic() + delay
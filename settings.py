@@ -0,0 +1,200 @@
+"""
+Настройки бота со значениями по умолчанию.
+
+Любую настройку можно переопределить одноименной переменной в config.py
+"""
+import config
+
+
+def _get(name, default):
+    return getattr(config, name, default)
+
+
+# Хранилище состояния: 'memory' (все теряется при перезапуске) или 'sqlite'
+STORAGE_BACKEND = _get('STORAGE_BACKEND', 'sqlite')
+SQLITE_PATH = _get('SQLITE_PATH', 'data/bot.sqlite3')
+# Как часто фоновый поток сбрасывает накопленные изменения на диск (секунды)
+SQLITE_FLUSH_INTERVAL = _get('SQLITE_FLUSH_INTERVAL', 0.5)
+# Максимум изменений в одной транзакции
+SQLITE_BATCH_SIZE = _get('SQLITE_BATCH_SIZE', 1000)
+# Сколько профилей пользователей держать в памяти (~120 байт на профиль)
+USER_CACHE_SIZE = _get('USER_CACHE_SIZE', 500_000)
+
+# Окно соответствия сообщений для reply/редактирования: сколько последних
+# сообщений помнить на пользователя и сколько секунд (None - без ограничения)
+MESSAGE_MAP_WINDOW = _get('MESSAGE_MAP_WINDOW', 10_000)
+MESSAGE_MAP_TTL = _get('MESSAGE_MAP_TTL', 48 * 3600)
+
+# Способ получения обновлений: 'polling' или 'webhook'
+SERVE_MODE = _get('SERVE_MODE', 'polling')
+# Локальный адрес HTTP сервера вебхука (обычно за reverse proxy с TLS)
+WEBHOOK_LISTEN = _get('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = _get('WEBHOOK_PORT', 8443)
+WEBHOOK_PATH = _get('WEBHOOK_PATH', '/telegram')
+# Публичный URL для setWebhook. Если не задан, регистрация при запуске
+# пропускается: вебхук уже настроен вместе с reverse proxy
+WEBHOOK_URL = _get('WEBHOOK_URL', None)
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token, обязателен в режиме вебхука
+WEBHOOK_SECRET = _get('WEBHOOK_SECRET', None)
+WEBHOOK_MAX_CONNECTIONS = _get('WEBHOOK_MAX_CONNECTIONS', 40)
+
+# Лимиты исходящих запросов (Telegram: ~30 сообщений/с на бота, ~1/с в один чат)
+SEND_GLOBAL_RATE = _get('SEND_GLOBAL_RATE', 28.0)
+SEND_GLOBAL_BURST = _get('SEND_GLOBAL_BURST', 30.0)
+SEND_CHAT_RATE = _get('SEND_CHAT_RATE', 1.0)
+SEND_CHAT_BURST = _get('SEND_CHAT_BURST', 3.0)
+SEND_MAX_RETRIES = _get('SEND_MAX_RETRIES', 5)
+# Сверх этого числа запросов в очереди новые отбрасываются со счетчиком
+SEND_MAX_QUEUE = _get('SEND_MAX_QUEUE', 50_000)
+
+# Транспорт Bot API: получение обновлений, отправка и загрузка медиа идут
+# через отдельные пулы соединений
+HTTP_POOL_SIZE = _get('HTTP_POOL_SIZE', 128)
+HTTP_MEDIA_POOL_SIZE = _get('HTTP_MEDIA_POOL_SIZE', 16)
+HTTP_UPDATES_POOL_SIZE = _get('HTTP_UPDATES_POOL_SIZE', 1)
+# Пул собирается из клиентов httpx по столько соединений: httpcore перебирает
+# все соединения клиента на каждый запрос, и один большой клиент дорог по процессору
+HTTP_POOL_STRIPE = _get('HTTP_POOL_STRIPE', 8)
+# Сколько простаивающих соединений пула держать открытыми (None - все) и как долго (секунды)
+HTTP_KEEPALIVE = _get('HTTP_KEEPALIVE', None)
+HTTP_KEEPALIVE_EXPIRY = _get('HTTP_KEEPALIVE_EXPIRY', 30.0)
+# '1.1' или '2' (для HTTP/2 нужен пакет h2: pip install "python-telegram-bot[http2]")
+HTTP_VERSION = _get('HTTP_VERSION', '1.1')
+# Таймауты запросов (секунды). HTTP_POOL_TIMEOUT - ожидание свободного соединения
+HTTP_CONNECT_TIMEOUT = _get('HTTP_CONNECT_TIMEOUT', 5.0)
+HTTP_READ_TIMEOUT = _get('HTTP_READ_TIMEOUT', 5.0)
+HTTP_WRITE_TIMEOUT = _get('HTTP_WRITE_TIMEOUT', 5.0)
+HTTP_POOL_TIMEOUT = _get('HTTP_POOL_TIMEOUT', 1.0)
+# Загрузки медиа долгие, поэтому их очередь к пулу ждет дольше
+HTTP_MEDIA_POOL_TIMEOUT = _get('HTTP_MEDIA_POOL_TIMEOUT', 30.0)
+# Таймауты чтения и записи отдельных методов Bot API, перекрывают общие
+HTTP_METHOD_TIMEOUTS = _get('HTTP_METHOD_TIMEOUTS', {
+    'sendMessage': 5.0,
+    'copyMessage': 5.0,
+    'editMessageText': 5.0,
+    'sendMediaGroup': 60.0,
+    'editMessageMedia': 30.0,
+    'sendVideo': 60.0,
+    'sendDocument': 60.0,
+})
+
+# Входящий лимит сообщений на пользователя: FLOOD_RATE в секунду и до
+# FLOOD_BURST подряд (альбом - одно сообщение). 0 или None отключает лимит
+FLOOD_RATE = _get('FLOOD_RATE', 1.0)
+FLOOD_BURST = _get('FLOOD_BURST', 10)
+# Молчание за превышение (секунды): удваивается за каждое повторное в течение
+# FLOOD_FORGIVE секунд, но не больше FLOOD_MUTE_MAX
+FLOOD_MUTE = _get('FLOOD_MUTE', 10.0)
+FLOOD_MUTE_MAX = _get('FLOOD_MUTE_MAX', 600.0)
+FLOOD_FORGIVE = _get('FLOOD_FORGIVE', 600.0)
+# Предел числа пользователей в памяти лимита (обычно там только недавно писавшие)
+FLOOD_MAX_USERS = _get('FLOOD_MAX_USERS', 1_000_000)
+
+# Сколько ждать следующую часть альбома перед отправкой (секунды)
+ALBUM_WINDOW = _get('ALBUM_WINDOW', 0.5)
+# Правки одного сообщения за это время схлопываются в одну (секунды, 0 - пересылать каждую)
+EDIT_WINDOW = _get('EDIT_WINDOW', 0.3)
+
+# Логи: один файл logs/bot.log с ротацией по размеру или по времени
+LOG_DIR = _get('LOG_DIR', 'logs')
+LOG_LEVEL = _get('LOG_LEVEL', 'DEBUG')
+LOG_ROTATE_BYTES = _get('LOG_ROTATE_BYTES', 50 * 1024 * 1024)
+# Если задано ('midnight', 'H' и т.п.), ротация по времени вместо размера
+LOG_ROTATE_WHEN = _get('LOG_ROTATE_WHEN', None)
+LOG_BACKUP_COUNT = _get('LOG_BACKUP_COUNT', 10)
+# 'text' или 'json' (одна компактная строка JSON на запись)
+LOG_FORMAT = _get('LOG_FORMAT', 'text')
+# Сколько записей может ждать записи в файл, сверх этого они отбрасываются
+LOG_QUEUE_SIZE = _get('LOG_QUEUE_SIZE', 100_000)
+# Уровни библиотечных логгеров
+LOG_LIBRARY_LEVELS = _get('LOG_LIBRARY_LEVELS', {
+    'httpx': 'WARNING',
+    'httpcore': 'WARNING',
+    'telegram': 'INFO',
+    'asyncio': 'WARNING',
+})
+# Доля сохраняемых DEBUG/INFO записей по префиксу имени логгера
+LOG_SAMPLING = _get('LOG_SAMPLING', {
+    'httpx': 0.1,
+    'telegram.ext.Updater': 0.1,
+})
+
+# Страница метрик Prometheus (/metrics). METRICS_PORT = None отключает ее
+METRICS_LISTEN = _get('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = _get('METRICS_PORT', 9090)
+
+# Адрес сервера Bot API. None - api.telegram.org; иначе, например,
+# 'http://127.0.0.1:8081' для своего telegram-bot-api или локальной заглушки
+BOT_API_BASE_URL = _get('BOT_API_BASE_URL', None)
+
+# Сколько обновлений обрабатывается одновременно (1 - строго по одному).
+# Внутри одного диалога порядок сохраняется в любом случае
+CONCURRENT_UPDATES = _get('CONCURRENT_UPDATES', 256)
+
+# Число процессов-воркеров. Больше 1 - координатор принимает обновления и
+# раздает их воркерам по диалогам, хранилище и очередь поиска общие
+SHARDS = _get('SHARDS', 1)
+# Сколько пользователей воркер помнит в кэше собеседников и режима отладки
+SHARD_CACHE_SIZE = _get('SHARD_CACHE_SIZE', 100_000)
+
+# Пакетный подбор собеседников: раз в MATCH_INTERVAL секунд вся очередь поиска
+# разбирается на пары с учетом страны и возраста. 0 - как раньше, сразу
+# первый подходящий по полу в момент поиска
+MATCH_INTERVAL = _get('MATCH_INTERVAL', 1.0)
+# Сколько секунд может занять один проход вместе с созданием диалогов; не успевшие ждут следующего
+MATCH_BUDGET = _get('MATCH_BUDGET', 0.05)
+# Вес совпадения страны и близости возрастных групп в оценке пары
+MATCH_COUNTRY_WEIGHT = _get('MATCH_COUNTRY_WEIGHT', 2)
+MATCH_AGE_WEIGHT = _get('MATCH_AGE_WEIGHT', 2)
+# Каждые MATCH_RELAX_STEP секунд ожидания требуемая оценка снижается на 1
+MATCH_RELAX_STEP = _get('MATCH_RELAX_STEP', 10.0)
+
+# Завершение по простою: диалог без сообщений дольше DIALOGUE_IDLE_TIMEOUT
+# секунд и поиск дольше SEARCH_TIMEOUT секунд. Проверка раз в REAPER_INTERVAL
+# секунд. 0 или None отключает
+DIALOGUE_IDLE_TIMEOUT = _get('DIALOGUE_IDLE_TIMEOUT', 30 * 60)
+SEARCH_TIMEOUT = _get('SEARCH_TIMEOUT', 10 * 60)
+REAPER_INTERVAL = _get('REAPER_INTERVAL', 10.0)
+
+# Анонимные комнаты (кнопка "Комнаты"): названия, максимум участников
+# и сколько последних сообщений на участника помнить для reply и правок.
+# Копии сообщений уходят с приоритетом рассылок, чтобы большая комната не
+# задерживала пересылку в диалогах
+ROOMS = _get('ROOMS', ('💬 Общий чат', '🤝 Знакомства', '🎵 Музыка и кино', '🎮 Игры'))
+ROOM_CAPACITY = _get('ROOM_CAPACITY', 1000)
+ROOM_HISTORY = _get('ROOM_HISTORY', 1000)
+
+# Сколько секунд отдавать один и тот же ответ /top и /search
+STATS_CACHE_TTL = _get('STATS_CACHE_TTL', 5.0)
+
+# Пользователи, которым доступны команды администратора (/broadcast)
+ADMIN_IDS = _get('ADMIN_IDS', ())
+
+# Рассылка всем пользователям (/broadcast): сообщений в секунду - должно
+# оставаться заметно ниже SEND_GLOBAL_RATE, остаток лимита идет на диалоги
+BROADCAST_RATE = _get('BROADCAST_RATE', 10.0)
+# Сколько получателей читать из хранилища за раз и сколько отправок держать в очереди
+BROADCAST_CHUNK = _get('BROADCAST_CHUNK', 500)
+BROADCAST_WINDOW = _get('BROADCAST_WINDOW', 50)
+# Файл с прогрессом рассылки: после перезапуска она продолжается с места остановки
+BROADCAST_STATE_PATH = _get('BROADCAST_STATE_PATH', 'data/broadcast.json')
+BROADCAST_CHECKPOINT_INTERVAL = _get('BROADCAST_CHECKPOINT_INTERVAL', 5.0)
+# Как часто присылать администратору отчет о ходе рассылки (секунды)
+BROADCAST_REPORT_INTERVAL = _get('BROADCAST_REPORT_INTERVAL', 60.0)
+
+# Журнал событий чатов (регистрация, поиск, диалоги) для аналитики:
+# каталог сегментов (None - не вести) и как часто сбрасывать буфер (секунды).
+# Отчет: python tools/event_stats.py data/events
+EVENTS_DIR = _get('EVENTS_DIR', 'data/events')
+EVENTS_FLUSH_INTERVAL = _get('EVENTS_FLUSH_INTERVAL', 1.0)
+
+# Профилирование по команде /profile или сигналу SIGUSR1: режим 'sample'
+# (выборки стека, почти без накладных расходов) или 'cprofile' (точнее, но
+# замедляет бота), длительность сессии по умолчанию и предел (секунды).
+# Результаты пишутся в LOG_DIR
+PROFILE_MODE = _get('PROFILE_MODE', 'sample')
+PROFILE_DURATION = _get('PROFILE_DURATION', 30.0)
+PROFILE_MAX_DURATION = _get('PROFILE_MAX_DURATION', 300.0)
+PROFILE_SAMPLE_INTERVAL = _get('PROFILE_SAMPLE_INTERVAL', 0.005)
+# Шаги цикла событий дольше этого попадают в отчет (секунды)
+PROFILE_SLOW_CALLBACK = _get('PROFILE_SLOW_CALLBACK', 0.1)
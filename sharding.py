@@ -0,0 +1,506 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import secrets
+import shutil
+import signal
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+from multiprocessing.managers import BaseManager
+from pathlib import Path
+
+import httpx
+from telegram import Update
+
+# Импорт токена из конфигурационного файла
+from config import TOKEN
+import settings
+import metrics
+from httpserver import HTTPServer
+from logging_setup import setup_logging
+from matchmaking import BatchMatcher, MatchQueue
+from rooms import RoomDirectory
+from sender import SendScheduler
+from storage import StateStore
+from webhook import make_webhook_handler
+
+# Методы общего состояния, которые могут вызывать воркеры
+STORE_METHODS = (
+    'get_user', 'is_registered', 'save_user', 'update_user', 'user_ids', 'count_users', 'count_profiles',
+    'get_partner', 'link', 'unlink', 'dialogue_started', 'take_idle',
+    'get_mapped', 'map_message', 'clear_mapping',
+    'is_debug', 'set_debug', 'count_chats', 'count_mapped',
+    'is_unreachable', 'set_unreachable', 'count_unreachable',
+)
+SEARCH_METHODS = ('__contains__', '__len__', '__iter__', 'get', 'counts', 'add', 'discard', 'find', 'pop_match', 'take_batch', 'take_stale')
+ROOM_METHODS = ('list_rooms', 'room_of', 'count_members', 'join', 'leave', 'post', 'record', 'copies')
+# Записи, результат которых воркеру не нужен: уходят в координатор в фоне
+POSTED_METHODS = {('store', 'map_message'), ('store', 'clear_mapping'), ('rooms', 'record')}
+
+# Поля обновления, в которых есть отправитель: по нему выбирается шард
+_USER_UPDATE_KINDS = ('message', 'edited_message', 'callback_query')
+
+
+class SharedState:
+    """
+    Состояние, общее для всех шардов: хранилище, очередь поиска и комнаты.
+
+    Живет в процессе координатора, воркеры обращаются к нему через
+    multiprocessing.managers. У каждого объекта своя блокировка: pop_match
+    забирает пару атомарно для всех процессов, и ищущий на одном шарде
+    находит собеседника на другом, а вызовы комнат не ждут хранилище.
+
+    Воркеры кэшируют собеседника и режим отладки (см. RemoteStore). После
+    их изменения invalidate(user_ids, origin) сбрасывает кэш остальных воркеров
+    """
+
+    def __init__(self, store: StateStore, matcher: BatchMatcher = None, invalidate=None):
+        self.store = store
+        self.searches = MatchQueue(matcher)
+        self.rooms = RoomDirectory(settings.ROOMS, settings.ROOM_CAPACITY, settings.ROOM_HISTORY)
+        self.invalidate = invalidate
+        # Вызовы по методам: сколько обращений к общему состоянию стоит обновление
+        self.calls = Counter()
+        self._targets = {'store': (store, STORE_METHODS, threading.Lock()),
+                         'search': (self.searches, SEARCH_METHODS, threading.Lock()),
+                         'rooms': (self.rooms, ROOM_METHODS, threading.Lock())}
+
+    def call(self, target: str, method: str, args: tuple = (), kwargs: dict = None, origin: int = None):
+        obj, allowed, lock = self._targets[target]
+        if method not in allowed:
+            raise AttributeError(f"{target}.{method} недоступен воркерам")
+        with lock:
+            self.calls[f'{target}.{method}'] += 1
+            result = getattr(obj, method)(*args, **(kwargs or {}))
+            # Итератор нельзя передать в другой процесс
+            if method == '__iter__':
+                result = list(result)
+        if target == 'store' and self.invalidate is not None and method in _CACHED_WRITES:
+            users = [args[0], args[1] if method == 'link' else result] if method in ('link', 'unlink') else [args[0]]
+            self.invalidate([user_id for user_id in users if user_id is not None], origin)
+        return result
+
+    def call_many(self, calls: list, origin: int = None) -> None:
+        """Пачка записей [(target, method, args, kwargs), ...] за одно обращение"""
+        for target, method, args, kwargs in calls:
+            self.call(target, method, args, kwargs, origin)
+
+    def partner_of(self, user_id: int) -> int:
+        """Собеседник для маршрутизации в координаторе (не считается обращением воркера)"""
+        store, _, lock = self._targets['store']
+        with lock:
+            return store.get_partner(user_id)
+
+
+# Записи хранилища, после которых кэш воркеров устаревает
+_CACHED_WRITES = ('link', 'unlink', 'set_debug', 'set_unreachable')
+
+
+class _StateManager(BaseManager):
+    pass
+
+
+_StateManager.register('state', exposed=('call', 'call_many'))
+
+
+class StateConnection:
+    """
+    Канал воркера к общему состоянию.
+
+    Вызов с результатом блокирует цикл воркера на время обращения к
+    координатору. Записи из POSTED_METHODS отдаются фоновому потоку и
+    цикл не ждут, а поток отправляет накопившиеся пачкой. Перед вызовом
+    с результатом накопленные записи дописываются, поэтому координатор
+    видит вызовы воркера в порядке их выполнения
+    """
+
+    # Больше записей за одно обращение не отправляется
+    BATCH_SIZE = 500
+
+    def __init__(self, state, origin: int = None):
+        self._state = state
+        self._origin = origin
+        self._posted = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="state-writer", daemon=True)
+        self._writer.start()
+
+    def call(self, target: str, method: str, args: tuple = (), kwargs: dict = None):
+        if (target, method) in POSTED_METHODS:
+            self._posted.put((target, method, args, kwargs))
+            return None
+        self._posted.join()
+        return self._state.call(target, method, args, kwargs, self._origin)
+
+    def close(self) -> None:
+        """Дописывает накопленные записи"""
+        self._posted.put(None)
+        self._writer.join()
+
+    def _write_loop(self) -> None:
+        # У прокси свое соединение в каждом потоке
+        stopping = False
+        while not stopping:
+            batch = [self._posted.get()]
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self._posted.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopping = True
+            calls = [item for item in batch if item is not None]
+            try:
+                if calls:
+                    self._state.call_many(calls, self._origin)
+            except Exception as e:
+                logging.error(f"Ошибка записи в общее состояние ({len(calls)} записей): {e}")
+            finally:
+                for _ in batch:
+                    self._posted.task_done()
+
+
+def _forward(target: str, method: str):
+    def call(self, *args, **kwargs):
+        return self._connection.call(target, method, args, kwargs)
+    call.__name__ = method
+    return call
+
+
+class RemoteStore(StateStore):
+    """
+    Хранилище в процессе воркера: вызовы выполняются в координаторе.
+
+    Координатор отдает воркеру обновления обоих собеседников диалога
+    (см. shard_of), поэтому собеседник, режим отладки и отметка
+    недоступности - самые частые чтения - берутся из кэша процесса. Изменения из других процессов
+    сбрасывают кэш через forget(), который вызывает координатор
+    """
+
+    def __init__(self, connection: StateConnection, cache_size: int = 100_000):
+        self._connection = connection
+        self.cache_size = cache_size
+        self._partners = OrderedDict()
+        self._debug = OrderedDict()
+        self._unreachable = OrderedDict()
+
+    def _cached(self, cache: OrderedDict, method: str, user_id: int):
+        if user_id in cache:
+            cache.move_to_end(user_id)
+            return cache[user_id]
+        value = self._connection.call('store', method, (user_id,))
+        self._remember(cache, user_id, value)
+        return value
+
+    def _remember(self, cache: OrderedDict, user_id: int, value) -> None:
+        cache[user_id] = value
+        cache.move_to_end(user_id)
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def forget(self, user_ids: list) -> None:
+        for user_id in user_ids:
+            self._partners.pop(user_id, None)
+            self._debug.pop(user_id, None)
+            self._unreachable.pop(user_id, None)
+
+    def get_partner(self, user_id: int) -> int:
+        return self._cached(self._partners, 'get_partner', user_id)
+
+    def is_debug(self, user_id: int) -> bool:
+        return self._cached(self._debug, 'is_debug', user_id)
+
+    def link(self, user_id: int, partner_id: int) -> None:
+        self._connection.call('store', 'link', (user_id, partner_id))
+        self._remember(self._partners, user_id, partner_id)
+        self._remember(self._partners, partner_id, user_id)
+
+    def unlink(self, user_id: int) -> int:
+        partner_id = self._connection.call('store', 'unlink', (user_id,))
+        self._remember(self._partners, user_id, None)
+        if partner_id is not None:
+            self._remember(self._partners, partner_id, None)
+        return partner_id
+
+    def set_debug(self, user_id: int, enabled: bool) -> None:
+        self._connection.call('store', 'set_debug', (user_id, enabled))
+        self._remember(self._debug, user_id, enabled)
+
+    def is_unreachable(self, user_id: int) -> bool:
+        return self._cached(self._unreachable, 'is_unreachable', user_id)
+
+    def set_unreachable(self, user_id: int, flag: bool) -> None:
+        self._connection.call('store', 'set_unreachable', (user_id, flag))
+        self._remember(self._unreachable, user_id, flag)
+
+
+class RemoteSearchQueue:
+    """Очередь поиска в процессе воркера с интерфейсом MatchQueue"""
+
+    def __init__(self, connection: StateConnection):
+        self._connection = connection
+
+    def __iter__(self):
+        return iter(self._connection.call('search', '__iter__'))
+
+
+class RemoteRooms:
+    """Комнаты в процессе воркера с интерфейсом RoomDirectory"""
+
+    def __init__(self, connection: StateConnection):
+        self._connection = connection
+
+
+for _cls, _target, _methods in ((RemoteStore, 'store', STORE_METHODS), (RemoteSearchQueue, 'search', SEARCH_METHODS),
+                                (RemoteRooms, 'rooms', ROOM_METHODS)):
+    for _method in _methods:
+        # Свои реализации (кэш) не заменяем
+        if _method not in vars(_cls):
+            setattr(_cls, _method, _forward(_target, _method))
+
+
+def shard_of(data: dict, shards: int, partner_of=None) -> int:
+    """
+    Номер шарда для обновления. Пользователь в диалоге попадает на шард
+    меньшего из двух ID: обновления обоих собеседников обрабатывает один
+    процесс, и DialogueLocks сохраняет их порядок, как в одном процессе
+    """
+    for kind in _USER_UPDATE_KINDS:
+        payload = data.get(kind)
+        if payload and 'from' in payload:
+            user_id = payload['from']['id']
+            partner_id = partner_of(user_id) if partner_of is not None else None
+            return (user_id if partner_id is None else min(user_id, partner_id)) % shards
+    return 0
+
+
+# --- Воркер ---
+
+def run_worker(index: int, shards: int, address: str, authkey: bytes, inbox, overrides: dict) -> None:
+    """Точка входа процесса-воркера: обрабатывает обновления своих пользователей"""
+    # Ctrl+C получает вся группа процессов, а воркеры останавливает координатор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    vars(settings).update(overrides)
+    setup_logging(f'bot-shard{index}')
+    asyncio.run(_serve_shard(index, shards, address, authkey, inbox))
+
+
+async def _serve_shard(index: int, shards: int, address: str, authkey: bytes, inbox) -> None:
+    # main импортирует этот модуль, поэтому импорт здесь, в процессе воркера
+    import main
+
+    manager = _StateManager(address=address, authkey=authkey)
+    manager.connect()
+    connection = StateConnection(manager.state(), index)
+    main.store = RemoteStore(connection, settings.SHARD_CACHE_SIZE)
+    main.active_searches = RemoteSearchQueue(connection)
+    main.rooms = RemoteRooms(connection)
+    # Лимит Telegram общий на бота, поэтому делится между воркерами
+    main.sender = SendScheduler(
+        global_rate=settings.SEND_GLOBAL_RATE / shards,
+        global_burst=max(1.0, settings.SEND_GLOBAL_BURST / shards),
+        chat_rate=settings.SEND_CHAT_RATE,
+        chat_burst=settings.SEND_CHAT_BURST,
+        max_retries=settings.SEND_MAX_RETRIES,
+        max_queue=settings.SEND_MAX_QUEUE)
+    if settings.METRICS_PORT:
+        settings.METRICS_PORT += 1 + index
+
+    application = main.build_application(base_url=settings.BOT_API_BASE_URL, serve_mode='worker')
+    # Проход по общей очереди выполняет координатор, а запускает его только первый воркер
+    application.bot_data['run_matcher'] = index == 0
+    # Незавершенную рассылку после перезапуска тоже продолжает только он
+    application.bot_data['run_broadcast'] = index == 0
+    application.bot_data['run_reaper'] = index == 0
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+
+    def deliver(data: dict) -> None:
+        if 'invalidate' in data:
+            main.store.forget(data['invalidate'])
+            return
+        update = Update.de_json(data, application.bot)
+        if update is not None:
+            application.update_queue.put_nowait(update)
+
+    def read_inbox() -> None:
+        while (data := inbox.get()) is not None:
+            loop.call_soon_threadsafe(deliver, data)
+        loop.call_soon_threadsafe(stopped.set)
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        threading.Thread(target=read_inbox, name=f"shard{index}-inbox", daemon=True).start()
+        logging.info(f"Шард {index}/{shards} запущен")
+        await stopped.wait()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+    connection.close()
+
+
+# --- Координатор ---
+
+class Coordinator:
+    """
+    Принимает обновления (polling или вебхук) и раздает их воркерам через
+    очереди multiprocessing: пользователя без диалога - по user_id % shards,
+    обоих собеседников - по меньшему ID пары (см. shard_of). Сообщения об
+    устаревшем кэше идут в те же очереди.
+
+    Порядок внутри диалога сохраняется, пока диалог не сменился: при
+    начале или конце диалога один из собеседников переходит на другой
+    шард, и его обновление, еще не обработанное на старом, может
+    выполниться одновременно с новыми.
+    """
+
+    def __init__(self, shards: int, store: StateStore, matcher: BatchMatcher = None):
+        self.shards = shards
+        self.state = SharedState(store, matcher, self.invalidate)
+        self.routed = [0] * shards
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = []
+        self._workers = []
+        self._manager_server = None
+        self._socket_dir = None
+
+    def start(self) -> None:
+        self._socket_dir = tempfile.mkdtemp(prefix='bot-shards-')
+        address = str(Path(self._socket_dir) / 'state.sock')
+        authkey = secrets.token_bytes(32)
+        _StateManager.register('state', callable=lambda: self.state, exposed=('call', 'call_many'))
+        self._manager_server = _StateManager(address=address, authkey=authkey).get_server()
+        threading.Thread(target=self._manager_server.serve_forever, name="shared-state", daemon=True).start()
+
+        overrides = {name: value for name, value in vars(settings).items() if name.isupper()}
+        for index in range(self.shards):
+            inbox = self._context.Queue()
+            worker = self._context.Process(
+                target=run_worker, args=(index, self.shards, address, authkey, inbox, overrides),
+                name=f"bot-shard{index}")
+            worker.start()
+            self._queues.append(inbox)
+            self._workers.append(worker)
+        logging.info(f"Запущено воркеров: {self.shards}")
+
+    def route(self, data: dict) -> None:
+        shard = shard_of(data, self.shards, self.state.partner_of)
+        self.routed[shard] += 1
+        self._queues[shard].put(data)
+
+    def invalidate(self, user_ids: list, origin: int = None) -> None:
+        """Сбрасывает кэш диалогов этих пользователей у всех воркеров, кроме изменившего"""
+        for index, inbox in enumerate(self._queues):
+            if index != origin:
+                inbox.put({'invalidate': user_ids})
+
+    def stop(self, timeout: float = 10) -> None:
+        for inbox in self._queues:
+            inbox.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                logging.error(f"Воркер {worker.name} не остановился за {timeout} с")
+                worker.terminate()
+            elif worker.exitcode:
+                logging.error(f"Воркер {worker.name} завершился с кодом {worker.exitcode}")
+        # Сокет удаляется при закрытии слушателя, иначе это попытается сделать финализатор при выходе
+        self._manager_server.listener.close()
+        shutil.rmtree(self._socket_dir, ignore_errors=True)
+
+    def register_gauges(self) -> None:
+        searches, store = self.state.searches, self.state.store
+        metrics.REGISTRY.gauge('bot_active_searches', 'Пользователей в поиске', lambda: len(searches))
+        metrics.REGISTRY.gauge('bot_active_chats', 'Активных диалогов', lambda: store.count_chats())
+        for index in range(self.shards):
+            metrics.REGISTRY.gauge(f'bot_shard{index}_routed_total', f'Обновлений передано шарду {index}',
+                                   lambda index=index: self.routed[index], kind='counter')
+        metrics.REGISTRY.gauge('bot_shared_state_calls_total', 'Обращений воркеров к общему состоянию',
+                               lambda: sum(self.state.calls.values()), kind='counter')
+
+
+async def _poll_updates(api_url: str, route, allowed_updates: list) -> None:
+    async with httpx.AsyncClient(timeout=httpx.Timeout(10, read=40)) as client:
+        await client.post(f"{api_url}/deleteWebhook")
+        offset = 0
+        while True:
+            try:
+                response = await client.post(f"{api_url}/getUpdates", json={
+                    'offset': offset, 'timeout': 30, 'allowed_updates': allowed_updates})
+                result = response.json()
+            except (httpx.HTTPError, ValueError) as e:
+                logging.error(f"Ошибка получения обновлений: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not result.get('ok'):
+                logging.error(f"getUpdates: {result.get('description')}")
+                await asyncio.sleep(result.get('parameters', {}).get('retry_after', 1))
+                continue
+            for data in result['result']:
+                offset = data['update_id'] + 1
+                route(data)
+
+
+async def _serve_coordinator(coordinator: Coordinator, allowed_updates: list) -> None:
+    api_url = f"{(settings.BOT_API_BASE_URL or 'https://api.telegram.org').rstrip('/')}/bot{TOKEN}"
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    metrics_server = None
+    if settings.METRICS_PORT:
+        coordinator.register_gauges()
+        metrics_server = await metrics.start_metrics_server(settings.METRICS_LISTEN, settings.METRICS_PORT)
+
+    async def deliver(data: dict) -> bool:
+        coordinator.route(data)
+        return True
+
+    server = poller = None
+    if settings.SERVE_MODE == 'webhook':
+        if not settings.WEBHOOK_SECRET:
+            raise ValueError("Для режима вебхука нужен WEBHOOK_SECRET")
+        server = HTTPServer(settings.WEBHOOK_LISTEN, settings.WEBHOOK_PORT)
+        server.route(settings.WEBHOOK_PATH, make_webhook_handler(settings.WEBHOOK_SECRET, deliver), methods=('POST',))
+        await server.start()
+        if settings.WEBHOOK_URL:
+            async with httpx.AsyncClient() as client:
+                await client.post(f"{api_url}/setWebhook", json={
+                    'url': settings.WEBHOOK_URL, 'secret_token': settings.WEBHOOK_SECRET,
+                    'allowed_updates': allowed_updates, 'max_connections': settings.WEBHOOK_MAX_CONNECTIONS})
+            logging.info(f"Вебхук зарегистрирован: {settings.WEBHOOK_URL}")
+    else:
+        poller = asyncio.create_task(_poll_updates(api_url, coordinator.route, allowed_updates))
+
+    try:
+        await stop_event.wait()
+    finally:
+        if poller is not None:
+            poller.cancel()
+        if server is not None:
+            await server.stop()
+        if metrics_server is not None:
+            await metrics_server.stop()
+
+
+def run_sharded(shards: int, store: StateStore, allowed_updates: list = None,
+                matcher: BatchMatcher = None) -> Coordinator:
+    """
+    Запускает координатор и shards воркеров до SIGINT/SIGTERM.
+    store (уже открытое) становится общим состоянием всех воркеров,
+    matcher выполняет пакетный подбор рядом с общей очередью.
+    Возвращает остановленный координатор (счетчики для бенчмарков)
+    """
+    coordinator = Coordinator(shards, store, matcher)
+    coordinator.start()
+    try:
+        asyncio.run(_serve_coordinator(coordinator, allowed_updates))
+    finally:
+        coordinator.stop()
+    return coordinator
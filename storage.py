@@ -0,0 +1,571 @@
+import bisect
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from pathlib import Path
+
+from message_map import MessageMap
+from profiles import FIELDS, ProfileTable, make_profile
+
+
+class StateStore:
+    """
+    Интерфейс хранилища состояния бота: профили пользователей,
+    активные диалоги, соответствие сообщений и режим отладки.
+
+    Очередь поиска сюда не входит - она живет только в памяти
+    (см. matchmaking.MatchQueue) и после перезапуска пользователь
+    просто начинает поиск заново.
+    """
+
+    def open(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    # Пользователи
+    def get_user(self, user_id: int) -> dict:
+        """Профиль (profiles.Profile, читается как словарь) или None"""
+        raise NotImplementedError
+
+    def is_registered(self, user_id: int) -> bool:
+        return self.get_user(user_id) is not None
+
+    def save_user(self, user_id: int, profile: dict) -> None:
+        raise NotImplementedError
+
+    def update_user(self, user_id: int, **fields) -> dict:
+        profile = dict(self.get_user(user_id) or {})
+        profile.update(fields)
+        self.save_user(user_id, profile)
+        return profile
+
+    def user_ids(self, after: int = 0, limit: int = 1000) -> list:
+        """
+        Следующие limit зарегистрированных user_id больше after по возрастанию
+        (для рассылок). Недоступные пользователи пропускаются
+        """
+        raise NotImplementedError
+
+    def count_users(self) -> int:
+        """Число зарегистрированных пользователей без недоступных"""
+        raise NotImplementedError
+
+    def count_profiles(self) -> Counter:
+        """
+        Зарегистрированные по профилю: {Profile: число}. Счетчики ведет save_user,
+        поэтому стоимость не зависит от числа пользователей
+        """
+        raise NotImplementedError
+
+    # Диалоги
+    def get_partner(self, user_id: int) -> int:
+        raise NotImplementedError
+
+    def link(self, user_id: int, partner_id: int) -> None:
+        raise NotImplementedError
+
+    def unlink(self, user_id: int) -> int:
+        """Завершает диалог пользователя с обеих сторон, возвращает ID партнера или None"""
+        raise NotImplementedError
+
+    def dialogue_started(self, user_id: int) -> float:
+        """Время начала диалога (time.time()) или None, если оно неизвестно"""
+        raise NotImplementedError
+
+    def take_idle(self, timeout: float, now: float = None) -> list:
+        """
+        Диалоги без пересланных сообщений дольше timeout секунд: [(user_id, partner_id), ...].
+        Возвращенные больше не отслеживаются, завершает их вызывающий
+        """
+        raise NotImplementedError
+
+    # Соответствие сообщений
+    def get_mapped(self, user_id: int, message_id: int) -> int:
+        raise NotImplementedError
+
+    def map_message(self, user_id: int, message_id: int, mapped_id: int) -> None:
+        raise NotImplementedError
+
+    def clear_mapping(self, user_id: int) -> None:
+        raise NotImplementedError
+
+    # Режим отладки
+    def is_debug(self, user_id: int) -> bool:
+        raise NotImplementedError
+
+    # Статистика для мониторинга
+    def count_chats(self) -> int:
+        raise NotImplementedError
+
+    def count_mapped(self) -> int:
+        raise NotImplementedError
+
+    def set_debug(self, user_id: int, enabled: bool) -> None:
+        raise NotImplementedError
+
+    # Недоступные: заблокировали бота или удалили аккаунт. Отметка
+    # снимается, когда пользователь снова пишет боту
+    def is_unreachable(self, user_id: int) -> bool:
+        raise NotImplementedError
+
+    def set_unreachable(self, user_id: int, flag: bool) -> None:
+        raise NotImplementedError
+
+    def count_unreachable(self) -> int:
+        raise NotImplementedError
+
+
+class MemoryStore(StateStore):
+    """Хранилище в словарях процесса, данные теряются при перезапуске"""
+
+    def __init__(self, map_window: int = 10_000, map_ttl: float = None):
+        self.map_window = map_window
+        self.map_ttl = map_ttl
+        self.users = ProfileTable()
+        # Все user_id по возрастанию: рассылка читает их порциями через bisect.
+        # Новые копятся отдельно и вливаются при чтении (timsort сливает их за один проход)
+        self._user_ids = []
+        self._new_user_ids = []
+        self.registrations = Counter()
+        self.active_chats = {}
+        # Начало диалогов, только в памяти: после перезапуска длительность неизвестна
+        self.linked_at = {}
+        # Последняя пересылка в диалоге по меньшему из двух ID. Порядок - по
+        # времени активности, поэтому простаивающие диалоги всегда в начале
+        self.chat_activity = OrderedDict()
+        self.message_mapping = {}
+        self.debug_mode = set()
+        self.unreachable = set()
+
+    def get_user(self, user_id: int) -> dict:
+        return self.users.get(user_id)
+
+    def save_user(self, user_id: int, profile: dict) -> None:
+        if user_id not in self.users:
+            self._new_user_ids.append(user_id)
+        self._count_registration(self.users.get(user_id), self.users.put(user_id, profile))
+
+    def _count_registration(self, old, new) -> None:
+        if old is new:
+            return
+        if old is not None:
+            self.registrations[old] -= 1
+            if self.registrations[old] <= 0:
+                del self.registrations[old]
+        if new is not None:
+            self.registrations[new] += 1
+
+    def count_profiles(self) -> Counter:
+        return Counter(self.registrations)
+
+    def user_ids(self, after: int = 0, limit: int = 1000) -> list:
+        if self._new_user_ids:
+            self._user_ids.extend(self._new_user_ids)
+            self._user_ids.sort()
+            self._new_user_ids.clear()
+        user_ids, unreachable = self._user_ids, self.unreachable
+        start = bisect.bisect_right(user_ids, after)
+        result = []
+        while len(result) < limit and start < len(user_ids):
+            chunk = user_ids[start:start + limit - len(result)]
+            start += len(chunk)
+            result.extend(user_id for user_id in chunk if user_id not in unreachable)
+        return result
+
+    def count_users(self) -> int:
+        return len(self.users) - sum(user_id in self.users for user_id in self.unreachable)
+
+    def get_partner(self, user_id: int) -> int:
+        return self.active_chats.get(user_id)
+
+    def link(self, user_id: int, partner_id: int) -> None:
+        self.active_chats[user_id] = partner_id
+        self.active_chats[partner_id] = user_id
+        self.linked_at[user_id] = self.linked_at[partner_id] = time.time()
+        self._touch(user_id, partner_id)
+
+    def unlink(self, user_id: int) -> int:
+        partner_id = self.active_chats.pop(user_id, None)
+        self.linked_at.pop(user_id, None)
+        if partner_id is not None and self.active_chats.get(partner_id) == user_id:
+            del self.active_chats[partner_id]
+            self.linked_at.pop(partner_id, None)
+            self.chat_activity.pop(min(user_id, partner_id), None)
+        return partner_id
+
+    def dialogue_started(self, user_id: int) -> float:
+        return self.linked_at.get(user_id)
+
+    def _touch(self, user_id: int, partner_id: int) -> None:
+        key = min(user_id, partner_id)
+        self.chat_activity[key] = time.monotonic()
+        self.chat_activity.move_to_end(key)
+
+    def take_idle(self, timeout: float, now: float = None) -> list:
+        now = time.monotonic() if now is None else now
+        activity = self.chat_activity
+        idle = []
+        while activity:
+            user_id, last = next(iter(activity.items()))
+            if now - last < timeout:
+                break
+            del activity[user_id]
+            partner_id = self.active_chats.get(user_id)
+            if partner_id is not None:
+                idle.append((user_id, partner_id))
+        return idle
+
+    def get_mapped(self, user_id: int, message_id: int) -> int:
+        mapping = self.message_mapping.get(user_id)
+        return mapping.get(message_id) if mapping else None
+
+    def map_message(self, user_id: int, message_id: int, mapped_id: int) -> bool:
+        partner_id = self.active_chats.get(user_id)
+        if partner_id is not None:
+            self._touch(user_id, partner_id)
+        mapping = self.message_mapping.get(user_id)
+        if mapping is None:
+            mapping = self.message_mapping[user_id] = MessageMap(self.map_window, self.map_ttl)
+        return mapping.put(message_id, mapped_id)
+
+    def clear_mapping(self, user_id: int) -> None:
+        self.message_mapping.pop(user_id, None)
+
+    def is_debug(self, user_id: int) -> bool:
+        return user_id in self.debug_mode
+
+    def set_debug(self, user_id: int, enabled: bool) -> None:
+        if enabled:
+            self.debug_mode.add(user_id)
+        else:
+            self.debug_mode.discard(user_id)
+
+    def is_unreachable(self, user_id: int) -> bool:
+        return user_id in self.unreachable
+
+    def set_unreachable(self, user_id: int, flag: bool) -> None:
+        if flag:
+            self.unreachable.add(user_id)
+        else:
+            self.unreachable.discard(user_id)
+
+    def count_unreachable(self) -> int:
+        return len(self.unreachable)
+
+    def count_chats(self) -> int:
+        return len(self.active_chats) // 2
+
+    def count_mapped(self) -> int:
+        return sum(len(mapping) for mapping in self.message_mapping.values())
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    gender TEXT,
+    country TEXT,
+    age TEXT
+);
+CREATE TABLE IF NOT EXISTS active_chats (
+    user_id INTEGER PRIMARY KEY,
+    partner_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS message_mapping (
+    user_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    mapped_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, message_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS debug_mode (
+    user_id INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS unreachable (
+    user_id INTEGER PRIMARY KEY
+);
+"""
+
+_SAVE_USER_SQL = "INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?)"
+
+# Маркер завершения работы фонового потока записи
+_STOP = object()
+
+# Ошибки, после которых та же запись может пройти: база занята, диск заполнен, сбой ввода-вывода
+_TRANSIENT_ERRORS = {sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED, sqlite3.SQLITE_IOERR, sqlite3.SQLITE_FULL}
+# Предельная пауза между повторами записи, секунды
+_MAX_RETRY_DELAY = 30.0
+
+
+def _is_transient(error: sqlite3.Error) -> bool:
+    # Расширенные коды (SQLITE_IOERR_WRITE и т.п.) хранят основной код в младшем байте
+    return (getattr(error, 'sqlite_errorcode', None) or 0) & 0xff in _TRANSIENT_ERRORS
+
+
+class SQLiteStore(MemoryStore):
+    """
+    Хранилище в SQLite (WAL) с отложенной пакетной записью.
+
+    Все изменения сразу применяются к данным в памяти и ставятся в очередь,
+    которую фоновый поток сбрасывает на диск пачками. Обработчики никогда
+    не ждут fsync. Диалоги, режим отладки, недоступные пользователи и
+    соответствие сообщений для активных диалогов загружаются при старте целиком, профили
+    пользователей загружаются при старте до размера кэша, остальные
+    подгружаются по требованию (LRU).
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.5, batch_size: int = 1000, user_cache_size: int = 100_000,
+                 map_window: int = 10_000, map_ttl: float = None):
+        super().__init__(map_window, map_ttl)
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.user_cache_size = user_cache_size
+        self.users = ProfileTable(max_size=user_cache_size)
+        # Профили, которые еще не записаны на диск: их нельзя терять из кэша.
+        # Значение - параметры записи, по ним поток записи узнает свою версию.
+        # Поток записи удаляет из словаря, поэтому обход - только по копии под блокировкой
+        self._pending_users = {}
+        self._pending_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._reader = None
+        self._writer = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # В режиме WAL synchronous=NORMAL не теряет целостность при сбое
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._reader = self._connect()
+        self._reader.executescript(_SCHEMA)
+
+        self.active_chats = dict(self._reader.execute("SELECT user_id, partner_id FROM active_chats"))
+        # Время последней активности не хранится: отсчет простоя начинается с запуска
+        now = time.monotonic()
+        self.chat_activity = OrderedDict(
+            (user_id, now) for user_id, partner_id in self.active_chats.items() if user_id < partner_id)
+        self.debug_mode = {row[0] for row in self._reader.execute("SELECT user_id FROM debug_mode")}
+        self.unreachable = {row[0] for row in self._reader.execute("SELECT user_id FROM unreachable")}
+        self.registrations = Counter()
+        for *values, count in self._reader.execute(
+                "SELECT gender, country, age, COUNT(*) FROM users GROUP BY gender, country, age"):
+            self.registrations[make_profile(dict(zip(FIELDS, values)))] += count
+        # Кэш профилей заполняется одним запросом, а не по запросу на пользователя
+        self.users.load(self._reader.execute(
+            "SELECT user_id, gender, country, age FROM users LIMIT ?", (self.user_cache_size,)))
+        stale = set()
+        for user_id, message_id, mapped_id in self._reader.execute(
+                "SELECT user_id, message_id, mapped_id FROM message_mapping"):
+            if user_id in self.active_chats or user_id in self.debug_mode:
+                MemoryStore.map_message(self, user_id, message_id, mapped_id)
+            else:
+                stale.add(user_id)
+        # Остатки от диалогов, завершенных до сбоя
+        for user_id in stale:
+            self._write("DELETE FROM message_mapping WHERE user_id = ?", (user_id,))
+
+        self._writer = threading.Thread(target=self._write_loop, name="sqlite-writer", daemon=True)
+        self._writer.start()
+        logging.info(
+            f"Состояние загружено из {self.path}: диалогов {len(self.active_chats) // 2}, "
+            f"в режиме отладки {len(self.debug_mode)}, профилей в кэше {len(self.users)}")
+
+    def close(self) -> None:
+        if self._writer is None:
+            return
+        self._queue.put(_STOP)
+        self._writer.join()
+        self._writer = None
+        self._reader.close()
+        self._reader = None
+
+    def flush(self) -> None:
+        """Блокирует до записи всех накопленных изменений (для тестов и остановки)"""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def _write(self, sql: str, params: tuple, pending: bool = False) -> None:
+        self._queue.put((sql, params, pending))
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        stopping = False
+        # Не записанные из-за временной ошибки: повторяются первыми, порядок сохраняется
+        retry = []
+        waiters = []
+        delay = self.flush_interval
+        while not stopping:
+            batch = [] if retry else [self._queue.get()]
+            # Добираем все, что накопилось, но не дольше flush_interval
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                pass
+            stopping = any(item is _STOP for item in batch)
+            waiters.extend(item for item in batch if isinstance(item, threading.Event))
+
+            written, retry = self._commit(conn, retry + [item for item in batch if isinstance(item, tuple)])
+            # Записанные профили больше не нужно держать в памяти принудительно
+            with self._pending_lock:
+                for item in written:
+                    if item[2]:
+                        user_id = item[1][0]
+                        if self._pending_users.get(user_id) is item[1]:
+                            del self._pending_users[user_id]
+
+            if retry and stopping:
+                logging.error(f"SQLite: при остановке не записано изменений: {len(retry)}")
+            elif retry:
+                time.sleep(delay)
+                delay = min(delay * 2, _MAX_RETRY_DELAY)
+                continue
+            delay = self.flush_interval
+            for waiter in waiters:
+                waiter.set()
+            waiters.clear()
+        conn.close()
+
+    @staticmethod
+    def _commit(conn: sqlite3.Connection, writes: list) -> tuple:
+        """Записывает пачку одной транзакцией. Возвращает (записанные, повторить позже)"""
+        try:
+            conn.execute("BEGIN")
+            for sql, params, _ in writes:
+                conn.execute(sql, params)
+            conn.execute("COMMIT")
+            return writes, []
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            if _is_transient(e):
+                logging.error(f"Ошибка записи состояния в SQLite, пачка будет записана повторно: {e}")
+                return [], writes
+            logging.error(f"Ошибка записи состояния в SQLite, записи сохраняются по одной: {e}")
+
+        # Ошибка в одной из записей: остальные не должны пропасть вместе с ней
+        written = []
+        for i, item in enumerate(writes):
+            try:
+                conn.execute(item[0], item[1])
+            except sqlite3.Error as e:
+                if _is_transient(e):
+                    return written, writes[i:]
+                # Такая запись не пройдет и при повторе. Профиль из нее остается в памяти
+                logging.error(f"SQLite: запись отброшена ({item[0]}, {item[1]}): {e}")
+            else:
+                written.append(item)
+        return written, []
+
+    # Пользователи
+    def get_user(self, user_id: int) -> dict:
+        if user_id in self.users:
+            return self.users.get(user_id)
+
+        row = self._pending_users.get(user_id)
+        if row is None:
+            row = self._reader.execute(
+                "SELECT user_id, gender, country, age FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        # Кэшируем и отсутствие профиля, чтобы незарегистрированные не ходили в базу
+        return self.users.put(user_id, None if row is None else dict(zip(FIELDS, row[1:])))
+
+    def save_user(self, user_id: int, profile: dict) -> None:
+        old = self.get_user(user_id)
+        profile = self.users.put(user_id, profile)
+        self._count_registration(old, profile)
+        params = (user_id, profile.gender, profile.country, profile.age)
+        with self._pending_lock:
+            self._pending_users[user_id] = params
+        self._write(_SAVE_USER_SQL, params, pending=True)
+
+    def _pending_ids(self) -> list:
+        """user_id еще не записанных профилей (копия: поток записи меняет словарь)"""
+        with self._pending_lock:
+            return list(self._pending_users)
+
+    def user_ids(self, after: int = 0, limit: int = 1000) -> list:
+        # Кэш неполный, поэтому читаем базу и добавляем еще не записанные профили.
+        # Недоступных отсеивает база, а еще не записанные отметки - множество в памяти
+        while True:
+            user_ids = [row[0] for row in self._reader.execute(
+                "SELECT user_id FROM users WHERE user_id > ? AND user_id NOT IN (SELECT user_id FROM unreachable) "
+                "ORDER BY user_id LIMIT ?", (after, limit))]
+            pending = [user_id for user_id in self._pending_ids() if user_id > after]
+            if pending:
+                user_ids = sorted(set(user_ids).union(pending))[:limit]
+            reachable = [user_id for user_id in user_ids if user_id not in self.unreachable]
+            # Пустая порция означает конец списка, поэтому целиком отсеянную пропускаем
+            if reachable or len(user_ids) < limit:
+                return reachable
+            after = user_ids[-1]
+
+    def count_users(self) -> int:
+        count = self._reader.execute(
+            "SELECT COUNT(*) FROM users WHERE user_id NOT IN (SELECT user_id FROM unreachable)").fetchone()[0]
+        pending = [user_id for user_id in self._pending_ids() if user_id not in self.unreachable]
+        if pending:
+            # Еще не записанные новые профили - одним запросом, а не по запросу на каждый
+            count += self._reader.execute(
+                "SELECT COUNT(*) FROM json_each(?) WHERE value NOT IN (SELECT user_id FROM users)",
+                (json.dumps(pending),)).fetchone()[0]
+        return count
+
+    # Диалоги
+    def link(self, user_id: int, partner_id: int) -> None:
+        super().link(user_id, partner_id)
+        self._write("INSERT OR REPLACE INTO active_chats VALUES (?, ?), (?, ?)",
+                    (user_id, partner_id, partner_id, user_id))
+
+    def unlink(self, user_id: int) -> int:
+        partner_id = super().unlink(user_id)
+        if partner_id is not None:
+            self._write("DELETE FROM active_chats WHERE user_id IN (?, ?)", (user_id, partner_id))
+        return partner_id
+
+    # Соответствие сообщений
+    def map_message(self, user_id: int, message_id: int, mapped_id: int) -> bool:
+        compacted = super().map_message(user_id, message_id, mapped_id)
+        self._write("INSERT OR REPLACE INTO message_mapping VALUES (?, ?, ?)",
+                    (user_id, message_id, mapped_id))
+        if compacted:
+            # Вслед за памятью удаляем вытесненные записи и на диске
+            self._write("DELETE FROM message_mapping WHERE user_id = ? AND message_id < ?",
+                        (user_id, self.message_mapping[user_id].oldest_key()))
+        return compacted
+
+    def clear_mapping(self, user_id: int) -> None:
+        super().clear_mapping(user_id)
+        self._write("DELETE FROM message_mapping WHERE user_id = ?", (user_id,))
+
+    # Режим отладки
+    def set_debug(self, user_id: int, enabled: bool) -> None:
+        super().set_debug(user_id, enabled)
+        if enabled:
+            self._write("INSERT OR IGNORE INTO debug_mode VALUES (?)", (user_id,))
+        else:
+            self._write("DELETE FROM debug_mode WHERE user_id = ?", (user_id,))
+
+    def set_unreachable(self, user_id: int, flag: bool) -> None:
+        super().set_unreachable(user_id, flag)
+        if flag:
+            self._write("INSERT OR IGNORE INTO unreachable VALUES (?)", (user_id,))
+        else:
+            self._write("DELETE FROM unreachable WHERE user_id = ?", (user_id,))
+
+
+def create_store(backend: str, map_window: int = 10_000, map_ttl: float = None, **options) -> StateStore:
+    """Создает хранилище по имени из настроек"""
+    if backend == 'memory':
+        return MemoryStore(map_window, map_ttl)
+    if backend == 'sqlite':
+        return SQLiteStore(map_window=map_window, map_ttl=map_ttl, **options)
+    raise ValueError(f"Неизвестное хранилище состояния: {backend}")
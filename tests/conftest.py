@@ -0,0 +1,14 @@
+import sys
+import types
+from pathlib import Path
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# config.py с токеном у каждой установки свой и в репозиторий не входит
+try:
+    import config  # noqa: F401
+except ImportError:
+    config = types.ModuleType('config')
+    config.TOKEN = '123456:TEST'
+    sys.modules['config'] = config
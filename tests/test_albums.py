@@ -0,0 +1,58 @@
+import asyncio
+from types import SimpleNamespace
+
+from albums import AlbumAggregator
+from ordering import DialogueLocks
+
+
+def part(message_id: int, group: str = 'g1'):
+    return SimpleNamespace(chat_id=1, message_id=message_id, media_group_id=group)
+
+
+def run(handle):
+    """Обработчик сообщения под блокировкой диалога, как при параллельной обработке"""
+    locks = DialogueLocks(lambda user_id: None)
+    albums = AlbumAggregator(window=0.05, hold=locks.hold)
+    sent = []
+
+    async def on_complete(parts):
+        await asyncio.sleep(0.01)
+        sent.append([message.message_id for message in parts])
+
+    async def go():
+        for message_id in (11, 10):
+            albums.add(part(message_id), on_complete)
+        async with locks.hold(1):
+            await handle(albums, sent)
+        await asyncio.sleep(0.1)
+        assert not len(albums) and not albums._tasks
+
+    asyncio.run(go())
+    return sent
+
+
+def test_next_message_waits_for_album():
+    async def handle(albums, sent):
+        await albums.flush(1)
+        sent.append('text')
+
+    assert run(handle) == [[10, 11], 'text']
+
+
+def test_album_is_sent_once_when_window_ends_during_handler():
+    async def handle(albums, sent):
+        # Окно истекло, пока обработчик держит блокировку: фоновая пересылка ждет ее
+        await asyncio.sleep(0.1)
+        await albums.flush(1)
+        sent.append('text')
+
+    assert run(handle) == [[10, 11], 'text']
+
+
+def test_parts_of_the_same_album_do_not_flush_it():
+    async def handle(albums, sent):
+        await albums.flush(1, 'g1')
+        await albums.flush(2)
+        sent.append('text')
+
+    assert run(handle) == ['text', [10, 11]]
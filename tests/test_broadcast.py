@@ -0,0 +1,146 @@
+import asyncio
+import json
+
+from telegram.error import Forbidden
+
+from broadcast import Broadcast
+from sender import SendScheduler
+from storage import MemoryStore
+
+PROFILE = {'gender': 'male', 'country': 'Россия', 'age': 'от 18 до 21 года'}
+
+
+class Bot:
+    """Бот, который запоминает получателей. Пока gate закрыт, отправка висит"""
+
+    def __init__(self, blocked=()):
+        self.sent = []
+        self.blocked = set(blocked)
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def send_message(self, chat_id: int, text: str):
+        await self.gate.wait()
+        if chat_id in self.blocked:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        self.sent.append(chat_id)
+
+
+def make_store(n: int) -> MemoryStore:
+    store = MemoryStore()
+    for user_id in range(1, n + 1):
+        store.save_user(user_id, PROFILE)
+    return store
+
+
+def make_job(path, total: int, **options) -> Broadcast:
+    options = {'rate': 1e6, 'chunk_size': 7, 'window': 5, 'checkpoint_interval': 0.0, **options}
+    return Broadcast.create(100, {'text': 'hi'}, total, str(path), **options)
+
+
+def scheduler(**options) -> SendScheduler:
+    return SendScheduler(global_rate=1e6, global_burst=1e6, chat_rate=1e6, chat_burst=1e6, **options)
+
+
+def test_sends_everyone_once_and_saves_done(tmp_path):
+    async def go():
+        bot, sender = Bot(), scheduler()
+        job = make_job(tmp_path / 'broadcast.json', 20)
+        await job.run(bot, sender, make_store(20))
+        await sender.close()
+        return bot, job
+
+    bot, job = asyncio.run(go())
+    assert sorted(bot.sent) == list(range(1, 21))
+    state = json.loads((tmp_path / 'broadcast.json').read_text())
+    assert state['done'] and state['cursor'] == 20 and state['sent'] == 20
+
+
+def test_dead_recipients_are_counted(tmp_path):
+    dead = []
+
+    async def on_dead(user_id: int) -> None:
+        dead.append(user_id)
+
+    async def go():
+        bot, sender = Bot(blocked={3, 7}), scheduler()
+        job = make_job(tmp_path / 'broadcast.json', 10)
+        await job.run(bot, sender, make_store(10), on_dead=on_dead)
+        await sender.close()
+        return job
+
+    job = asyncio.run(go())
+    assert sorted(dead) == [3, 7]
+    assert job.state['dead'] == 2 and job.state['sent'] == 8 and job.processed == 10
+    # Файл состояния не растет с числом недоступных
+    assert json.loads((tmp_path / 'broadcast.json').read_text())['dead'] == 2
+
+
+def test_loads_old_state_with_dead_list(tmp_path):
+    path = tmp_path / 'broadcast.json'
+    job = make_job(path, 10)
+    job.state['dead'] = [4, 5, 6]
+    job.save()
+    assert Broadcast.load(str(path)).state['dead'] == 3
+
+
+def test_resumes_after_cursor(tmp_path):
+    path = tmp_path / 'broadcast.json'
+    job = make_job(path, 20)
+    job.state['cursor'] = 12
+    job.save()
+
+    async def go():
+        bot, sender = Bot(), scheduler()
+        await Broadcast.load(str(path), rate=1e6, chunk_size=7, window=5).run(bot, sender, make_store(20))
+        await sender.close()
+        return bot
+
+    assert sorted(asyncio.run(go()).sent) == list(range(13, 21))
+    assert Broadcast.load(str(tmp_path / 'missing.json')) is None
+
+
+def test_cancel_drops_queued_sends(tmp_path):
+    async def go():
+        bot, sender = Bot(), scheduler(max_in_flight=2)
+        bot.gate.clear()
+        job = make_job(tmp_path / 'broadcast.json', 50, window=10)
+        task = asyncio.create_task(job.run(bot, sender, make_store(50)))
+        while sender.stats()['queued'] < 10:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        # Уже отправленные в Telegram запросы завершаются, стоявшие в очереди - нет
+        bot.gate.set()
+        await asyncio.sleep(0.1)
+        await sender.close()
+        return bot, job, sender
+
+    bot, job, sender = asyncio.run(go())
+    assert len(bot.sent) == 2
+    assert sender.counters['cancelled'] == 8
+    # Неподтвержденные остаются за cursor и уйдут после возобновления
+    assert job.state['cursor'] == 0 and job.active
+
+
+def test_stop_requested_from_another_process(tmp_path):
+    path = tmp_path / 'broadcast.json'
+
+    async def go():
+        bot, sender = Bot(), scheduler()
+        job = make_job(path, 1000, rate=200.0)
+        job.save()
+        task = asyncio.create_task(job.run(bot, sender, make_store(1000)))
+        while len(bot.sent) < 10:
+            await asyncio.sleep(0.01)
+        # Другой процесс видит рассылку только по файлу
+        Broadcast.load(str(path)).request_stop()
+        await asyncio.wait_for(task, 5)
+        await sender.close()
+        return bot, job
+
+    bot, job = asyncio.run(go())
+    assert job.state['cancelled'] and not job.state['done']
+    assert len(bot.sent) < 1000
+    assert json.loads(path.read_text())['cancelled']
+    assert not job.stop_path.exists()
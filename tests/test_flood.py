@@ -0,0 +1,77 @@
+import asyncio
+from types import SimpleNamespace
+
+import main
+from flood import FloodControl
+
+
+def test_burst_then_mute_with_growing_duration():
+    flood = FloodControl(rate=1.0, burst=3, mute=10.0, mute_max=25.0, forgive=600.0)
+    assert [flood.check(1, now=0.0) for _ in range(3)] == [None, None, None]
+    # Сверх лимита: молчание начинается, о нем сообщается один раз
+    assert flood.check(1, now=0.0) == 10.0
+    assert flood.check(1, now=5.0) == 0
+    # Повторное нарушение до прощения - вдвое дольше, но не больше mute_max
+    assert [flood.check(1, now=10.0) for _ in range(4)] == [None, None, None, 20.0]
+    assert [flood.check(1, now=30.0) for _ in range(4)] == [None, None, None, 25.0]
+    # Другие пользователи не затронуты
+    assert flood.check(2, now=30.0) is None
+
+
+def test_album_counts_as_one_message():
+    flood = FloodControl(rate=1.0, burst=1)
+    assert [flood.check(1, 'album', now=0.0) for _ in range(10)] == [None] * 10
+    assert flood.check(1, now=0.0) == flood.mute
+
+
+def test_forgotten_after_refill_and_bounded():
+    flood = FloodControl(rate=1.0, burst=2, forgive=5.0, max_users=3)
+    for user_id in range(5):
+        flood.check(user_id, now=0.0)
+    assert len(flood) == 3
+    # Восстановившиеся записи без нарушений удаляются
+    flood.check(100, now=10.0)
+    assert len(flood) == 1
+
+
+def test_commands_pass_during_mute(monkeypatch):
+    monkeypatch.setattr(main, 'flood', FloodControl(rate=1.0, burst=1, mute=60.0))
+    monkeypatch.setattr(main.settings, 'ADMIN_IDS', [])
+    monkeypatch.setattr(main, 'flood_warning', lambda *args: _noop())
+
+    def update(text: str):
+        message = SimpleNamespace(from_user=SimpleNamespace(id=7), text=text, media_group_id=None)
+        return SimpleNamespace(message=message, edited_message=None, get_bot=lambda: None)
+
+    async def go():
+        results = [main.admit_update(update('привет')) for _ in range(3)]
+        results.append(main.admit_update(update('/stop')))
+        await asyncio.sleep(0)
+        return results
+
+    assert asyncio.run(go()) == [True, False, False, True]
+    assert not main.flood_warnings
+
+
+def test_commands_other_than_stop_are_limited(monkeypatch):
+    monkeypatch.setattr(main, 'flood', FloodControl(rate=1.0, burst=3, mute=60.0))
+    monkeypatch.setattr(main.settings, 'ADMIN_IDS', [])
+    warnings = []
+    monkeypatch.setattr(main, 'flood_warning', lambda bot, user_id, seconds: _noop(warnings.append(seconds)))
+
+    def update(text: str):
+        message = SimpleNamespace(from_user=SimpleNamespace(id=8), text=text, media_group_id=None)
+        return SimpleNamespace(message=message, edited_message=None, get_bot=lambda: None)
+
+    async def go():
+        results = [main.admit_update(update('/top')) for _ in range(5)]
+        results.append(main.admit_update(update('/stop@bot')))
+        await asyncio.sleep(0)
+        return results
+
+    assert asyncio.run(go()) == [True, True, True, False, False, True]
+    assert warnings == [60.0]
+
+
+async def _noop(*args) -> None:
+    pass
@@ -0,0 +1,52 @@
+import asyncio
+import re
+
+from httpserver import MAX_BODY_SIZE, HTTPServer
+
+
+async def echo(request) -> tuple:
+    return 200, 'text/plain', request.body
+
+
+def exchange(*chunks: bytes) -> list:
+    """Отправляет сырые байты серверу и возвращает статусы всех ответов"""
+    async def go():
+        server = HTTPServer('127.0.0.1', 0)
+        server.route('/hook', echo, methods=('POST',))
+        await server.start()
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.bound_port)
+        for chunk in chunks:
+            writer.write(chunk)
+        await writer.drain()
+        writer.write_eof()
+        response = await reader.read()
+        writer.close()
+        await server.stop()
+        return [int(status) for status in re.findall(rb'HTTP/1\.1 (\d{3}) ', response)]
+
+    return asyncio.run(go())
+
+
+def post(length: str, body: bytes = b'') -> bytes:
+    return b'POST /hook HTTP/1.1\r\nContent-Length: ' + length.encode() + b'\r\n\r\n' + body
+
+
+def test_keep_alive_serves_several_requests():
+    assert exchange(post('2', b'{}'), post('0'), b'GET /missing HTTP/1.1\r\n\r\n',
+                    b'GET /hook HTTP/1.1\r\n\r\n') == [200, 200, 404, 405]
+
+
+def test_bad_content_length_is_400():
+    assert exchange(post('abc')) == [400]
+    assert exchange(post('-1')) == [400]
+    assert exchange('٣'.encode('utf-8').join([b'POST /hook HTTP/1.1\r\nContent-Length: ', b'\r\n\r\n'])) == [400]
+
+
+def test_too_large_body_is_413():
+    assert exchange(post(str(MAX_BODY_SIZE + 1))) == [413]
+
+
+def test_bad_request_line_and_long_header_are_400():
+    assert exchange(b'garbage\r\n\r\n') == [400]
+    assert exchange(b'POST /hook HTTP/1.1\r\nX-Long: ' + b'a' * 100_000 + b'\r\n\r\n') == [400]
+    assert exchange(b'POST /hook HTTP/1.1\r\n' + b'X-A: 1\r\n' * 200 + b'\r\n') == [400]
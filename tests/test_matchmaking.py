@@ -0,0 +1,110 @@
+from matchmaking import BatchMatcher, MatchQueue
+
+AGES = ['a', 'b', 'c', 'd']
+
+
+def test_longest_waiting_compatible_partner():
+    queue = MatchQueue()
+    queue.add(1, 'male', 'male')
+    queue.add(2, 'female', None)
+    queue.add(3, 'female', 'male')
+    queue.add(4, 'male', 'female')
+    # 1 ищет парней - 4 ему не пара; 2 подходит 4 и ждет дольше 3
+    assert queue.pop_match(4).user_id == 2
+    assert 2 not in queue and 4 not in queue and len(queue) == 2
+    assert queue.find(3) is None
+
+
+def test_filters_apply_both_ways():
+    queue = MatchQueue()
+    queue.add(1, 'female', 'female')
+    queue.add(2, 'male', None)
+    assert queue.find(2) is None
+    queue.add(3, 'female', None)
+    assert queue.find(2).user_id == 3
+
+
+def test_readd_moves_to_back_and_discard():
+    queue = MatchQueue()
+    queue.add(1, 'male', None)
+    queue.add(2, 'male', None)
+    queue.add(1, 'male', None)
+    queue.add(3, 'female', None)
+    assert queue.find(3).user_id == 2
+    assert [entry.user_id for entry in queue] == [2, 1, 3]
+    assert queue.counts() == {('male', None): 2, ('female', None): 1}
+    queue.discard(2)
+    queue.discard(42)
+    assert queue.find(3).user_id == 1
+
+
+def test_take_stale_in_queue_order():
+    queue = MatchQueue()
+    for user_id in (1, 2, 3):
+        queue.add(user_id, 'male', None)
+    entries = {entry.user_id: entry for entry in queue}
+    entries[1].since, entries[2].since, entries[3].since = 0.0, 5.0, 20.0
+    assert [entry.user_id for entry in queue.take_stale(10.0, now=20.0)] == [1, 2]
+    assert len(queue) == 1 and 3 in queue
+
+
+def batch_queue(**options) -> MatchQueue:
+    return MatchQueue(BatchMatcher(AGES, country_weight=2, age_weight=2, relax_step=10.0, **options))
+
+
+def set_since(queue: MatchQueue, since: float) -> None:
+    for entry in queue:
+        entry.since = since
+
+
+def test_score_and_relaxation():
+    matcher = BatchMatcher(AGES, country_weight=2, age_weight=2, relax_step=10.0)
+    assert matcher.score(('male', None, 'RU', 'a'), ('female', None, 'RU', 'a')) == 4
+    assert matcher.score(('male', None, 'RU', 'a'), ('female', None, 'US', 'b')) == 1
+    assert matcher.score(('male', None, None, 'a'), ('female', None, None, 'd')) == 0
+    assert [matcher.required(wait) for wait in (0, 9, 10, 25, 100)] == [4, 4, 3, 2, 0]
+
+
+def test_batch_prefers_best_score_over_waiting_time():
+    queue = batch_queue()
+    queue.add(1, 'male', 'female', country='RU', age='a')
+    queue.add(2, 'female', None, country='US', age='d')
+    queue.add(3, 'female', None, country='RU', age='a')
+    set_since(queue, 0.0)
+    pairs = queue.take_batch(now=0.0)
+    assert [(entry.user_id, partner.user_id, score) for entry, partner, score in pairs] == [(1, 3, 4)]
+    assert list(queue.counts()) == [('female', None)] and 2 in queue
+
+
+def test_batch_relaxes_with_waiting_time():
+    queue = batch_queue()
+    queue.add(1, 'male', None, country='RU', age='a')
+    queue.add(2, 'female', None, country='US', age='d')
+    set_since(queue, 0.0)
+    assert queue.take_batch(now=5.0) == []
+    pairs = queue.take_batch(now=40.0)
+    assert [(entry.user_id, partner.user_id, score) for entry, partner, score in pairs] == [(1, 2, 0)]
+    assert len(queue) == 0
+
+
+def test_batch_respects_gender_filters():
+    queue = batch_queue()
+    queue.add(1, 'male', 'male', country='RU', age='a')
+    queue.add(2, 'female', None, country='RU', age='a')
+    queue.add(3, 'male', 'female', country='RU', age='a')
+    set_since(queue, 0.0)
+    pairs = queue.take_batch(now=100.0)
+    assert [(entry.user_id, partner.user_id) for entry, partner, score in pairs] == [(2, 3)]
+    assert 1 in queue
+
+
+def test_batch_leaves_budget_for_found_pairs():
+    queue = batch_queue(budget=0.05)
+    for user_id in range(1000):
+        queue.add(user_id, ('male', 'female')[user_id % 2], None, country='RU', age='a')
+    set_since(queue, 0.0)
+    # Каждой паре нужно больше всего бюджета: подбор останавливается на первой проверке
+    pairs = queue.take_batch(now=0.0, pair_cost=1.0)
+    assert 0 < len(pairs) <= 64 and len(queue) == 1000 - 2 * len(pairs)
+    waiting = len(queue)
+    assert len(queue.take_batch(now=0.0)) == waiting // 2
@@ -0,0 +1,44 @@
+import message_map
+from message_map import MessageMap
+
+
+def test_get_and_update():
+    mapping = MessageMap()
+    mapping.put(10, 110)
+    mapping.put(12, 112)
+    assert mapping.get(10) == 110 and mapping.get(12) == 112
+    assert mapping.get(11) is None and 11 not in mapping
+    mapping.put(10, 210)
+    assert mapping.get(10) == 210 and len(mapping) == 2
+
+
+def test_out_of_order_put_keeps_keys_sorted():
+    mapping = MessageMap()
+    for key in (5, 9, 7, 6, 8):
+        mapping.put(key, key * 10)
+    assert [mapping.get(key) for key in range(5, 10)] == [50, 60, 70, 80, 90]
+    assert mapping.oldest_key() == 5
+
+
+def test_window_evicts_oldest_and_compacts():
+    mapping = MessageMap(window=100)
+    compacted = [mapping.put(key, -key) for key in range(1, 1001)]
+    assert len(mapping) == 100
+    assert mapping.oldest_key() == 901
+    assert mapping.get(900) is None and mapping.get(901) == -901 and mapping.get(1000) == -1000
+    # Мертвая часть массивов не растет бесконечно
+    assert any(compacted) and len(mapping._keys) <= 2 * 100 + 64
+
+
+def test_ttl_hides_and_evicts_old_entries(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(message_map.time, 'time', lambda: now[0])
+    mapping = MessageMap(ttl=60)
+    mapping.put(1, 101)
+    now[0] += 30
+    mapping.put(2, 102)
+    now[0] += 40
+    # Запись 1 старше ttl: не находится, хотя еще не вытеснена
+    assert mapping.get(1) is None and mapping.get(2) == 102
+    mapping.put(3, 103)
+    assert len(mapping) == 2 and mapping.oldest_key() == 2
@@ -0,0 +1,24 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram.ext import TypeHandler
+
+import main
+from storage import MemoryStore
+
+
+def test_any_update_clears_unreachable(monkeypatch):
+    store = MemoryStore()
+    monkeypatch.setattr(main, 'store', store)
+    store.set_unreachable(7, True)
+    # Правка, ответ или /top - не только /start и поиск
+    asyncio.run(main.track_reachable(SimpleNamespace(effective_user=SimpleNamespace(id=7)), None))
+    assert not store.is_unreachable(7)
+    asyncio.run(main.track_reachable(SimpleNamespace(effective_user=None), None))
+
+
+def test_tracking_runs_before_all_handlers():
+    application = main.build_application('123456:TEST', serve_mode='polling')
+    first = application.handlers[min(application.handlers)]
+    assert any(isinstance(handler, TypeHandler) and handler.callback.__wrapped__ is main.track_reachable
+               for handler in first)
@@ -0,0 +1,84 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+from storage import MemoryStore
+
+
+def test_parse_registration_steps():
+    assert main.parse_registration('reg:male') == ('male', None, None)
+    assert main.parse_registration('reg:female:0') == ('female', main.COUNTRIES[0], None)
+    assert main.parse_registration('reg:male:00:1') == ('male', main.COUNTRIES[0], main.AGE_GROUPS[1])
+
+
+@pytest.mark.parametrize('data', [
+    'reg', 'reg:other', 'reg:male:', 'reg:male:-1', 'reg:male:²', 'reg:male:٣',
+    f'reg:male:{len(main.COUNTRIES)}', 'reg:male:0:99', 'reg:male:0:0:0',
+])
+def test_parse_registration_rejects(data):
+    assert main.parse_registration(data) is None
+
+
+class Query:
+    def __init__(self, data: str):
+        self.data = data
+        self.from_user = SimpleNamespace(id=5)
+        self.message = SimpleNamespace(chat=SimpleNamespace(id=5), message_id=1)
+        self.answers = []
+
+    async def answer(self, text: str = None):
+        self.answers.append(text)
+
+
+class Sender:
+    def __init__(self):
+        self.calls = []
+
+    async def call(self, bot, method, priority, **kwargs):
+        self.calls.append((method, kwargs))
+
+
+def tap(data: str) -> tuple:
+    query = Query(data)
+    asyncio.run(main.registration(SimpleNamespace(callback_query=query), SimpleNamespace(bot=None)))
+    return query
+
+
+@pytest.fixture
+def bot_state(monkeypatch):
+    state = SimpleNamespace(store=MemoryStore(), sender=Sender(), events=[], notices=[])
+    monkeypatch.setattr(main, 'store', state.store)
+    monkeypatch.setattr(main, 'sender', state.sender)
+    monkeypatch.setattr(main.event_log, 'emit', lambda kind, user_id, *args: state.events.append(kind))
+
+    async def notify(context, chat_id, text, reply_markup=None):
+        state.notices.append(text)
+
+    monkeypatch.setattr(main, 'notify', notify)
+    return state
+
+
+def test_age_step_accepts_normalized_country(bot_state):
+    tap('reg:male:00')
+    method, kwargs = bot_state.sender.calls[0]
+    assert method == 'edit_message_text'
+    assert kwargs['reply_markup'] is main.AGE_KEYBOARDS['reg:male:0']
+
+
+def test_stale_button_is_answered(bot_state):
+    assert tap('reg:male:x').answers == ["Кнопка устарела, отправьте /start"]
+    assert not bot_state.sender.calls
+
+
+def test_double_tap_registers_once(bot_state):
+    tap('reg:female:1:2')
+    tap('reg:female:1:2')
+    assert bot_state.store.get_user(5) == {'gender': 'female', 'country': main.COUNTRIES[1],
+                                           'age': main.AGE_GROUPS[2]}
+    assert bot_state.events == [main.events.REGISTERED]
+    assert len(bot_state.notices) == 1
+    # Другой выбор - это изменение профиля
+    tap('reg:female:1:3')
+    assert bot_state.events == [main.events.REGISTERED] * 2
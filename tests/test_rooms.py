@@ -0,0 +1,106 @@
+import asyncio
+from itertools import count
+from types import SimpleNamespace
+
+import pytest
+
+import main
+from rooms import RoomDirectory
+from sender import SendScheduler
+
+_ids = count(1000)
+
+
+class Bot:
+    """Запоминает запросы по чатам; каждый отвечает с задержкой"""
+
+    def __init__(self):
+        self.chats = {}
+
+    async def _record(self, chat_id: int, entry: tuple):
+        await asyncio.sleep(0.02)
+        message_id = next(_ids)
+        self.chats.setdefault(chat_id, []).append((*entry, message_id))
+        return SimpleNamespace(message_id=message_id)
+
+    async def send_message(self, chat_id: int, text: str, reply_to_message_id: int = None, **kwargs):
+        return await self._record(chat_id, ('text', text, reply_to_message_id))
+
+    async def copy_message(self, chat_id: int, from_chat_id: int, message_id: int, reply_to_message_id: int = None,
+                           **kwargs):
+        return await self._record(chat_id, ('copy', message_id, reply_to_message_id))
+
+
+def message(user_id: int, message_id: int, text: str = None, sticker: bool = False, reply_to: int = None):
+    fields = dict.fromkeys(('caption', 'photo', 'video', 'document', 'audio', 'voice', 'animation', 'video_note',
+                            'media_group_id'))
+    return SimpleNamespace(
+        **fields, message_id=message_id, chat_id=user_id, chat=SimpleNamespace(id=user_id), text=text,
+        sticker=SimpleNamespace(file_id='s') if sticker else None, entities=(), caption_entities=(),
+        reply_to_message=SimpleNamespace(message_id=reply_to) if reply_to else None)
+
+
+@pytest.fixture
+def room(monkeypatch):
+    bot = Bot()
+    # run() ставит свой планировщик: после теста вернется прежний
+    monkeypatch.setattr(main, 'sender', main.sender)
+    monkeypatch.setattr(main, 'rooms', RoomDirectory(('Комната',), capacity=10))
+    for user_id in (1, 2, 3):
+        main.rooms.join(user_id, 1)
+    return bot, SimpleNamespace(bot=bot, application=SimpleNamespace(create_task=asyncio.ensure_future))
+
+
+def run(coroutine_factory):
+    async def go():
+        main.sender = SendScheduler(global_rate=1e6, global_burst=1e6, chat_rate=1e6, chat_burst=1e6)
+        try:
+            await coroutine_factory()
+            await asyncio.sleep(0.3)
+        finally:
+            await main.sender.close()
+
+    asyncio.run(go())
+
+
+def test_header_and_sticker_stay_together(room):
+    bot, context = room
+
+    async def posts():
+        main.post_to_room(context, 1, [message(1, 10, sticker=True)])
+        # Следующий пост приходит, пока заголовок первого еще в пути
+        await asyncio.sleep(0.005)
+        main.post_to_room(context, 2, [message(2, 20, text='привет')])
+
+    run(posts)
+    assert [entry[:2] for entry in bot.chats[3]] == [('text', '👤 1'), ('copy', 10), ('text', '👤 2: привет')]
+
+
+def test_captionless_copy_keeps_reply(room):
+    bot, context = room
+
+    async def posts():
+        main.post_to_room(context, 2, [message(2, 20, text='вопрос')])
+        await asyncio.sleep(0.1)
+        copy_at_1 = bot.chats[1][0][-1]
+        main.post_to_room(context, 1, [message(1, 11, sticker=True, reply_to=copy_at_1)])
+
+    run(posts)
+    header, copy = bot.chats[3][1:]
+    # В чате 3 ответ ведет на его копию сообщения 20
+    assert header[:3] == ('text', '👤 1', None)
+    assert copy[:3] == ('copy', 11, bot.chats[3][0][-1])
+
+
+@pytest.mark.parametrize('data', ['room:²', 'room:٣', 'room:x', 'room:'])
+def test_join_room_rejects_bad_button(room, monkeypatch, data):
+    answers = []
+
+    async def answer(text: str = None):
+        answers.append(text)
+
+    monkeypatch.setattr(main, 'store', main.MemoryStore())
+    main.store.save_user(4, {'gender': 'male', 'country': 'Россия', 'age': 'от 18 до 21 года'})
+    query = SimpleNamespace(from_user=SimpleNamespace(id=4), data=data, answer=answer)
+    asyncio.run(main.join_room(SimpleNamespace(callback_query=query), room[1]))
+    assert answers == ["Кнопка устарела"] and main.rooms.room_of(4) is None
@@ -0,0 +1,60 @@
+import pytest
+
+from sharding import RemoteStore, SharedState, StateConnection, shard_of
+from storage import MemoryStore
+
+
+def message(user_id: int) -> dict:
+    return {'update_id': 1, 'message': {'message_id': 1, 'from': {'id': user_id}, 'text': 'hi'}}
+
+
+def test_dialogue_partners_share_a_shard():
+    partners = {10: 13, 13: 10}
+    assert shard_of(message(10), 4, partners.get) == shard_of(message(13), 4, partners.get) == 10 % 4
+    assert shard_of(message(7), 4, partners.get) == 3
+    assert shard_of({'update_id': 1}, 4, partners.get) == 0
+
+
+@pytest.fixture
+def workers():
+    """Два воркера с общим состоянием в одном процессе, без менеджера"""
+    stores = {}
+    state = SharedState(MemoryStore(), invalidate=lambda users, origin: [
+        stores[index].forget(users) for index in stores if index != origin])
+    connections = [StateConnection(state, index) for index in range(2)]
+    stores.update({index: RemoteStore(connection) for index, connection in enumerate(connections)})
+    yield state, stores
+    for connection in connections:
+        connection.close()
+
+
+def test_cache_is_invalidated_by_other_workers(workers):
+    state, stores = workers
+    assert stores[0].get_partner(1) is None
+    stores[1].link(1, 2)
+    assert stores[0].get_partner(1) == 2
+    calls = state.calls['store.get_partner']
+    # Повторное чтение - из кэша воркера
+    assert stores[0].get_partner(1) == 2 and state.calls['store.get_partner'] == calls
+    assert stores[1].unlink(2) == 1
+    assert stores[0].get_partner(1) is None and stores[0].get_partner(2) is None
+
+
+def test_posted_writes_land_before_next_read(workers):
+    state, stores = workers
+    stores[0].link(1, 2)
+    for message_id in range(100):
+        stores[0].map_message(1, message_id, 1000 + message_id)
+    assert stores[0].get_mapped(1, 99) == 1099
+    assert state.calls['store.map_message'] == 100
+
+
+def test_unreachable_flag_is_cached_and_invalidated(workers):
+    state, stores = workers
+    assert not stores[0].is_unreachable(5)
+    stores[1].set_unreachable(5, True)
+    assert stores[0].is_unreachable(5)
+    calls = state.calls['store.is_unreachable']
+    assert stores[0].is_unreachable(5) and state.calls['store.is_unreachable'] == calls
+    stores[1].set_unreachable(5, False)
+    assert not stores[0].is_unreachable(5)
@@ -0,0 +1,146 @@
+import sqlite3
+import threading
+
+import pytest
+
+from storage import MemoryStore, SQLiteStore
+
+PROFILE = {'gender': 'male', 'country': 'Россия', 'age': 'от 18 до 21 года'}
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    store = SQLiteStore(tmp_path / 'bot.sqlite3', flush_interval=0.001, user_cache_size=10)
+    store.open()
+    yield store
+    store.close()
+
+
+def test_pending_profile_survives_cache_eviction(sqlite_store):
+    for user_id in range(1, 31):
+        sqlite_store.save_user(user_id, PROFILE)
+    # Кэш на 10 профилей, но еще не записанные читаются из памяти, а записанные - из базы
+    assert sqlite_store.get_user(1) == PROFILE
+    sqlite_store.flush()
+    assert sqlite_store._pending_ids() == []
+    assert sqlite_store.get_user(2) == PROFILE
+
+
+def test_user_ids_and_count_include_pending(sqlite_store):
+    for user_id in (5, 1, 3):
+        sqlite_store.save_user(user_id, PROFILE)
+    sqlite_store.set_unreachable(3, True)
+    assert sqlite_store.user_ids(0, 10) == [1, 5]
+    assert sqlite_store.count_users() == 2
+    sqlite_store.flush()
+    assert sqlite_store.user_ids(0, 10) == [1, 5]
+    assert sqlite_store.user_ids(1, 10) == [5]
+    assert sqlite_store.count_users() == 2
+
+
+def test_listing_users_while_writer_flushes(sqlite_store):
+    errors = []
+    stop = threading.Event()
+
+    def register() -> None:
+        try:
+            for user_id in range(1, 3001):
+                sqlite_store.save_user(user_id, PROFILE)
+        finally:
+            stop.set()
+
+    writer = threading.Thread(target=register)
+    writer.start()
+    try:
+        while not stop.is_set():
+            sqlite_store.user_ids(0, 100)
+            sqlite_store.count_users()
+    except RuntimeError as e:
+        errors.append(e)
+    writer.join()
+    assert errors == []
+    sqlite_store.flush()
+    assert sqlite_store.count_users() == 3000
+
+
+def test_reopen_restores_state(tmp_path):
+    store = SQLiteStore(tmp_path / 'bot.sqlite3', flush_interval=0.001)
+    store.open()
+    store.save_user(1, PROFILE)
+    store.save_user(2, {**PROFILE, 'gender': 'female'})
+    store.link(1, 2)
+    store.map_message(1, 10, 20)
+    store.close()
+
+    store = SQLiteStore(tmp_path / 'bot.sqlite3')
+    store.open()
+    try:
+        assert store.get_partner(1) == 2
+        assert store.get_mapped(1, 10) == 20
+        assert store.count_profiles()[store.get_user(2)] == 1
+    finally:
+        store.close()
+
+
+class FlakyConnection:
+    """Соединение, у которого первые failures коммитов завершаются ошибкой 'database is locked'"""
+
+    def __init__(self, conn: sqlite3.Connection, failures: int):
+        self._conn = conn
+        self.failures = failures
+
+    def execute(self, sql: str, params: tuple = ()):
+        if sql == "COMMIT" and self.failures:
+            self.failures -= 1
+            error = sqlite3.OperationalError("database is locked")
+            error.sqlite_errorcode = sqlite3.SQLITE_BUSY
+            raise error
+        return self._conn.execute(sql, params)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def test_failed_batch_is_retried(tmp_path, monkeypatch):
+    store = SQLiteStore(tmp_path / 'bot.sqlite3', flush_interval=0.001, user_cache_size=2)
+    store.open()
+    connect = store._connect
+    monkeypatch.setattr(store, '_connect', lambda: FlakyConnection(connect(), failures=3))
+    # Поток записи уже открыл свое соединение: перезапускаем его с ненадежным
+    store.close()
+    store.open()
+    for user_id in range(1, 11):
+        store.save_user(user_id, PROFILE)
+    store.link(1, 2)
+    # Пока запись не прошла, вытесненные из кэша профили читаются из памяти
+    assert store.get_user(1) == PROFILE and store.count_users() == 10
+    store.flush()
+    assert store._pending_ids() == []
+    store.close()
+
+    store = SQLiteStore(tmp_path / 'bot.sqlite3')
+    store.open()
+    try:
+        assert store.count_users() == 10 and store.get_partner(1) == 2
+    finally:
+        store.close()
+
+
+def test_bad_write_does_not_drop_the_batch(sqlite_store):
+    sqlite_store.save_user(1, PROFILE)
+    sqlite_store._write("INSERT INTO missing_table VALUES (?)", (1,))
+    sqlite_store.save_user(2, PROFILE)
+    sqlite_store.flush()
+    assert sqlite_store._pending_ids() == []
+    assert sqlite_store._reader.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 2
+
+
+def test_memory_store_user_ids_pages_in_order():
+    store = MemoryStore()
+    for user_id in (9, 2, 7, 4, 1):
+        store.save_user(user_id, PROFILE)
+    store.set_unreachable(4, True)
+    assert store.user_ids(0, 2) == [1, 2]
+    assert store.user_ids(2, 2) == [7, 9]
+    assert store.user_ids(9, 2) == []
+    assert store.count_users() == 4
@@ -0,0 +1,58 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+import main
+from benchmarks.fake_bot_api import FakeBotAPI
+from sender import SendScheduler
+from storage import MemoryStore
+from webhook import SECRET_HEADER, start_webhook
+
+TOKEN = '123456:WEBHOOK'
+
+
+def start_update(user_id: int) -> dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+    return {'update_id': 1, 'message': {
+        'message_id': 1, 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'}, 'from': user,
+        'text': '/start', 'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]}}
+
+
+@pytest.mark.parametrize('url', [None, 'https://bot.example.com/telegram'])
+def test_update_goes_through_webhook(monkeypatch, url):
+    monkeypatch.setattr(main.settings, 'WEBHOOK_PORT', 0)
+    monkeypatch.setattr(main.settings, 'WEBHOOK_SECRET', 'secret')
+    monkeypatch.setattr(main.settings, 'WEBHOOK_URL', url)
+    monkeypatch.setattr(main, 'store', MemoryStore())
+    monkeypatch.setattr(main, 'sender', main.sender)
+
+    async def go():
+        main.sender = SendScheduler(global_rate=1e6, global_burst=1e6, chat_rate=1e6, chat_burst=1e6)
+        api = FakeBotAPI(TOKEN)
+        await api.start()
+        application = main.build_application(TOKEN, base_url=api.url, serve_mode='webhook')
+        async with application:
+            await application.start()
+            server = await start_webhook(application, main.ALLOWED_UPDATES)
+            hook = f"http://127.0.0.1:{server.bound_port}{main.settings.WEBHOOK_PATH}"
+            async with httpx.AsyncClient() as client:
+                forged = await client.post(hook, content=json.dumps(start_update(8)))
+                response = await client.post(hook, content=json.dumps(start_update(7)),
+                                             headers={SECRET_HEADER: 'secret'})
+            reply = await asyncio.wait_for(api.inbox(7).get(), 5)
+            await server.stop()
+            await application.stop()
+        await main.sender.close()
+        await api.stop()
+        return forged.status_code, response.status_code, reply, api.calls
+
+    forged, status, reply, calls = asyncio.run(go())
+    assert (forged, status) == (403, 200)
+    assert reply.method == 'sendMessage'
+    assert reply.params['reply_markup']['inline_keyboard'][0][0]['callback_data'] == 'reg:male'
+    # Без публичного URL вебхук не регистрируется: PTB подставил бы адрес WEBHOOK_LISTEN
+    assert calls['setWebhook'] == (1 if url else 0)
+    assert calls['getUpdates'] == 0
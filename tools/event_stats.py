@@ -0,0 +1,42 @@
+"""
+Отчет по журналу событий чатов (events.EventLog): сколько диалогов в час,
+сколько они длятся и чем заканчиваются.
+
+Сегменты читаются через mmap и не загружаются в память целиком, поэтому
+отчет по сотням миллионов событий строится за секунды. Можно указать
+каталог целиком или отдельные сегменты (например, за один день).
+
+Запуск:
+    python tools/event_stats.py data/events
+    python tools/event_stats.py data/events/events-20260101*.events
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from events import EventStats, segments
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help='каталог журнала или файлы сегментов')
+    args = parser.parse_args()
+
+    paths = []
+    for path in map(Path, args.paths):
+        paths += segments(path) if path.is_dir() else [path]
+    start = time.perf_counter()
+    stats = EventStats()
+    for path in paths:
+        stats.add_segment(path)
+    elapsed = time.perf_counter() - start
+    print(stats.report())
+    print(f"\nСегментов {len(paths)}, прочитано за {elapsed:.2f} с", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Локальный стенд для режима вебхука: отправляет записанные обновления
+Telegram POST-запросами на вебхук бота, как это делает сам Telegram.
+
+Файл с обновлениями - JSON Lines, по одному объекту Update на строку.
+
+Запуск:
+    python tools/replay_updates.py tools/sample_updates.jsonl \\
+        --url http://127.0.0.1:8443/telegram --secret <WEBHOOK_SECRET>
+"""
+import argparse
+import json
+import sys
+import time
+import urllib.error
+import urllib.request
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def post_update(url: str, secret: str, update: dict) -> int:
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode(),
+        headers={'Content-Type': 'application/json', SECRET_HEADER: secret},
+        method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('updates', help='файл JSON Lines с обновлениями')
+    parser.add_argument('--url', default='http://127.0.0.1:8443/telegram')
+    parser.add_argument('--secret', required=True)
+    parser.add_argument('--delay', type=float, default=0.0, help='пауза между обновлениями, секунды')
+    args = parser.parse_args()
+
+    failed = 0
+    with open(args.updates, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            update = json.loads(line)
+            status = post_update(args.url, args.secret, update)
+            print(f"update_id={update.get('update_id')}: HTTP {status}")
+            failed += status != 200
+            if args.delay:
+                time.sleep(args.delay)
+
+    # Неверный секрет должен отклоняться
+    status = post_update(args.url, args.secret + '-wrong', {'update_id': 0})
+    print(f"неверный секрет: HTTP {status}")
+    failed += status != 403
+
+    print("OK" if not failed else f"ошибок: {failed}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+import asyncio
+import time
+
+import httpx
+from telegram.error import TimedOut
+from telegram.request import BaseRequest, HTTPXRequest
+
+import metrics
+
+# Методы с загрузкой медиа: у них свой пул, чтобы долгая отправка видео
+# не занимала соединения, через которые идет пересылка текста
+MEDIA_METHODS = frozenset({
+    'sendPhoto', 'sendVideo', 'sendDocument', 'sendAudio', 'sendVoice', 'sendAnimation',
+    'sendVideoNote', 'sendMediaGroup', 'editMessageMedia',
+})
+
+
+class Pool:
+    """
+    Пул соединений httpx с заданным размером и keep-alive.
+
+    httpcore при каждом запросе перебирает все соединения своего пула и
+    проверяет их сокеты, поэтому большой пул дорог по процессору. Здесь пул
+    из size соединений собран из нескольких клиентов httpx по stripe_size
+    соединений, и запрос уходит в наименее занятый. Запросы сверх size
+    ждут в очереди перед пулом, а не внутри httpcore.
+
+    pool_timeout - сколько ждать свободного соединения, keepalive - сколько
+    простаивающих соединений держать открытыми (по умолчанию все)
+    """
+
+    def __init__(self, size: int, keepalive: int = None, keepalive_expiry: float = 30.0, http_version: str = '1.1',
+                 connect_timeout: float = 5.0, read_timeout: float = 5.0, write_timeout: float = 5.0,
+                 pool_timeout: float = 1.0, stripe_size: int = 8):
+        self.size = size
+        self.pool_timeout = pool_timeout
+        stripes = -(-size // stripe_size)
+        per_stripe = -(-size // stripes)
+        keepalive = per_stripe if keepalive is None else min(per_stripe, -(-keepalive // stripes))
+        limits = httpx.Limits(
+            max_connections=per_stripe, max_keepalive_connections=keepalive, keepalive_expiry=keepalive_expiry)
+        self.requests = [
+            HTTPXRequest(
+                connection_pool_size=per_stripe, http_version=http_version,
+                connect_timeout=connect_timeout, read_timeout=read_timeout, write_timeout=write_timeout,
+                pool_timeout=pool_timeout, httpx_kwargs={'limits': limits})
+            for _ in range(stripes)]
+        self._load = [0] * stripes
+        self._slots = asyncio.Semaphore(size)
+        self.in_flight = 0
+        # Сколько запросов ждали свободного соединения
+        self.saturated = 0
+
+    @property
+    def read_timeout(self):
+        return self.requests[0].read_timeout
+
+    async def acquire(self, timeout: float) -> None:
+        if not self._slots.locked():
+            await self._slots.acquire()
+            return
+        self.saturated += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            # Как у HTTPXRequest: запрос точно не ушел, планировщик отправки его повторит
+            raise TimedOut("Pool timeout: все соединения пула заняты") from httpx.PoolTimeout(None)
+
+    async def send(self, *args, **kwargs):
+        """Выполняет запрос на соединении, занятом acquire, и освобождает его"""
+        stripe = min(range(len(self._load)), key=self._load.__getitem__)
+        self._load[stripe] += 1
+        self.in_flight += 1
+        try:
+            return await self.requests[stripe].do_request(*args, **kwargs)
+        finally:
+            self.in_flight -= 1
+            self._load[stripe] -= 1
+            self._slots.release()
+
+
+class PooledRequest(BaseRequest):
+    """
+    Транспорт PTB из нескольких пулов соединений.
+
+    pools - {имя: Pool}; запрос уходит в пул route(метод) (по умолчанию -
+    первый). Если вызывающий не задал таймауты явно, для методов из
+    method_timeouts чтение и запись ограничиваются своим значением
+    """
+
+    def __init__(self, pools: dict, route=None, method_timeouts: dict = None):
+        self.pools = pools
+        self.route = route or (lambda method: next(iter(pools)))
+        self.method_timeouts = method_timeouts or {}
+
+    @property
+    def read_timeout(self):
+        return next(iter(self.pools.values())).read_timeout
+
+    @property
+    def saturated(self) -> dict:
+        return {name: pool.saturated for name, pool in self.pools.items()}
+
+    async def initialize(self) -> None:
+        for pool in self.pools.values():
+            for request in pool.requests:
+                await request.initialize()
+
+    async def shutdown(self) -> None:
+        for pool in self.pools.values():
+            for request in pool.requests:
+                await request.shutdown()
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        api_method = url.rsplit('/', 1)[-1]
+        timeout = self.method_timeouts.get(api_method)
+        if timeout is not None:
+            if read_timeout is BaseRequest.DEFAULT_NONE:
+                read_timeout = timeout
+            if write_timeout is BaseRequest.DEFAULT_NONE:
+                write_timeout = timeout
+
+        name = self.route(api_method)
+        pool = self.pools[name]
+        start = time.perf_counter()
+        await pool.acquire(pool.pool_timeout if pool_timeout is BaseRequest.DEFAULT_NONE else pool_timeout)
+        metrics.http_pool_wait.observe(time.perf_counter() - start, name)
+        return await pool.send(
+            url, method, request_data, read_timeout=read_timeout, write_timeout=write_timeout,
+            connect_timeout=connect_timeout, pool_timeout=pool_timeout)
+
+    def register_gauges(self) -> None:
+        for name, pool in self.pools.items():
+            metrics.REGISTRY.gauge(f'bot_http_{name}_pool_size', f'Соединений в пуле {name}',
+                                   lambda pool=pool: pool.size)
+            metrics.REGISTRY.gauge(f'bot_http_{name}_pool_in_flight', f'Запросов в работе в пуле {name}',
+                                   lambda pool=pool: pool.in_flight)
+            metrics.REGISTRY.gauge(f'bot_http_{name}_pool_saturated_total',
+                                   f'Запросов, ждавших свободного соединения в пуле {name}',
+                                   lambda pool=pool: pool.saturated, kind='counter')
+
+
+def route_media(method: str) -> str:
+    return 'media' if method in MEDIA_METHODS else 'send'
@@ -0,0 +1,67 @@
+import hmac
+import json
+import logging
+
+from telegram import Update
+from telegram.ext import Application
+
+import settings
+from httpserver import HTTPServer, Request
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+
+def make_webhook_handler(secret_token: str, deliver):
+    """
+    Обработчик POST-запросов от Telegram: проверка секрета и передача
+    разобранного JSON в deliver(data). deliver возвращает False, если
+    обновление не удалось принять.
+
+    Координатор шардов передает обновления воркерам как есть, один
+    процесс - в очередь своего Application (start_webhook)
+    """
+    expected = secret_token.encode()
+
+    async def handle(request: Request) -> tuple:
+        received = request.headers.get(SECRET_HEADER, '').encode()
+        if not hmac.compare_digest(received, expected):
+            logging.warning("Вебхук: запрос с неверным секретным токеном отклонен")
+            return 403, 'text/plain', b'forbidden'
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return 400, 'text/plain', b'bad json'
+        if not isinstance(data, dict) or await deliver(data) is False:
+            return 400, 'text/plain', b'bad update'
+        return 200, 'text/plain', b'ok'
+
+    return handle
+
+
+async def start_webhook(application: Application, allowed_updates: list = None) -> HTTPServer:
+    """
+    Вебхук одного процесса: сервер на WEBHOOK_LISTEN:WEBHOOK_PORT кладет
+    обновления в application.update_queue. setWebhook вызывается, только
+    если задан публичный WEBHOOK_URL - иначе его регистрирует тот, кто
+    настраивает reverse proxy. Возвращает запущенный сервер
+    """
+    async def deliver(data: dict) -> bool:
+        try:
+            update = Update.de_json(data, application.bot)
+        except (KeyError, TypeError, ValueError) as e:
+            logging.warning(f"Вебхук: обновление не разобрано: {e}")
+            return False
+        await application.update_queue.put(update)
+        return True
+
+    server = HTTPServer(settings.WEBHOOK_LISTEN, settings.WEBHOOK_PORT)
+    server.route(settings.WEBHOOK_PATH, make_webhook_handler(settings.WEBHOOK_SECRET, deliver), methods=('POST',))
+    await server.start()
+    if settings.WEBHOOK_URL:
+        await application.bot.set_webhook(
+            url=settings.WEBHOOK_URL,
+            secret_token=settings.WEBHOOK_SECRET,
+            allowed_updates=allowed_updates,
+            max_connections=settings.WEBHOOK_MAX_CONNECTIONS)
+        logging.info(f"Вебхук зарегистрирован: {settings.WEBHOOK_URL}")
+    return server